@@ -1,6 +1,12 @@
+import json
 from django.contrib import admin
-from .models import UserProfile, ClientUser, Conversation, ConversationHistory 
+from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import path, reverse
+from django.utils.html import format_html
+from .models import UserProfile, ClientUser, Conversation, ConversationHistory, RequestProfile
 from .adminform import UserProfileForm
+from .utils.profiler import speedscope_profile
 from django.contrib.auth.models import User
 
 class UserProfileAdmin(admin.ModelAdmin):
@@ -46,9 +52,67 @@ class ConversationHistoryAdmin(admin.ModelAdmin):
     search_fields = ('conversation__session_id', 'user_text', 'assistant_text')
     ordering = ('-request_at',)
 
+class RequestProfileAdmin(admin.ModelAdmin):
+    list_display = ('request_id', 'created', 'requested_by', 'client_user_id', 'status_code',
+                    'duration_ms', 'sample_count', 'query_count', 'downloads')
+    search_fields = ('request_id', 'client_user_id', 'conversation_history__user_text')
+    list_filter = ('status_code',)
+    ordering = ('-created',)
+    readonly_fields = ('request_id', 'created', 'requested_by', 'client_user_id', 'conversation_history', 'path',
+                       'status_code', 'duration_ms', 'sample_interval_ms', 'sample_count', 'downloads',
+                       'collapsed_stacks', 'sql_queries')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    @admin.display(description='SQL queries')
+    def query_count(self, obj):
+        return len(obj.sql_queries or [])
+
+    @admin.display(description='Download')
+    def downloads(self, obj):
+        if obj.pk is None:
+            return '-'
+        return format_html(
+            '<a href="{}">speedscope</a> | <a href="{}">flamegraph</a>',
+            reverse('admin:chat_requestprofile_speedscope', args=[obj.pk]),
+            reverse('admin:chat_requestprofile_collapsed', args=[obj.pk]),
+        )
+
+    def get_urls(self):
+        custom = [
+            path('<int:pk>/speedscope/', self.admin_site.admin_view(self.speedscope_view),
+                 name='chat_requestprofile_speedscope'),
+            path('<int:pk>/collapsed/', self.admin_site.admin_view(self.collapsed_view),
+                 name='chat_requestprofile_collapsed'),
+        ]
+        return custom + super().get_urls()
+
+    def _download(self, request, pk, content, content_type, extension):
+        if not self.has_view_permission(request):
+            return HttpResponse(status=403)
+        response = HttpResponse(content, content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="profile-{pk}.{extension}"'
+        return response
+
+    def speedscope_view(self, request, pk):
+        obj = get_object_or_404(RequestProfile, pk=pk)
+        profile = speedscope_profile(obj.collapsed_stacks, obj.sample_interval_ms, f"{obj.path} {obj.request_id}")
+        return self._download(request, pk, json.dumps(profile), 'application/json', 'speedscope.json')
+
+    def collapsed_view(self, request, pk):
+        # flamegraph.pl / inferno input
+        obj = get_object_or_404(RequestProfile, pk=pk)
+        return self._download(request, pk, obj.collapsed_stacks, 'text/plain; charset=utf-8', 'folded')
+
+
 admin.site.register(UserProfile, UserProfileAdmin)
 admin.site.register(ClientUser,ClientUserAdmin)
 admin.site.register(Conversation,ConversationAdmin)
 admin.site.register(ConversationHistory,ConversationHistoryAdmin)
+admin.site.register(RequestProfile, RequestProfileAdmin)
 
 
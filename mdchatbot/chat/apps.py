@@ -4,3 +4,17 @@ from django.apps import AppConfig
 class ChatConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "chat"
+
+    def ready(self):
+        # Count DB queries on every connection for the metrics endpoint
+        from django.db.backends.signals import connection_created
+        from chat.middleware import install_query_counter
+
+        connection_created.connect(install_query_counter, dispatch_uid="chat-query-counter")
+
+        # Warm the retrieval stack in the background so serving processes become
+        # ready without blocking startup; management commands skip it entirely.
+        from chat.utils.lifecycle import lifecycle, should_warm_up
+
+        if should_warm_up():
+            lifecycle.start()
@@ -0,0 +1,214 @@
+import os
+import sys
+import json
+import time
+import resource
+import tempfile
+import subprocess
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.models import ConversationHistory
+from chat.utils.data_processor import EMBEDDING_BACKEND_TORCH, build_documents, load_local_embedding_model
+
+# Backends that can be benchmarked; "onnx-int8" is the quantized export
+BACKENDS = ("torch", "onnx", "onnx-int8")
+
+
+def _rss_mb() -> float:
+    with open("/proc/self/status", encoding="utf-8") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return round(int(line.split()[1]) / 1024, 1)
+    return 0.0
+
+
+def _load_backend(name: str, threads: int):
+    if name == EMBEDDING_BACKEND_TORCH:
+        if threads:
+            import torch
+
+            torch.set_num_threads(threads)
+        return load_local_embedding_model(EMBEDDING_BACKEND_TORCH)
+
+    from chat.utils.onnx_embeddings import OnnxEmbeddings
+
+    return OnnxEmbeddings(settings.EMBEDDING_ONNX_DIR, quantized=name == "onnx-int8", threads=threads)
+
+
+def _top_k(queries: np.ndarray, docs: np.ndarray, k: int) -> np.ndarray:
+    # Vectors are L2-normalized, so inner product ranks like the FAISS L2 index
+    return np.argsort(-(queries @ docs.T), axis=1)[:, :k]
+
+
+def _agreement(a: np.ndarray, b: np.ndarray) -> float:
+    """
+    Mean overlap of two top-k result lists (1.0 = same documents retrieved).
+    """
+    k = a.shape[1]
+    return round(float(np.mean([len(set(x) & set(y)) / k for x, y in zip(a, b)])), 4)
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare embedding backends (torch, onnx, onnx-int8) on this corpus: model load time, "
+        "per-query latency, batch throughput, RSS, and retrieval agreement with the first "
+        "backend — both against the existing index (vectors built by the first backend) and "
+        "against an index rebuilt with the backend's own vectors. Each backend runs in its "
+        "own process so RSS is measured in isolation."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--backends", default=",".join(BACKENDS),
+                            help="Comma-separated backends; the first is the reference")
+        parser.add_argument("--queries", type=int, default=200, help="Questions sampled from history")
+        parser.add_argument("--fixture", help="Question file: JSON list of strings, or one question per line")
+        parser.add_argument("--repeat", type=int, default=3, help="Timed passes over the questions")
+        parser.add_argument("--docs", type=int, default=0, help="Max corpus chunks embedded (0 = all)")
+        parser.add_argument("--threads", type=int, default=1,
+                            help="Threads per backend (0 = backend default); 1 matches a busy worker")
+        parser.add_argument("--top-k", type=int, default=5, help="Retrieval depth for agreement")
+        parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+        parser.add_argument("--worker", help="Internal: benchmark one backend in this process")
+        parser.add_argument("--workdir", help="Internal: input/output directory for --worker")
+
+    def load_questions(self, options, docs) -> list:
+        if options["fixture"]:
+            with open(options["fixture"], encoding="utf-8") as f:
+                raw = f.read()
+            try:
+                questions = json.loads(raw)
+            except json.JSONDecodeError:
+                questions = raw.splitlines()
+        else:
+            questions = list(
+                ConversationHistory.objects.exclude(user_text__isnull=True).exclude(user_text="")
+                .order_by("-request_at").values_list("user_text", flat=True)[:options["queries"]]
+            )
+        questions = [q.strip() for q in questions if isinstance(q, str) and q.strip()]
+        if not questions:
+            # No history yet: section titles are realistic short queries
+            questions = [d.metadata["section_title"] for d in docs if d.metadata.get("section_title")]
+        if not questions:
+            raise CommandError("No questions: ConversationHistory is empty and no --fixture was given")
+        return questions[:options["queries"]]
+
+    def handle(self, *args, **options):
+        if options["worker"]:
+            return self.run_worker(options["worker"], options)
+
+        backends = [b.strip() for b in options["backends"].split(",") if b.strip()]
+        unknown = set(backends) - set(BACKENDS)
+        if unknown or not backends:
+            raise CommandError(f"Unknown backends {sorted(unknown)}; choose from {', '.join(BACKENDS)}")
+
+        docs = build_documents()
+        if options["docs"]:
+            docs = docs[:options["docs"]]
+        questions = self.load_questions(options, docs)
+
+        results = {}
+        with tempfile.TemporaryDirectory(prefix="embedding-bench-") as workdir:
+            with open(os.path.join(workdir, "input.json"), "w", encoding="utf-8") as f:
+                json.dump({"queries": questions, "docs": [d.page_content for d in docs]}, f)
+
+            for backend in backends:
+                self.stderr.write(f"Benchmarking {backend} ({len(questions)} queries, {len(docs)} chunks)...")
+                command = [
+                    sys.executable, os.path.join(settings.BASE_DIR, "manage.py"), "benchmark_embeddings",
+                    "--worker", backend, "--workdir", workdir,
+                    "--repeat", str(options["repeat"]), "--threads", str(options["threads"]),
+                ]
+                completed = subprocess.run(command, capture_output=True, text=True)
+                if completed.returncode != 0:
+                    self.stderr.write(f"{backend} failed:\n{completed.stderr[-2000:]}")
+                    continue
+                with open(os.path.join(workdir, f"{backend}.json"), encoding="utf-8") as f:
+                    results[backend] = json.load(f)
+                results[backend]["vectors"] = np.load(os.path.join(workdir, f"{backend}.npz"))
+
+            if not results:
+                raise CommandError("No backend could be benchmarked")
+
+            reference_name = next(iter(results))
+            reference = results[reference_name]["vectors"]
+            k = min(options["top_k"], reference["docs"].shape[0])
+            reference_hits = _top_k(reference["queries"], reference["docs"], k)
+            for name, result in results.items():
+                vectors = result.pop("vectors")
+                a, b = reference["queries"], vectors["queries"]
+                cosine = (a * b).sum(axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1))
+                result["agreement"] = {
+                    "query_cosine_mean": round(float(cosine.mean()), 6),
+                    "query_cosine_min": round(float(cosine.min()), 6),
+                    f"top{k}_existing_index": _agreement(reference_hits, _top_k(vectors["queries"], reference["docs"], k)),
+                    f"top{k}_rebuilt_index": _agreement(reference_hits, _top_k(vectors["queries"], vectors["docs"], k)),
+                }
+
+        report = {
+            "reference": reference_name,
+            "queries": len(questions),
+            "chunks": len(docs),
+            "threads": options["threads"],
+            "backends": results,
+        }
+        if options["json"]:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+
+        self.stdout.write(
+            f"{len(questions)} queries x {options['repeat']}, {len(docs)} chunks, "
+            f"{options['threads'] or 'default'} threads, reference: {reference_name}"
+        )
+        self.stdout.write(
+            f"{'backend':<11}{'load s':>8}{'p50 ms':>9}{'p95 ms':>9}{'docs/s':>9}{'+RSS MB':>9}"
+            f"{'peak MB':>9}{'cos min':>10}{'top-k idx':>11}{'rebuilt':>9}"
+        )
+        for name, r in results.items():
+            agreement = list(r["agreement"].values())
+            self.stdout.write(
+                f"{name:<11}{r['load_seconds']:>8}{r['query']['p50_ms']:>9}{r['query']['p95_ms']:>9}"
+                f"{r['docs_per_second']:>9}{r['model_rss_mb']:>9}{r['peak_rss_mb']:>9}"
+                f"{agreement[1]:>10}{agreement[2]:>11}{agreement[3]:>9}"
+            )
+
+    def run_worker(self, backend: str, options) -> None:
+        workdir = options["workdir"]
+        with open(os.path.join(workdir, "input.json"), encoding="utf-8") as f:
+            data = json.load(f)
+        queries, docs = data["queries"], data["docs"]
+
+        rss_start = _rss_mb()
+        started = time.perf_counter()
+        model = _load_backend(backend, options["threads"])
+        model.embed_query("warm-up")  # includes lazy session / weight initialization
+        load_seconds = time.perf_counter() - started
+
+        latencies = []
+        for _ in range(max(options["repeat"], 1)):
+            for query in queries:
+                t = time.perf_counter()
+                model.embed_query(query)
+                latencies.append(time.perf_counter() - t)
+
+        started = time.perf_counter()
+        doc_vectors = np.asarray(model.embed_documents(docs), dtype=np.float32)
+        docs_seconds = time.perf_counter() - started
+        query_vectors = np.asarray(model.embed_documents(queries), dtype=np.float32)
+
+        np.savez(os.path.join(workdir, f"{backend}.npz"), queries=query_vectors, docs=doc_vectors)
+        with open(os.path.join(workdir, f"{backend}.json"), "w", encoding="utf-8") as f:
+            json.dump({
+                "load_seconds": round(load_seconds, 2),
+                "query": {
+                    "count": len(latencies),
+                    "mean_ms": round(float(np.mean(latencies)) * 1000, 2),
+                    "p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 2),
+                    "p95_ms": round(float(np.percentile(latencies, 95)) * 1000, 2),
+                },
+                "docs_per_second": round(len(docs) / docs_seconds, 1) if docs_seconds else 0.0,
+                "model_rss_mb": round(_rss_mb() - rss_start, 1),
+                "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            }, f)
@@ -0,0 +1,59 @@
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from chat.utils.data_processor import load_local_embedding_model, EMBEDDING_BACKEND_ONNX, EMBEDDING_MODEL_NAME
+from chat.utils.embedding_service import EmbeddingServer
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the embedding sidecar: loads the embedding model once and serves embedding "
+        "requests from all workers on the host over a Unix socket, micro-batching concurrent "
+        "requests into one forward pass. Enable clients with EMBEDDING_SIDECAR=True."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--socket", default=settings.EMBEDDING_SOCKET_PATH, help="Unix socket path")
+        parser.add_argument("--window-ms", type=float, default=settings.EMBEDDING_BATCH_WINDOW_MS,
+                            help="Micro-batch collection window (ms)")
+        parser.add_argument("--max-batch", type=int, default=settings.EMBEDDING_MAX_BATCH,
+                            help="Max texts per forward pass")
+        parser.add_argument("--threads", type=int, default=0,
+                            help="torch / ONNX Runtime threads (0 = backend default)")
+
+    def handle(self, *args, **options):
+        onnx = settings.EMBEDDING_BACKEND == EMBEDDING_BACKEND_ONNX
+        if options["threads"] and not onnx:
+            import torch
+
+            torch.set_num_threads(options["threads"])
+
+        self.stderr.write(f"Loading {EMBEDDING_MODEL_NAME} ({settings.EMBEDDING_BACKEND})...")
+        model = load_local_embedding_model()
+        if options["threads"] and onnx:
+            model.threads = options["threads"]  # the ONNX Runtime session is created on first use
+        model.embed_query("warm-up")
+
+        server = EmbeddingServer(
+            options["socket"],
+            model,
+            window=options["window_ms"] / 1000.0,
+            max_batch=options["max_batch"],
+        )
+
+        def stop(signum, frame):
+            # shutdown() blocks until serve_forever() returns, so call it off the main thread
+            threading.Thread(target=server.shutdown, daemon=True).start()
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        self.stdout.write(f"Embedding sidecar listening on {options['socket']}")
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+            self.stdout.write(f"Embedding sidecar stopped: {server.batcher.stats()}")
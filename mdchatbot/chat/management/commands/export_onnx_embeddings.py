@@ -0,0 +1,152 @@
+import os
+import json
+import shutil
+import tempfile
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.utils.data_processor import EMBEDDING_MODEL_NAME
+from chat.utils.onnx_embeddings import (
+    ONNX_MANIFEST,
+    ONNX_MODEL_FILE,
+    ONNX_QUANTIZED_MODEL_FILE,
+    ONNX_TOKENIZER_FILE,
+    OnnxEmbeddings,
+)
+
+# Sentences used to check the export against the torch model
+CHECK_TEXTS = [
+    "How do I add a new customer?",
+    "milk collection report for the evening shift",
+    "Steps to reset the password of a collection centre user",
+    "x",
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Export the sentence-transformers embedding model to ONNX for EMBEDDING_BACKEND=onnx "
+        "(optionally with an int8 dynamically quantized copy) and check the exported vectors "
+        "against the torch model. Needs torch, sentence-transformers and onnxruntime; serving "
+        "the export needs only onnxruntime and tokenizers."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--output", default=settings.EMBEDDING_ONNX_DIR, help="Output directory")
+        parser.add_argument("--quantize", action="store_true", help="Also write an int8 model (model_int8.onnx)")
+        parser.add_argument("--opset", type=int, default=17, help="ONNX opset version")
+        parser.add_argument("--min-cosine", type=float, default=0.9999,
+                            help="Fail if the fp32 export's vectors differ more than this from torch")
+
+    def handle(self, *args, **options):
+        try:
+            import torch
+            from sentence_transformers import SentenceTransformer
+            from sentence_transformers.models import Normalize, Pooling
+        except ImportError as e:
+            raise CommandError(f"Exporting needs torch and sentence-transformers: {e}")
+
+        self.stderr.write(f"Loading {EMBEDDING_MODEL_NAME}...")
+        st_model = SentenceTransformer(EMBEDDING_MODEL_NAME, device="cpu")
+        pooling = next((m for m in st_model if isinstance(m, Pooling)), None)
+        if pooling is None or pooling.get_pooling_mode_str() != "mean":
+            raise CommandError("Only mean-pooling sentence-transformers models can be exported")
+
+        transformer = st_model[0].auto_model.eval()
+        tokenizer = st_model.tokenizer
+
+        class LastHiddenState(torch.nn.Module):
+            def __init__(self, model):
+                super().__init__()
+                self.model = model
+
+            def forward(self, input_ids, attention_mask, token_type_ids):
+                return self.model(
+                    input_ids=input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids
+                ).last_hidden_state
+
+        output = options["output"]
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(prefix=".onnx-export-", dir=os.path.dirname(os.path.abspath(output)))
+        try:
+            sample = tokenizer(CHECK_TEXTS, padding=True, return_tensors="pt")
+            axes = {0: "batch", 1: "sequence"}
+            with torch.no_grad():
+                torch.onnx.export(
+                    LastHiddenState(transformer),
+                    (sample["input_ids"], sample["attention_mask"], sample["token_type_ids"]),
+                    os.path.join(tmp_dir, ONNX_MODEL_FILE),
+                    input_names=["input_ids", "attention_mask", "token_type_ids"],
+                    output_names=["last_hidden_state"],
+                    dynamic_axes={
+                        "input_ids": axes,
+                        "attention_mask": axes,
+                        "token_type_ids": axes,
+                        "last_hidden_state": axes,
+                    },
+                    opset_version=options["opset"],
+                )
+            tokenizer.save_pretrained(tmp_dir)
+            if not os.path.isfile(os.path.join(tmp_dir, ONNX_TOKENIZER_FILE)):
+                raise CommandError("The model has no fast tokenizer (tokenizer.json); cannot export")
+
+            manifest = {
+                "model": EMBEDDING_MODEL_NAME,
+                "pooling": "mean",
+                "normalize": any(isinstance(m, Normalize) for m in st_model),
+                "max_seq_length": st_model.max_seq_length,
+                "dim": st_model.get_sentence_embedding_dimension(),
+                "pad_token": tokenizer.pad_token,
+                "pad_token_id": tokenizer.pad_token_id,
+                "opset": options["opset"],
+                "quantized": False,
+            }
+
+            if options["quantize"]:
+                from onnxruntime.quantization import QuantType, quantize_dynamic
+
+                quantize_dynamic(
+                    os.path.join(tmp_dir, ONNX_MODEL_FILE),
+                    os.path.join(tmp_dir, ONNX_QUANTIZED_MODEL_FILE),
+                    weight_type=QuantType.QInt8,
+                )
+                manifest["quantized"] = True
+
+            with open(os.path.join(tmp_dir, ONNX_MANIFEST), "w", encoding="utf-8") as f:
+                json.dump(manifest, f, indent=2)
+
+            # Check the export reproduces the torch vectors before publishing it
+            reference = st_model.encode(CHECK_TEXTS, convert_to_numpy=True)
+            checks = {"fp32": False, "int8": True} if options["quantize"] else {"fp32": False}
+            for label, quantized in checks.items():
+                vectors = OnnxEmbeddings(tmp_dir, quantized=quantized).embed_array(CHECK_TEXTS)
+                cosine = _min_cosine(reference, vectors)
+                manifest[f"{label}_min_cosine"] = round(cosine, 6)
+                self.stdout.write(f"{label}: min cosine vs torch = {cosine:.6f}")
+                if label == "fp32" and cosine < options["min_cosine"]:
+                    raise CommandError(f"fp32 export diverges from torch (min cosine {cosine:.6f})")
+
+            with open(os.path.join(tmp_dir, ONNX_MANIFEST), "w", encoding="utf-8") as f:
+                json.dump(manifest, f, indent=2)
+
+            if os.path.isdir(output):
+                shutil.rmtree(output)
+            os.rename(tmp_dir, output)
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+        sizes = {
+            name: f"{os.path.getsize(os.path.join(output, name)) / 2 ** 20:.1f} MB"
+            for name in (ONNX_MODEL_FILE, ONNX_QUANTIZED_MODEL_FILE)
+            if os.path.isfile(os.path.join(output, name))
+        }
+        self.stdout.write(f"Exported {EMBEDDING_MODEL_NAME} to {output}: {sizes}")
+
+
+def _min_cosine(a: np.ndarray, b: np.ndarray) -> float:
+    a = a / np.linalg.norm(a, axis=1, keepdims=True)
+    b = b / np.linalg.norm(b, axis=1, keepdims=True)
+    return float((a * b).sum(axis=1).min())
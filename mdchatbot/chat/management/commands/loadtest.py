@@ -0,0 +1,241 @@
+import sys
+import json
+import time
+import random
+import resource
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.backends.signals import connection_created
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from chat.models import ConversationHistory
+from chat.utils import chatbot
+from chat.utils.fake_gemini import FakeGeminiClient
+from chat.utils.lifecycle import lifecycle
+from chat.utils.turn_writer import turn_writer
+from chat.views import ChatAPIView
+
+# Pipeline functions timed as stages (looked up by name in chat.utils.chatbot at call time)
+STAGES = {
+    "session": "initialize_session",
+    "rewrite": "rewrite_query",
+    "retrieval": "retrieve_documents",
+    "generation": "generate_reply",
+    "persistence": "finish_turn",
+}
+
+
+class StageTimer:
+    """
+    Thread-safe collection of per-stage durations (seconds).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = defaultdict(list)
+
+    def record(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.samples[stage].append(seconds)
+
+    def wrap(self, stage: str, func):
+        @wraps(func)
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.record(stage, time.perf_counter() - started)
+        return timed
+
+
+def percentile(values, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux but in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def summarize(values) -> dict:
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 50) * 1000, 1),
+        "p95_ms": round(percentile(values, 95) * 1000, 1),
+        "p99_ms": round(percentile(values, 99) * 1000, 1),
+        "max_ms": round(max(values) * 1000, 1) if values else 0.0,
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Offline load test of ChatAPIView: replays questions from ConversationHistory (or a "
+        "fixture file) at a target rate against a local Gemini stand-in and reports RPS, "
+        "per-stage latency percentiles, DB query counts (every thread: requests, turn "
+        "writer, retrieval pool) and peak RSS. "
+        "Writes conversation rows, so point DJANGO_DB_PATH at a scratch copy of the database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=200, help="Total requests to send")
+        parser.add_argument("--rps", type=float, default=10.0, help="Target arrival rate (open loop)")
+        parser.add_argument("--concurrency", type=int, default=32, help="Max requests in flight")
+        parser.add_argument("--users", type=int, default=50, help="Simulated client_user_ids")
+        parser.add_argument("--user-id-start", type=int, default=900000, help="First simulated client_user_id")
+        parser.add_argument("--fixture", help="Question file: JSON list of strings, or one question per line")
+        parser.add_argument("--sample", type=int, default=1000, help="Max questions sampled from history")
+        parser.add_argument("--latency", type=float, default=1.0, help="Median fake Gemini latency (s)")
+        parser.add_argument("--latency-sigma", type=float, default=0.3, help="Log-normal sigma (0 = fixed)")
+        parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of fake calls failing with 503")
+        parser.add_argument("--responses", help="JSON file with a list of canned response bodies")
+        parser.add_argument("--seed", type=int, default=None, help="Random seed for traffic and the stand-in")
+        parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+
+    def load_questions(self, options) -> list:
+        if options["fixture"]:
+            with open(options["fixture"], encoding="utf-8") as f:
+                raw = f.read()
+            try:
+                questions = json.loads(raw)
+            except json.JSONDecodeError:
+                questions = raw.splitlines()
+        else:
+            questions = list(
+                ConversationHistory.objects.exclude(user_text__isnull=True).exclude(user_text="")
+                .order_by("-request_at").values_list("user_text", flat=True)[:options["sample"]]
+            )
+
+        questions = [q.strip() for q in questions if isinstance(q, str) and q.strip()]
+        if not questions:
+            raise CommandError("No questions to replay: ConversationHistory is empty and no --fixture was given")
+        return questions
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        questions = self.load_questions(options)
+
+        responses = None
+        if options["responses"]:
+            with open(options["responses"], encoding="utf-8") as f:
+                responses = json.load(f)
+
+        self.stderr.write("Loading retrieval stack...")
+        if not lifecycle.ensure_ready():
+            raise CommandError(f"Chat stack failed to initialize: {lifecycle.error}")
+        lifecycle.gemini_client = FakeGeminiClient(
+            latency_median=options["latency"],
+            latency_sigma=options["latency_sigma"],
+            error_rate=options["error_rate"],
+            responses=responses,
+            seed=options["seed"],
+        )
+
+        timer = StageTimer()
+        originals = {name: getattr(chatbot, name) for name in STAGES.values()}
+        for stage, name in STAGES.items():
+            setattr(chatbot, name, timer.wrap(stage, originals[name]))
+
+        user = get_user_model()(username="loadtest")  # unsaved; only used by force_authenticate
+        factory = APIRequestFactory()
+        view = ChatAPIView.as_view()
+        lock = threading.Lock()
+        totals = defaultdict(int)
+
+        queries_by_thread = defaultdict(int)
+
+        def count_queries(execute, sql, params, many, context):
+            # Thread names are "<pool prefix>_<n>" or a fixed name such as "turn-writer"
+            with lock:
+                queries_by_thread[threading.current_thread().name.split("_")[0]] += 1
+            return execute(sql, params, many, context)
+
+        def instrument(sender, connection, **kwargs):
+            # Every connection opened during the run (one per thread) counts its queries
+            connection.execute_wrappers.append(count_queries)
+
+        def send(i, question, scheduled):
+            payload = {
+                "client_id": 1,
+                "client_user_id": options["user_id_start"] + i % options["users"],
+                "client_user_name": f"loadtest-{i % options['users']}",
+                "query": question,
+            }
+            request = factory.post("/api/chat/", payload, format="json")
+            force_authenticate(request, user=user)
+            try:
+                response = view(request)
+                key = f"status_{response.status_code}"
+            except Exception as e:
+                key = f"exception_{type(e).__name__}"
+            finally:
+                connection.close()  # worker threads would otherwise keep connections open
+            timer.record("total", time.perf_counter() - scheduled)
+            with lock:
+                totals[key] += 1
+
+        total = options["requests"]
+        interval = 1.0 / options["rps"] if options["rps"] > 0 else 0.0
+        self.stderr.write(f"Replaying {total} requests from {len(questions)} questions at {options['rps']} rps...")
+
+        connection_created.connect(instrument)
+        try:
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=options["concurrency"], thread_name_prefix="loadtest") as pool:
+                for i in range(total):
+                    # Open loop: latency is measured from the scheduled arrival time
+                    scheduled = started + i * interval
+                    delay = scheduled - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                    pool.submit(send, i, rng.choice(questions), scheduled)
+            elapsed = time.perf_counter() - started
+            turn_writer.flush()  # write-behind rows count towards this run
+        finally:
+            connection_created.disconnect(instrument)
+            for name, func in originals.items():
+                setattr(chatbot, name, func)
+
+        db_queries = sum(queries_by_thread.values())
+        report = {
+            "requests": total,
+            "elapsed_seconds": round(elapsed, 3),
+            "achieved_rps": round(total / elapsed, 2) if elapsed else 0.0,
+            "outcomes": dict(totals),
+            "db_queries": db_queries,
+            "db_queries_per_request": round(db_queries / total, 2) if total else 0.0,
+            "db_queries_by_thread": dict(queries_by_thread),
+            "peak_rss_mb": peak_rss_mb(),
+            "fake_gemini_calls": lifecycle.gemini_client.calls,
+            "stages": {stage: summarize(timer.samples[stage]) for stage in ["total", *STAGES]},
+        }
+
+        if options["json"]:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+
+        self.stdout.write(
+            f"Requests: {total} in {report['elapsed_seconds']}s → {report['achieved_rps']} rps "
+            f"(target {options['rps']})"
+        )
+        self.stdout.write(f"Outcomes: {report['outcomes']}")
+        self.stdout.write(
+            f"DB queries: {report['db_queries']} ({report['db_queries_per_request']}/request, "
+            f"by thread: {report['db_queries_by_thread']}), "
+            f"peak RSS: {report['peak_rss_mb']} MB, fake Gemini calls: {report['fake_gemini_calls']}"
+        )
+        self.stdout.write(f"{'stage':<12}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+        for stage, s in report["stages"].items():
+            self.stdout.write(
+                f"{stage:<12}{s['count']:>8}{s['p50_ms']:>10}{s['p95_ms']:>10}{s['p99_ms']:>10}{s['max_ms']:>10}"
+            )
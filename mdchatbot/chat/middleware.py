@@ -0,0 +1,83 @@
+import re
+import time
+import uuid
+import logging
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from chat.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+REQUEST_ID_HEADER = "X-Request-ID"
+# Accept caller-supplied IDs only if they are short and header/log safe
+REQUEST_ID_PATTERN = re.compile(r"^[A-Za-z0-9._:-]{1,64}$")
+
+
+def install_query_counter(sender, connection, **kwargs):
+    """
+    connection_created handler: count queries on every new database connection
+    (each thread gets its own). Connected in ChatConfig.ready().
+    """
+    if metrics.count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(metrics.count_query)
+
+
+class RequestMetricsMiddleware:
+    """
+    Assigns a request ID (from the X-Request-ID header or a new one), collects the
+    pipeline spans and DB query count of the request, records them in the metrics
+    registry and logs a one-line summary tied together by the request ID.
+    Spans recorded while a streaming body is produced happen after this summary.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+
+        trace, token, started = self._start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.end_request(token)
+        return self._finish(request, response, trace, started)
+
+    async def __acall__(self, request):
+        trace, token, started = self._start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.end_request(token)
+        return self._finish(request, response, trace, started)
+
+    def _start(self, request):
+        incoming = request.headers.get(REQUEST_ID_HEADER, "")
+        request_id = incoming if REQUEST_ID_PATTERN.match(incoming) else uuid.uuid4().hex
+        request.request_id = request_id
+        trace, token = metrics.start_request(request_id)
+        return trace, token, time.perf_counter()
+
+    def _finish(self, request, response, trace, started):
+        elapsed = time.perf_counter() - started
+        match = getattr(request, "resolver_match", None)
+        route = match.view_name if match and match.view_name else "unmatched"
+
+        metrics.REQUEST_SECONDS.observe(elapsed, route=route, method=request.method, status=str(response.status_code))
+        metrics.REQUEST_DB_QUERIES.observe(trace["db_queries"], route=route)
+        response[REQUEST_ID_HEADER] = trace["id"]
+
+        if trace["spans"]:
+            spans = " ".join(f"{stage}={seconds * 1000:.1f}ms" for stage, seconds in trace["spans"])
+            logger.info(
+                f"[{trace['id']}] {request.method} {request.path} {response.status_code} "
+                f"{elapsed * 1000:.1f}ms db_queries={trace['db_queries']} {spans}"
+            )
+        return response
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.1 on 2026-10-17 10:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0002_requestprofile'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='conversationhistory',
+            index=models.Index(fields=['conversation', 'request_at'], name='chat_history_conv_request_idx'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.1 on 2026-10-17 11:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0003_conversationhistory_conv_request_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatSessionState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('client_user_id', models.CharField(max_length=64, unique=True)),
+                ('state', models.JSONField(default=dict)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
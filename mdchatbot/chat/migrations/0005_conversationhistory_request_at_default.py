@@ -0,0 +1,19 @@
+# Generated by Django 5.2.1 on 2026-10-17 16:00
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_chatsessionstate'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='conversationhistory',
+            name='request_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
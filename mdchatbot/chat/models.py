@@ -64,9 +64,15 @@ class ConversationHistory(models.Model):
     conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE)
     user_text = models.TextField(null=True, blank=True)  # Original user message
     assistant_text = models.JSONField(null=True, blank=True)  # Gemini JSON response
-    request_at = models.DateTimeField(auto_now_add=True)  # Timestamp when user sent message
+    request_at = models.DateTimeField(default=timezone.now)  # Timestamp when user sent message
     response_at = models.DateTimeField(null=True, blank=True)  # Set when assistant replies
 
+    class Meta:
+        indexes = [
+            # Serves the windowed history read (latest rows of one conversation)
+            models.Index(fields=["conversation", "request_at"], name="chat_history_conv_request_idx"),
+        ]
+
     def save(self, *args, **kwargs):
         """
         Automatically set response_at when assistant_text is added.
@@ -75,3 +81,52 @@ class ConversationHistory(models.Model):
         if self.assistant_text and not self.response_at:
             self.response_at = timezone.now()
         super().save(*args, **kwargs)
+
+
+class ChatSessionState(models.Model):
+    """
+    Serializable chat session state (session_id, profile, language) shared by all
+    workers when SESSION_BACKEND is "database".
+    """
+    client_user_id = models.CharField(max_length=64, unique=True)
+    state = models.JSONField(default=dict)
+    updated = models.DateTimeField(auto_now=True)  # Last time any worker synced the session
+
+    def __str__(self):
+        return f"Session state for {self.client_user_id}"
+
+
+class RequestProfile(models.Model):
+    """
+    Sampling-profiler capture of one /api/chat/ request, taken on demand by staff
+    (X-Profile header). Downloadable from the admin as speedscope or flamegraph files.
+    """
+    request_id = models.CharField(max_length=64, db_index=True)
+    created = models.DateTimeField(auto_now_add=True)
+    requested_by = models.ForeignKey(
+        get_user_model(),
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL
+    )  # Staff user who asked for the capture
+    client_user_id = models.CharField(max_length=64, null=True, blank=True)
+    conversation_history = models.ForeignKey(
+        ConversationHistory,
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name="profiles"
+    )  # Turn saved by the profiled request
+    path = models.CharField(max_length=255)
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    duration_ms = models.FloatField()
+    sample_interval_ms = models.FloatField()
+    sample_count = models.PositiveIntegerField(default=0)
+    collapsed_stacks = models.TextField(blank=True)  # "frame;frame;frame count" lines
+    sql_queries = models.JSONField(default=list, blank=True)  # [{"sql", "ms", "many", "thread"}, ...]
+
+    class Meta:
+        ordering = ("-created",)
+
+    def __str__(self):
+        return f"Profile {self.request_id} ({self.duration_ms:.0f} ms)"
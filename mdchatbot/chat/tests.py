@@ -1,3 +1,623 @@
-from django.test import TestCase
+import os
+import json
+import math
+import time
+import asyncio
+import tempfile
+import uuid
+from collections import Counter
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from google.genai import errors
+from langchain.schema import Document
+
+from chat.models import ChatSessionState, ClientUser, Conversation, ConversationHistory
+from chat.utils import chatbot
+from chat.utils.bm25 import SparseBM25Index, tokenize
+from chat.utils.fake_gemini import FakeGeminiClient
+from chat.utils.guide_fallback import degraded_response
+from chat.utils.langchain_memory import DjangoChatMessageHistory
+from chat.utils.turn_writer import turn_writer
+from chat.utils.lifecycle import lifecycle
+from chat.utils.resilience import CallTimeout, CircuitBreaker, CircuitOpenError, ResilientCaller
+from chat.utils.session_store import DatabaseSessionBackend, MemorySessionBackend, SessionStore, new_session
+
+
+def _api_error(code: int) -> errors.APIError:
+    error_class = errors.ServerError if code >= 500 else errors.ClientError
+    return error_class(code, {"error": {"code": code, "message": f"fake {code}", "status": "FAKE"}})
+
+
+def _generate(client: FakeGeminiClient):
+    return client.models.generate_content(model="fake", contents="How do I add a customer?")
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+# -- Gemini resilience ----------------------------------------------------------
+
+
+class RetryTests(SimpleTestCase):
+    def setUp(self):
+        self.breaker = CircuitBreaker(failure_threshold=10)
+        self.caller = ResilientCaller("test", self.breaker, timeout=5, max_attempts=3, backoff_base=0,
+                                      sleep=lambda seconds: None)
+        self.healthy = FakeGeminiClient(latency_median=0, latency_sigma=0)
+        self.failing = FakeGeminiClient(latency_median=0, latency_sigma=0, error_rate=1.0)
+
+    def test_retries_server_errors(self):
+        clients = iter([self.failing, self.failing, self.healthy])
+        response = self.caller.call(lambda hedged: _generate(next(clients)))
+
+        self.assertIn(json.loads(response.text)["responseType"], ("basic", "procedure"))
+        self.assertEqual(self.failing.calls, 2)
+        self.assertEqual(self.caller.stats()["retries"], 2)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_retries_rate_limiting(self):
+        outcomes = iter([_api_error(429), None])
+
+        def attempt(hedged):
+            error = next(outcomes)
+            if error is not None:
+                raise error
+            return _generate(self.healthy)
+
+        self.assertIsNotNone(self.caller.call(attempt))
+        self.assertEqual(self.caller.stats()["retries"], 1)
+
+    def test_does_not_retry_client_errors(self):
+        calls = []
+
+        def attempt(hedged):
+            calls.append(hedged)
+            raise _api_error(400)
+
+        with self.assertRaises(errors.ClientError):
+            self.caller.call(attempt)
+        self.assertEqual(len(calls), 1)
+        # Upstream answered, so a bad request does not count against the circuit
+        self.assertEqual(self.breaker.stats()["consecutive_failures"], 0)
+
+    def test_gives_up_after_max_attempts(self):
+        with self.assertRaises(errors.ServerError):
+            self.caller.call(lambda hedged: _generate(self.failing))
+        self.assertEqual(self.failing.calls, 3)
+
+    def test_async_retries_server_errors(self):
+        clients = iter([self.failing, self.healthy])
+
+        async def attempt(hedged):
+            return await next(clients).aio.models.generate_content(model="fake", contents="q")
+
+        self.assertIsNotNone(asyncio.run(self.caller.acall(attempt)))
+        self.assertEqual(self.failing.calls, 1)
+        self.assertEqual(self.caller.stats()["retries"], 1)
+
+
+class HedgingTests(SimpleTestCase):
+    def setUp(self):
+        self.caller = ResilientCaller("test", CircuitBreaker(), timeout=5, hedge_percentile=50,
+                                      hedge_min_samples=5)
+        self.slow = FakeGeminiClient(latency_median=1.0, latency_sigma=0)
+        self.fast = FakeGeminiClient(latency_median=0, latency_sigma=0)
+
+    def _attempt(self, hedged):
+        return _generate(self.fast if hedged else self.slow)
+
+    def _record_latencies(self, seconds: float = 0.05, count: int = 5):
+        for _ in range(count):
+            self.caller.latency.record(seconds)
+
+    def test_hedge_wins_over_slow_primary(self):
+        self._record_latencies()
+        started = time.monotonic()
+        self.assertIsNotNone(self.caller.call(self._attempt))
+
+        self.assertLess(time.monotonic() - started, 0.9)
+        self.assertEqual(self.caller.stats()["hedges"], 1)
+        self.assertEqual(self.caller.stats()["hedge_wins"], 1)
+
+    def test_no_hedge_before_enough_samples(self):
+        self._record_latencies(count=4)
+        self.assertIsNone(self.caller.hedge_delay())
+
+    def test_no_hedge_when_disabled_for_the_call(self):
+        self._record_latencies()
+        self.slow.latency_median = 0.2
+        self.assertIsNotNone(self.caller.call(self._attempt, hedge=False))
+        self.assertEqual(self.fast.calls, 0)
+        self.assertNotIn("hedges", self.caller.stats())
+
+
+@override_settings(GEMINI_GENERATION_MODE="chat")
+class StatefulChatTests(SimpleTestCase):
+    def setUp(self):
+        self.gemini = FakeGeminiClient(latency_median=0.3, latency_sigma=0)
+        caller = ResilientCaller("test", CircuitBreaker(), timeout=0.1, max_attempts=3, backoff_base=0,
+                                 sleep=lambda seconds: None)
+        patcher = mock.patch.object(chatbot, "generation_caller", caller)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def turn(self, chat_key: str, chat) -> dict:
+        return {"sess": {chat_key: chat}, "prompt": "How do I add a customer?", "client_user_id": "u1"}
+
+    def wait_for_sends(self):
+        time.sleep(0.5)  # the timed-out send finishes in the background
+
+    def test_timed_out_send_is_not_repeated(self):
+        chat = self.gemini.chats.create(model="fake")
+        with self.assertRaises(CallTimeout):
+            chatbot.generate_reply(self.turn("chat", chat))
+        self.wait_for_sends()
+
+        self.assertEqual(self.gemini.calls, 1)
+        self.assertEqual([role for role, _ in chat.get_history()], ["user", "model"])
+
+    def test_async_timed_out_send_is_not_repeated(self):
+        chat = self.gemini.aio.chats.create(model="fake")
+
+        async def generate():
+            with self.assertRaises(CallTimeout):
+                await chatbot.agenerate_reply(self.turn("aio_chat", chat))
+            await asyncio.sleep(0.5)
+
+        asyncio.run(generate())
+        self.assertEqual(self.gemini.calls, 1)
+        self.assertEqual([role for role, _ in chat.get_history()], ["user", "model"])
+
+    def test_upstream_errors_are_still_retried(self):
+        gemini = FakeGeminiClient(latency_median=0, latency_sigma=0)
+        chat = gemini.chats.create(model="fake")
+        failures, generate = iter([_api_error(503)]), gemini.generate
+
+        def fail_once(contents, config=None):
+            for error in failures:
+                raise error
+            return generate(contents, config)
+
+        with mock.patch.object(gemini, "generate", fail_once):
+            self.assertTrue(chatbot.generate_reply(self.turn("chat", chat)))
+        # The rejected send left no trace, so the chat holds one exchange
+        self.assertEqual([role for role, _ in chat.get_history()], ["user", "model"])
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30, clock=self.clock)
+
+    def _fail(self, times: int):
+        for _ in range(times):
+            self.breaker.record_failure()
+
+    def test_opens_after_consecutive_failures(self):
+        self._fail(2)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self._fail(1)
+        self.assertTrue(self.breaker.is_open)
+        self.assertFalse(self.breaker.allow())
+
+    def test_success_resets_failure_count(self):
+        self._fail(2)
+        self.breaker.record_success()
+        self._fail(2)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_half_open_allows_one_probe(self):
+        self._fail(3)
+        self.clock.now = 30
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(self.breaker.allow())
+
+    def test_failed_probe_reopens(self):
+        self._fail(3)
+        self.clock.now = 30
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_failure()
+
+        self.clock.now = 59
+        self.assertTrue(self.breaker.is_open)
+        self.clock.now = 60
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+
+    def test_open_circuit_short_circuits_calls(self):
+        failing = FakeGeminiClient(latency_median=0, latency_sigma=0, error_rate=1.0)
+        caller = ResilientCaller("test", self.breaker, timeout=5, max_attempts=3, backoff_base=0,
+                                 sleep=lambda seconds: None)
+        with self.assertRaises(errors.ServerError):
+            caller.call(lambda hedged: _generate(failing))
+        self.assertTrue(self.breaker.is_open)
+
+        with self.assertRaises(CircuitOpenError):
+            caller.call(lambda hedged: _generate(failing))
+        self.assertEqual(failing.calls, 3)
+
+        # The half-open probe goes upstream and its success closes the circuit
+        self.clock.now = 30
+        self.assertIsNotNone(caller.call(lambda hedged: _generate(FakeGeminiClient(latency_median=0))))
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+
+GUIDE_SECTION = Document(
+    page_content=(
+        "Customer Guide\n\nAdd Customer\n\nRegister a new customer.\n\n"
+        "1. Open customers: Tap Customers on the home screen.\n"
+        "2. Save: Fill in the details and tap Save.\n"
+    ),
+    metadata={"guide_title": "Customer Guide", "section_title": "Add Customer", "chunk_id": "guide-1"},
+)
+
+
+class StaticRetriever:
+    corpus_version = "test"
+
+    def __init__(self, docs):
+        self.docs = docs
+
+    def search(self, query, k=4):
+        return [(doc, 1.0) for doc in self.docs[:k]]
+
+
+class DegradedAnswerTests(TestCase):
+    def test_guide_section_becomes_procedure(self):
+        answer = json.loads(degraded_response([GUIDE_SECTION]))
+        self.assertEqual(answer["responseType"], "procedure")
+        self.assertEqual(answer["content"]["header"]["title"], "Add Customer")
+        self.assertEqual([step["title"] for step in answer["content"]["body"]], ["Open customers", "Save"])
+
+    def test_apology_without_guide_section(self):
+        pdf_chunk = Document(page_content="Milk rates are revised monthly.", metadata={"chunk_id": "pdf-1"})
+        for docs in ([], [pdf_chunk]):
+            self.assertEqual(json.loads(degraded_response(docs))["responseType"], "basic")
+
+    @override_settings(CHAT_PERSISTENCE_MODE="sync", SPECULATIVE_RETRIEVAL=False, SEMANTIC_CACHE_ENABLED=False)
+    def test_open_circuit_answers_from_guides_and_saves_turn(self):
+        breaker = CircuitBreaker(failure_threshold=1)
+        breaker.record_failure()
+        gemini = FakeGeminiClient(latency_median=0, latency_sigma=0)
+
+        with mock.patch.object(lifecycle, "ensure_ready", return_value=True), \
+                mock.patch.multiple(lifecycle, retriever=StaticRetriever([GUIDE_SECTION]), gemini_client=gemini), \
+                mock.patch.object(chatbot, "gemini_breaker", breaker), \
+                mock.patch.object(chatbot.rewrite_caller, "breaker", breaker), \
+                mock.patch.object(chatbot.generation_caller, "breaker", breaker):
+            response = chatbot.text_pipeline_session("How do I add a customer?", "913001")
+
+        self.assertEqual(response, degraded_response([GUIDE_SECTION]))
+        self.assertEqual(gemini.calls, 0)
+        row = ConversationHistory.objects.get(conversation__session_id=chatbot.user_sessions.pop("913001")["session_id"])
+        self.assertEqual(row.user_text, "How do I add a customer?")
+        self.assertEqual(json.loads(row.assistant_text)["responseType"], "procedure")
+
+
+# -- BM25 -------------------------------------------------------------------------
+
+BM25_CORPUS = [
+    "How to add a new customer in the Mobile Dairy app",
+    "Customer list: search, edit and delete customers",
+    "Milk collection report for the morning and evening shift",
+    "Set the milk rate chart for cow and buffalo milk",
+    "नया ग्राहक कैसे जोड़ें? ग्राहक सूची खोलें",
+    "दूध संकलन रिपोर्ट देखें",
+    "Reset the password of a collection centre user",
+]
+
+
+def reference_bm25(corpus, query, k1=1.5, b=0.75):
+    """
+    Straightforward Okapi BM25 (Lucene idf), scoring every document.
+    """
+    docs = [Counter(tokenize(text)) for text in corpus]
+    avgdl = sum(sum(doc.values()) for doc in docs) / len(docs)
+    scores = []
+    for doc in docs:
+        length = sum(doc.values())
+        score = 0.0
+        for term in tokenize(query):
+            tf = doc[term]
+            if not tf:
+                continue
+            df = sum(1 for other in docs if term in other)
+            idf = math.log(1 + (len(docs) - df + 0.5) / (df + 0.5))
+            score += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * length / avgdl))
+        scores.append(score)
+    return scores
+
+
+class SparseBM25IndexTests(SimpleTestCase):
+    QUERIES = ["add customer", "milk report", "customer customer milk", "ग्राहक जोड़ें", "password", "unknown words"]
+
+    def setUp(self):
+        self.index = SparseBM25Index.build(BM25_CORPUS)
+
+    def assert_matches_reference(self, index):
+        for query in self.QUERIES:
+            expected = reference_bm25(BM25_CORPUS, query)
+            results = index.search(query, k=len(BM25_CORPUS))
+            # Only documents containing a query term are scored
+            self.assertEqual({doc for doc, _ in results}, {i for i, score in enumerate(expected) if score > 0}, query)
+            for doc, score in results:
+                self.assertAlmostEqual(score, expected[doc], places=4, msg=query)
+            self.assertEqual([score for _, score in results], sorted((score for _, score in results), reverse=True))
+
+    def test_scores_match_reference_bm25(self):
+        self.assert_matches_reference(self.index)
+
+    def test_top_k_is_best_first(self):
+        expected = reference_bm25(BM25_CORPUS, "customer milk")
+        top = self.index.search("customer milk", k=2)
+        self.assertEqual([doc for doc, _ in top], sorted(range(len(expected)), key=lambda i: -expected[i])[:2])
+
+    def test_tokenizer_keeps_devanagari_words(self):
+        self.assertEqual(tokenize("नया ग्राहक कैसे जोड़ें?"), ["नया", "ग्राहक", "कैसे", "जोड़ें"])
+        self.assertEqual(tokenize("Milk-Rate CHART"), ["milk", "rate", "chart"])
+
+    def test_save_and_load_round_trip(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "bm25.npz")
+            self.index.save(path)
+            self.assert_matches_reference(SparseBM25Index.load(path))
+
+
+# -- Conversation history ---------------------------------------------------------
+
+
+def new_conversation() -> str:
+    client_user = ClientUser.objects.create(name="Test user")
+    return Conversation.objects.create(client_user=client_user, session_id=str(uuid.uuid4())).session_id
+
+
+def human_texts(history) -> list:
+    return [message.content for message in history.messages if message.type == "human"]
+
+
+@override_settings(CHAT_PERSISTENCE_MODE="sync", SESSION_BACKEND="memory")
+class WindowedHistoryTests(TestCase):
+    def setUp(self):
+        self.session_id = new_conversation()
+        self.started = timezone.now()
+
+    def add_turns(self, history, *questions, offsets=None):
+        for question, offset in zip(questions, offsets or range(len(questions))):
+            history.add_turn(question, f"answer to {question}", self.started + timedelta(seconds=offset))
+
+    def test_keeps_the_last_turns_oldest_first(self):
+        history = DjangoChatMessageHistory(self.session_id, max_turns=2)
+        self.add_turns(history, "q1", "q2", "q3")
+
+        self.assertEqual(human_texts(history), ["q2", "q3"])
+        self.assertEqual(human_texts(DjangoChatMessageHistory(self.session_id, max_turns=2)), ["q2", "q3"])
+        self.assertEqual([message.type for message in history.messages], ["human", "ai", "human", "ai"])
+
+    def test_orders_by_request_time(self):
+        # q2 was asked before q1 but finished (and was saved) after it
+        self.add_turns(DjangoChatMessageHistory(self.session_id, max_turns=5), "q1", "q2", offsets=[2, 1])
+
+        self.assertEqual(human_texts(DjangoChatMessageHistory(self.session_id, max_turns=5)), ["q2", "q1"])
+        self.assertEqual(human_texts(DjangoChatMessageHistory(self.session_id)), ["q2", "q1"])
+
+    def test_buffer_serves_reads_without_queries(self):
+        history = DjangoChatMessageHistory(self.session_id, max_turns=3)
+        self.add_turns(history, "q1")
+        history.messages  # loads the buffer
+
+        self.add_turns(history, "q2", offsets=[1])
+        with self.assertNumQueries(0):
+            self.assertEqual(human_texts(history), ["q1", "q2"])
+
+    @override_settings(CHAT_HISTORY_CACHE_TTL=0)
+    def test_reloads_when_the_buffer_expires(self):
+        history = DjangoChatMessageHistory(self.session_id, max_turns=3)
+        self.add_turns(history, "q1")
+        history.messages
+
+        ConversationHistory.objects.create(
+            conversation=Conversation.objects.get(session_id=self.session_id), user_text="elsewhere",
+            assistant_text="a", request_at=self.started + timedelta(seconds=5),
+        )
+        self.assertEqual(human_texts(history), ["q1", "elsewhere"])
+
+
+@override_settings(CHAT_PERSISTENCE_MODE="write_behind", SESSION_BACKEND="memory")
+class WriteBehindHistoryTests(TransactionTestCase):
+    # The turn writer commits from its own thread, so test data must be committed too
+
+    def setUp(self):
+        self.session_id = new_conversation()
+        self.asked = timezone.now() - timedelta(seconds=30)
+
+    def test_flush_writes_queued_turns_with_request_time(self):
+        history = DjangoChatMessageHistory(self.session_id, max_turns=5)
+        history.add_turn("q1", "a1", self.asked)
+        history.add_turn("q2", "a2", self.asked + timedelta(seconds=1))
+        self.assertTrue(turn_writer.flush())
+
+        rows = list(ConversationHistory.objects.filter(conversation__session_id=self.session_id).order_by("request_at"))
+        self.assertEqual([(row.user_text, row.assistant_text) for row in rows], [("q1", "a1"), ("q2", "a2")])
+        # Stamped when asked, not when the writer flushed the batch
+        self.assertEqual(rows[0].request_at, self.asked)
+        self.assertTrue(all(row.response_at >= row.request_at for row in rows))
+
+    def test_queued_turns_are_read_from_the_buffer(self):
+        history = DjangoChatMessageHistory(self.session_id, max_turns=5)
+        history.messages  # loads the (empty) buffer
+
+        with mock.patch.object(turn_writer, "submit", return_value=True):
+            history.add_turn("queued", "answer", self.asked)
+        # The database does not have the turn yet; the buffer does, and is not reloaded over it
+        with override_settings(CHAT_HISTORY_CACHE_TTL=0):
+            self.assertEqual(human_texts(history), ["queued"])
+        self.assertFalse(ConversationHistory.objects.filter(conversation__session_id=self.session_id).exists())
+
+    def test_full_queue_writes_synchronously(self):
+        history = DjangoChatMessageHistory(self.session_id, max_turns=5)
+        with mock.patch.object(turn_writer, "submit", return_value=False):
+            history.add_turn("q1", "a1", self.asked)
+
+        row = ConversationHistory.objects.get(conversation__session_id=self.session_id)
+        self.assertEqual((row.user_text, row.request_at), ("q1", self.asked))
+        self.assertEqual(history._pending, 0)
+
+    def test_async_turns_match_sync_reads(self):
+        history = DjangoChatMessageHistory(self.session_id, max_turns=2)
+
+        async def add_turns():
+            for n in range(3):
+                await history.aadd_turn(f"q{n}", f"a{n}", self.asked + timedelta(seconds=n))
+
+        asyncio.run(add_turns())
+        self.assertTrue(turn_writer.flush())
+        reloaded = asyncio.run(DjangoChatMessageHistory(self.session_id, max_turns=2).aget_messages())
+        self.assertEqual([message.content for message in reloaded if message.type == "human"], ["q1", "q2"])
+        self.assertEqual(reloaded, history.messages)
+
+
+# -- Session store ----------------------------------------------------------------
+
+
+class SessionStoreTests(SimpleTestCase):
+    def store(self, **kwargs) -> SessionStore:
+        return SessionStore(new_session, **{"reap_interval": 0, **kwargs})
+
+    def test_touch_returns_the_same_session(self):
+        store = self.store()
+        session = store.touch("u1")
+        session["language"] = "hi"
+        self.assertIs(store.touch("u1"), session)
+        self.assertIs(store["u1"], session)
+        self.assertIn("u1", store)
+        self.assertIs(store.lock_for("u1"), store.lock_for("u1"))
+
+    def test_evicts_least_recently_used_when_full(self):
+        store = self.store(shards=1, max_sessions=2)
+        store.touch("a")
+        store.touch("b")
+        store.touch("a")  # b is now the least recently used
+        store.touch("c")
+
+        self.assertEqual(sorted(key for key, _ in store.items()), ["a", "c"])
+        self.assertEqual(store.stats()["evictions"], {"idle": 0, "capacity": 1})
+
+    def test_each_shard_holds_its_share(self):
+        store = self.store(shards=4, max_sessions=8)
+        for n in range(100):
+            store.touch(f"user-{n}")
+        self.assertLessEqual(len(store), 8)
+        self.assertEqual(store.stats()["evictions"]["capacity"], 100 - len(store))
+
+    def test_purges_idle_sessions(self):
+        store = self.store(idle_timeout=0.05)
+        store.touch("old")
+        time.sleep(0.1)
+        store.touch("new")
+
+        self.assertEqual(store.purge_expired(), 1)
+        self.assertNotIn("old", store)
+        self.assertIn("new", store)
+        self.assertEqual(store.stats()["evictions"]["idle"], 1)
+
+    def test_reaper_drops_idle_sessions(self):
+        store = self.store(idle_timeout=0.05, reap_interval=0.05)
+        store.touch("u1")
+        deadline = time.monotonic() + 5
+        while "u1" in store and time.monotonic() < deadline:
+            time.sleep(0.02)
+        self.assertNotIn("u1", store)
+        self.assertEqual(store.stats()["evictions"]["idle"], 1)
+
+
+# -- Shared session state ---------------------------------------------------------
+
+
+def session_state(session_id: str, greeted: bool = False) -> dict:
+    return {"session_id": session_id, "language": "en", "profile": {"name": "Ann", "greeted": greeted}}
+
+
+class SessionBackendTests(TestCase):
+    def test_memory_backend_keeps_state_local(self):
+        backend = MemorySessionBackend()
+        state = session_state("s1")
+        self.assertIs(backend.claim("u1", state), state)
+        backend.save("u1", session_state("s2"))
+        self.assertFalse(ChatSessionState.objects.exists())
+
+    def test_database_backend_returns_the_stored_state(self):
+        backend = DatabaseSessionBackend()
+        self.assertEqual(backend.claim("u1", session_state("s1")), session_state("s1"))
+        self.assertEqual(backend.claim("u1", session_state("s2")), session_state("s1"))
+
+        backend.save("u1", session_state("s1", greeted=True))
+        self.assertEqual(backend.claim("u1", session_state("s3")), session_state("s1", greeted=True))
+
+    def test_database_backend_replaces_idle_state(self):
+        DatabaseSessionBackend().claim("u1", session_state("s1"))
+        ChatSessionState.objects.update(updated=timezone.now() - timedelta(hours=3))
+
+        self.assertEqual(DatabaseSessionBackend(idle_timeout=7200).claim("u1", session_state("s2")), session_state("s2"))
+        self.assertEqual(ChatSessionState.objects.get(client_user_id="u1").state["session_id"], "s2")
+
+
+@override_settings(SESSION_BACKEND="database", CHAT_PERSISTENCE_MODE="sync")
+class SharedSessionTests(TestCase):
+    """
+    Two SessionStores stand in for two workers sharing the database backend.
+    """
+
+    def setUp(self):
+        self.worker_a = SessionStore(new_session, reap_interval=0)
+        self.worker_b = SessionStore(new_session, reap_interval=0)
+        patcher = mock.patch.object(chatbot, "session_backend", DatabaseSessionBackend())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def touch(self, worker: SessionStore, client_user_id: str = "u1") -> dict:
+        with mock.patch.object(chatbot, "user_sessions", worker):
+            return chatbot._touch_session(client_user_id, "Ann")
+
+    def test_workers_continue_the_same_session(self):
+        session_a = self.touch(self.worker_a)
+        session_b = self.touch(self.worker_b)
+        self.assertEqual(session_a["session_id"], session_b["session_id"])
+
+    def test_greeting_is_not_repeated_or_lost(self):
+        session_b = self.touch(self.worker_b)
+        session_a = self.touch(self.worker_a)
+        self.assertEqual(chatbot.get_greeting(session_a["profile"]), "Hello Ann! ")
+        self.touch(self.worker_a)  # A's next turn shares the greeting
+
+        # B's copy predates the greeting; its next turn picks it up instead of overwriting it
+        self.assertFalse(session_b["profile"]["greeted"])
+        with override_settings(SESSION_SYNC_INTERVAL=0):  # B also writes a keep-alive
+            self.touch(self.worker_b)
+        self.assertEqual(chatbot.get_greeting(session_b["profile"]), "")
+        self.assertTrue(ChatSessionState.objects.get(client_user_id="u1").state["profile"]["greeted"])
+
+    def test_history_shows_turns_written_by_another_worker(self):
+        session_id = new_conversation()
+        history_a = DjangoChatMessageHistory(session_id, max_turns=5)
+        history_b = DjangoChatMessageHistory(session_id, max_turns=5)
+        history_a.add_turn("from a", "answer")
+        self.assertEqual(human_texts(history_a), ["from a"])
+
+        # Unchanged: one count query confirms the buffer is current
+        with self.assertNumQueries(1):
+            self.assertEqual(human_texts(history_a), ["from a"])
+
+        history_b.add_turn("from b", "answer")
+        self.assertEqual(human_texts(history_a), ["from a", "from b"])
@@ -1,12 +1,19 @@
 from django.urls import path
+from django.views.decorators.csrf import csrf_exempt
 from . import views
-from .views import ChatAPIView, ConversationHistoryAPIView
+from .views import ChatAPIView, ChatStreamAPIView, AsyncChatAPIView, ConversationHistoryAPIView
 
 
 urlpatterns = [
     # POST endpoint to send a chat message and receive a response
     path('', views.ChatAPIView.as_view(), name='chat-api'),
 
+    # POST endpoint streaming the response as Server-Sent Events
+    path('stream/', ChatStreamAPIView.as_view(), name='chat-stream'),
+
+    # Async POST endpoint (same contract as chat-api), for ASGI deployments
+    path('async/', csrf_exempt(AsyncChatAPIView.as_view()), name='chat-api-async'),
+
     # GET endpoint to fetch past conversation history
     path('history/', ConversationHistoryAPIView.as_view(), name='chat-history'),
 ]
@@ -0,0 +1,150 @@
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import Counter
+from typing import List, Optional
+
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS answers (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    corpus_version TEXT NOT NULL,
+    chunk_key TEXT NOT NULL,
+    question TEXT NOT NULL,
+    embedding BLOB NOT NULL,
+    answer TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    last_hit_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS answers_lookup ON answers (corpus_version, chunk_key);
+CREATE INDEX IF NOT EXISTS answers_lru ON answers (last_hit_at);
+"""
+
+
+def chunk_key(chunk_ids: List[str]) -> str:
+    """
+    Order-independent key for the set of retrieved chunk IDs.
+    """
+    return hashlib.sha1("\n".join(sorted(chunk_ids)).encode("utf-8")).hexdigest()
+
+
+class SemanticAnswerCache:
+    """
+    On-disk (SQLite) cache of final answers for near-duplicate standalone questions.
+
+    An entry matches when the corpus version and the set of retrieved chunk IDs are
+    identical and the cosine similarity between the question embeddings is at least
+    `threshold`. Entries expire after `ttl` seconds and the store is capped at
+    `max_entries` rows, evicting the least recently hit first. The SQLite file (WAL mode)
+    survives restarts and is shared by every worker on the host.
+    """
+
+    def __init__(self, path: str, threshold: float = 0.92, max_entries: int = 5000, ttl: float = 7 * 86400):
+        self.path = path
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self._stats = Counter()
+
+    def _connection(self) -> sqlite3.Connection:
+        # One connection per thread (and per process after a fork)
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _count(self, key: str) -> None:
+        with self._stats_lock:
+            self._stats[key] += 1
+
+    def lookup(self, vector: List[float], chunk_ids: List[str], corpus_version: str) -> Optional[str]:
+        """
+        Return the cached answer for a similar question over the same chunks, or None.
+        """
+        try:
+            conn = self._connection()
+            rows = conn.execute(
+                "SELECT id, embedding FROM answers "
+                "WHERE corpus_version = ? AND chunk_key = ? AND created_at >= ?",
+                (corpus_version, chunk_key(chunk_ids), time.time() - self.ttl),
+            ).fetchall()
+
+            if rows:
+                query = np.array(vector, dtype=np.float32)
+                query /= np.linalg.norm(query) or 1.0
+                stored = np.vstack([np.frombuffer(blob, dtype=np.float32) for _, blob in rows])
+                similarities = stored @ query
+                best = int(np.argmax(similarities))
+
+                if similarities[best] >= self.threshold:
+                    entry_id = rows[best][0]
+                    conn.execute("UPDATE answers SET last_hit_at = ? WHERE id = ?", (time.time(), entry_id))
+                    answer = conn.execute("SELECT answer FROM answers WHERE id = ?", (entry_id,)).fetchone()
+                    if answer:
+                        self._count("hits")
+                        return answer[0]
+
+            self._count("misses")
+            return None
+
+        except (sqlite3.Error, ValueError) as e:
+            logger.error(f"Semantic cache lookup failed: {e}")
+            self._count("errors")
+            return None
+
+    def store(self, question: str, vector: List[float], chunk_ids: List[str], corpus_version: str, answer: str) -> None:
+        """
+        Store an answer, then drop expired rows and evict down to `max_entries`.
+        """
+        try:
+            embedding = np.array(vector, dtype=np.float32)
+            embedding /= np.linalg.norm(embedding) or 1.0
+            now = time.time()
+
+            conn = self._connection()
+            conn.execute(
+                "INSERT INTO answers (corpus_version, chunk_key, question, embedding, answer, created_at, last_hit_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (corpus_version, chunk_key(chunk_ids), question, embedding.tobytes(), answer, now, now),
+            )
+            conn.execute(
+                "DELETE FROM answers WHERE created_at < ? OR corpus_version != ?",
+                (now - self.ttl, corpus_version),
+            )
+            conn.execute(
+                "DELETE FROM answers WHERE id IN ("
+                "SELECT id FROM answers ORDER BY last_hit_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self._count("stores")
+
+        except (sqlite3.Error, ValueError) as e:
+            logger.error(f"Semantic cache store failed: {e}")
+            self._count("errors")
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {"enabled": settings.SEMANTIC_CACHE_ENABLED, **self._stats}
+
+
+# Process-wide handle; the SQLite file is opened lazily on first use
+semantic_cache = SemanticAnswerCache(
+    settings.SEMANTIC_CACHE_PATH,
+    threshold=settings.SEMANTIC_CACHE_THRESHOLD,
+    max_entries=settings.SEMANTIC_CACHE_MAX_ENTRIES,
+    ttl=settings.SEMANTIC_CACHE_TTL,
+)
@@ -0,0 +1,140 @@
+import re
+import unicodedata
+from collections import Counter
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+from scipy import sparse
+
+# Word characters plus Devanagari vowel signs/viramas (which `\w` alone splits on),
+# excluding the danda punctuation marks (U+0964, U+0965)
+TOKEN_PATTERN = re.compile(r"[\w\u0900-\u0963\u0966-\u097F]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Tokenizer shared by indexing and querying: NFC-normalize, case-fold and split on
+    anything that is not a word character. Keeps Hindi/Marathi words intact.
+    """
+    return TOKEN_PATTERN.findall(unicodedata.normalize("NFC", text).casefold())
+
+
+class SparseBM25Index:
+    """
+    Okapi BM25 over a precomputed inverted index.
+
+    Postings are stored as a CSR matrix with one row per term and one column per document,
+    holding the full per-posting BM25 weight (idf * saturated tf with length normalization).
+    A query therefore only reads the posting rows of its own terms and sums them in
+    vectorized form, touching only documents that contain at least one query term.
+    """
+
+    def __init__(self, terms: List[str], postings: sparse.csr_matrix, doc_len: np.ndarray, k1: float, b: float):
+        self.terms = list(terms)
+        self.vocab: Dict[str, int] = {term: i for i, term in enumerate(self.terms)}
+        self.postings = postings
+        self.doc_len = doc_len
+        self.k1 = k1
+        self.b = b
+
+    @property
+    def num_docs(self) -> int:
+        return self.postings.shape[1]
+
+    @classmethod
+    def build(cls, texts: Iterable[str], k1: float = 1.5, b: float = 0.75) -> "SparseBM25Index":
+        """
+        Build the index from document texts (document i is column i).
+        """
+        vocab: Dict[str, int] = {}
+        rows, cols, tfs, doc_len = [], [], [], []
+
+        for doc_id, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            doc_len.append(sum(counts.values()))
+            for term, tf in counts.items():
+                rows.append(vocab.setdefault(term, len(vocab)))
+                cols.append(doc_id)
+                tfs.append(tf)
+
+        terms = [None] * len(vocab)
+        for term, i in vocab.items():
+            terms[i] = term
+
+        return cls.from_counts(terms, rows, cols, tfs, doc_len, k1=k1, b=b)
+
+    @classmethod
+    def from_counts(cls, terms, rows, cols, tfs, doc_len, k1: float = 1.5, b: float = 0.75) -> "SparseBM25Index":
+        """
+        Build the index from (term row, document column, term frequency) triples.
+        """
+        doc_len = np.asarray(doc_len, dtype=np.float32)
+        n_docs, n_terms = len(doc_len), len(terms)
+
+        tf = sparse.csr_matrix(
+            (np.asarray(tfs, dtype=np.float32), (np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64))),
+            shape=(n_terms, n_docs),
+        )
+        tf.sum_duplicates()
+        tf.sort_indices()
+
+        # Document frequency is the posting-list length of each term row
+        df = np.diff(tf.indptr).astype(np.float32)
+        idf = np.log1p((n_docs - df + 0.5) / (df + 0.5))
+
+        avgdl = (float(doc_len.mean()) if n_docs else 0.0) or 1.0
+        term_of_posting = np.repeat(np.arange(n_terms), np.diff(tf.indptr))
+        norm = k1 * (1.0 - b + b * doc_len[tf.indices] / avgdl)
+        tf.data = idf[term_of_posting] * tf.data * (k1 + 1.0) / (tf.data + norm)
+
+        return cls(terms, tf, doc_len, k1, b)
+
+    def search(self, query: str, k: int) -> List[Tuple[int, float]]:
+        """
+        Return up to k (document index, BM25 score) pairs, best first.
+        """
+        term_ids = [self.vocab[t] for t in tokenize(query) if t in self.vocab]
+        if not term_ids:
+            return []
+
+        indptr = self.postings.indptr
+        spans = [(indptr[t], indptr[t + 1]) for t in term_ids]
+        doc_ids = np.concatenate([self.postings.indices[s:e] for s, e in spans])
+        weights = np.concatenate([self.postings.data[s:e] for s, e in spans])
+
+        docs, inverse = np.unique(doc_ids, return_inverse=True)
+        scores = np.bincount(inverse, weights=weights)
+
+        if len(docs) > k:
+            top = np.argpartition(-scores, k)[:k]
+        else:
+            top = np.arange(len(docs))
+        top = top[np.argsort(-scores[top])]
+        return [(int(docs[i]), float(scores[i])) for i in top]
+
+    def save(self, path: str) -> None:
+        """
+        Serialize to a single .npz file (no pickling).
+        """
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                terms=np.array(self.terms, dtype=str),
+                indptr=self.postings.indptr,
+                indices=self.postings.indices,
+                data=self.postings.data,
+                doc_len=self.doc_len,
+                params=np.array([self.k1, self.b]),
+            )
+
+    @classmethod
+    def load(cls, path: str) -> "SparseBM25Index":
+        with np.load(path, allow_pickle=False) as npz:
+            terms = npz["terms"].tolist()
+            doc_len = npz["doc_len"]
+            postings = sparse.csr_matrix(
+                (npz["data"], npz["indices"], npz["indptr"]),
+                shape=(len(terms), len(doc_len)),
+            )
+            k1, b = npz["params"].tolist()
+        return cls(terms, postings, doc_len, k1, b)
@@ -1,19 +1,31 @@
 import re
 import uuid
 import json
+import queue
+import asyncio
+import time
 import logging
-from collections import defaultdict
-from datetime import datetime, timedelta
-from typing import Optional, Dict, Any, List
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, List, Iterator, Tuple
 
 from django.conf import settings
-from google import genai
-from google.genai.types import GenerateContentConfig
+from django.utils import timezone
+from google.genai.types import GenerateContentConfig, HttpOptions
 from google.api_core import exceptions as google_exceptions
 from google.api_core.exceptions import GoogleAPICallError
 
-from chat.models import ClientUser, Conversation
-from chat.utils.data_processor import setup_vector_db
+from chat.utils.lifecycle import lifecycle
+from chat.utils.identity_cache import identity_cache
+from chat.utils.session_store import user_sessions, session_backend, shared_state
+from chat.utils import rewrite_gate
+from chat.utils.retrieval_cache import normalize_query
+from chat.utils.answer_cache import semantic_cache
+from chat.utils.llm_gateway import llm_gateway, LLMQueueTimeout
+from chat.utils.resilience import gemini_breaker, rewrite_caller, generation_caller, is_upstream_failure
+from chat.utils.guide_fallback import degraded_response
+from chat.utils.metrics import timed, span, record_error, bind_context
+from chat.utils.streaming import PartialAnswerParser
 from chat.utils.langchain_memory import DjangoChatMessageHistory
 from langchain.memory import ConversationBufferWindowMemory
 from langchain.schema import HumanMessage, Document
@@ -23,94 +35,207 @@ from django.db import DatabaseError
 # Initialize logger
 logger = logging.getLogger(__name__)
 
-# Constants for Gemini API
-GEMINI_CLIENT = genai.Client(api_key=settings.GEMINI_API_KEY)
+# Constants for Gemini API (the client itself is owned by `lifecycle`)
 GEMINI_MODEL = "gemini-2.0-flash"
 TEMPERATURE = 0.4
 MAX_OUTPUT_TOKENS = 1024
 REWRITE_TEMPERATURE = 0.1
 REWRITE_MAX_TOKENS = 64
+GENERATION_MODE_CHAT = "chat"
+GENERATION_MODE_STATELESS = "stateless"
 
-# Load the FAISS and BM25 retrievers, and combined documents
-retriever, vector_db, bm25_index, Documents = setup_vector_db()
+# Rewrite outcomes (turn["rewrite"]["status"]); only these leave a query that is known
+# not to depend on the user's history, so only they may use the shared answer cache
+REWRITE_STANDALONE = "standalone"  # no history, or the gate classified it as standalone
+REWRITE_DONE = "rewritten"  # Gemini rewrite ran and returned a question
+REWRITE_SKIPPED = "skipped"  # circuit open: the raw text was used without a rewrite
+REWRITE_FAILED = "failed"  # the rewrite errored, timed out or came back empty
+CACHEABLE_REWRITES = (REWRITE_STANDALONE, REWRITE_DONE)
 
-# In-memory user session store (used to manage per-user chat and memory)
-user_sessions = defaultdict(lambda: {
-    "chat": None,
-    "language": "en",
-    "profile": {"name": None, "greeted": False},
-    "last_activity": datetime.now(),
-    "session_id": None,
-    "memory": None
-})
+# Shared, bounded pool for retrieval work taken off the request thread
+_retrieval_executor = ThreadPoolExecutor(
+    max_workers=settings.RETRIEVAL_WORKERS,
+    thread_name_prefix="retrieval"
+)
+_speculation_lock = threading.Lock()
+_speculation_stats = Counter()
 
-def rewrite_query(user_input: str, memory: ConversationBufferWindowMemory, client_user_id: str) -> str:
+
+def _set_outcome(outcome: Optional[Dict[str, Any]], status: str) -> None:
+    if outcome is not None:
+        outcome["status"] = status
+
+
+def _rewrite_needed(user_input: str, history_msgs: list, client_user_id: str,
+                    outcome: Optional[Dict[str, Any]] = None) -> bool:
+    """
+    Decide (and record) whether the Gemini rewrite has to run for this message.
+    """
+    if not history_msgs:
+        logger.info(f"[{client_user_id}] No history → returning original query")
+        rewrite_gate.record(False, "no_history")
+        _set_outcome(outcome, REWRITE_STANDALONE)
+        return False
+
+    # Gemini is unavailable: answer from the original query rather than waiting on it
+    if gemini_breaker.is_open:
+        logger.info(f"[{client_user_id}] Gemini circuit open → returning original query")
+        rewrite_gate.record(False, "circuit_open")
+        _set_outcome(outcome, REWRITE_SKIPPED)
+        return False
+
+    # Skip the Gemini round trip for messages that are clearly standalone
+    reason = "gate_disabled"
+    if settings.REWRITE_GATE_ENABLED:
+        embed = lifecycle.retriever.embed_query if lifecycle.retriever else None
+        needed, reason = rewrite_gate.needs_rewrite(user_input, history_msgs, embed=embed)
+        if not needed:
+            logger.info(f"[{client_user_id}] Rewrite skipped ({reason}) → returning original query")
+            rewrite_gate.record(False, reason)
+            _set_outcome(outcome, REWRITE_STANDALONE)
+            return False
+
+    rewrite_gate.record(True, reason)
+    return True
+
+
+def build_rewrite_prompt(user_input: str, history_msgs: list) -> str:
+    """
+    Gemini prompt asking for a standalone version of a follow-up question.
+    """
+    # Format conversation history
+    history_str = "\n".join(
+        f"{'User' if isinstance(m, HumanMessage) else 'Assistant'}: {m.content}"
+        for m in history_msgs
+    )
+
+    return (
+        "You are given a chat history and a new user input. "
+        "rephrase it as a standalone question preserving its original meaning and language. "
+        "If the user input is not a follow-up (e.g., greetings, thanks, or a standalone question that does not depend on history), "
+        "return it exactly as-is without modification. Return ONLY the rewritten question or the original input.\n\n"
+        "Examples:\n"
+        "1. Follow-up: 'What about the second one?'\n"
+        "   Standalone: 'What about the second symptom of mastitis?'\n"
+        "2. Follow-up: 'How do I fix that?'\n"
+        "   Standalone: 'How do I fix the milk collection error?'\n"
+        "3. Input: 'Hello'\n"
+        "   Standalone: 'Hello'\n"
+        "4. Input: 'Thanks for the info.'\n"
+        "   Standalone: 'Thanks for the info.'\n"
+        "5. Input: 'What is mastitis?'\n"
+        "   Standalone: 'What is mastitis?'\n"
+        "6. Follow-up: 'And the third step?'\n"
+        "   Standalone: 'What is the third step to configure the milk collection schedule?'\n\n"
+        f"Chat History:\n{history_str}\n\n"
+        f"User Input: {user_input}\n"
+        "Standalone Question:"
+    )
+
+
+def _http_timeout(seconds: float) -> HttpOptions:
+    # google-genai takes the HTTP timeout in milliseconds
+    return HttpOptions(timeout=int(seconds * 1000))
+
+
+def _rewrite_config() -> GenerateContentConfig:
+    return GenerateContentConfig(
+        temperature=REWRITE_TEMPERATURE,
+        max_output_tokens=REWRITE_MAX_TOKENS,
+        http_options=_http_timeout(settings.GEMINI_REWRITE_TIMEOUT),
+    )
+
+
+def _parse_rewrite(response, user_input: str, client_user_id: str,
+                   outcome: Optional[Dict[str, Any]] = None) -> str:
+    rewritten = response.text.strip('"').strip() if response and response.text else ""
+    if rewritten:
+        logger.info(f"[{client_user_id}] Rewrite successful: '{user_input}' → '{rewritten}'")
+        _set_outcome(outcome, REWRITE_DONE)
+        return rewritten
+
+    logger.warning(f"[{client_user_id}] Empty rewrite response for: '{user_input}'")
+    _set_outcome(outcome, REWRITE_FAILED)
+    return user_input
+
+
+@timed("rewrite")
+def rewrite_query(user_input: str, memory: ConversationBufferWindowMemory, client_user_id: str,
+                  outcome: Optional[Dict[str, Any]] = None) -> str:
     """
     Rewrite a follow-up question using past memory to make it standalone.
-    If history is not available, return original user input.
+    If history is not available, or the local rewrite gate judges the message to be
+    standalone already, return original user input without calling Gemini.
+    `outcome["status"]` is set to one of the REWRITE_* outcomes.
     """
     try:
         # Get conversation history
         mem_vars = memory.load_memory_variables({})
         history_msgs = mem_vars.get("history", [])
 
-        if not history_msgs:
-            logger.info(f"[{client_user_id}] No history → returning original query")
+        if not _rewrite_needed(user_input, history_msgs, client_user_id, outcome):
             return user_input
 
-        # Format conversation history
-        history_str = "\n".join(
-            f"{'User' if isinstance(m, HumanMessage) else 'Assistant'}: {m.content}"
-            for m in history_msgs
-        )
+        prompt = build_rewrite_prompt(user_input, history_msgs)
+        config = _rewrite_config()
+        response = rewrite_caller.call(lambda hedged: llm_gateway.generate(
+            lifecycle.gemini_client,
+            model=GEMINI_MODEL,
+            contents=prompt,
+            config=config,
+            coalesce=not hedged
+        ))
+        return _parse_rewrite(response, user_input, client_user_id, outcome)
 
-        # Gemini prompt for rewriting the question
-        prompt = (
-            "You are given a chat history and a new user input. "
-            "rephrase it as a standalone question preserving its original meaning and language. "
-            "If the user input is not a follow-up (e.g., greetings, thanks, or a standalone question that does not depend on history), "
-            "return it exactly as-is without modification. Return ONLY the rewritten question or the original input.\n\n"
-            "Examples:\n"
-            "1. Follow-up: 'What about the second one?'\n"
-            "   Standalone: 'What about the second symptom of mastitis?'\n"
-            "2. Follow-up: 'How do I fix that?'\n"
-            "   Standalone: 'How do I fix the milk collection error?'\n"
-            "3. Input: 'Hello'\n"
-            "   Standalone: 'Hello'\n"
-            "4. Input: 'Thanks for the info.'\n"
-            "   Standalone: 'Thanks for the info.'\n"
-            "5. Input: 'What is mastitis?'\n"
-            "   Standalone: 'What is mastitis?'\n"
-            "6. Follow-up: 'And the third step?'\n"
-            "   Standalone: 'What is the third step to configure the milk collection schedule?'\n\n"
-            f"Chat History:\n{history_str}\n\n"
-            f"User Input: {user_input}\n"
-            "Standalone Question:"
-        )
+    except GoogleAPICallError as e:
+        record_error("rewrite", e)
+        logger.error(f"Gemini API error in rewrite_query: {str(e)}")
+        _set_outcome(outcome, REWRITE_FAILED)
+        return user_input
+    except Exception as e:
+        record_error("rewrite", e)
+        logger.error(f"Unexpected error in rewrite_query: {str(e)}")
+        _set_outcome(outcome, REWRITE_FAILED)
+        return user_input
 
-        rewrite_chat = GEMINI_CLIENT.chats.create(
-            model=GEMINI_MODEL,
-            config=GenerateContentConfig(
-                temperature=REWRITE_TEMPERATURE,
-                max_output_tokens=REWRITE_MAX_TOKENS,
-            )
-        )
 
-        response = rewrite_chat.send_message(prompt)
+@timed("rewrite")
+async def arewrite_query(user_input: str, memory: ConversationBufferWindowMemory, client_user_id: str,
+                         outcome: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Async version of rewrite_query using the async ORM and the async Gemini client.
+    """
+    try:
+        # Same window ConversationBufferWindowMemory applies (k exchanges)
+        history_msgs = _window(await memory.chat_memory.aget_messages(), memory.k)
 
-        if response and response.text:
-            rewritten = response.text.strip('"').strip()
-            logger.info(f"[{client_user_id}] Rewrite successful: '{user_input}' → '{rewritten}'")
-            return rewritten
+        loop = asyncio.get_running_loop()
+        needed = await loop.run_in_executor(
+            _retrieval_executor, bind_context(_rewrite_needed, user_input, history_msgs, client_user_id, outcome)
+        )
+        if not needed:
+            return user_input
 
-        logger.warning(f"[{client_user_id}] Empty rewrite response for: '{user_input}'")
-        return user_input
+        prompt = build_rewrite_prompt(user_input, history_msgs)
+        config = _rewrite_config()
+        response = await rewrite_caller.acall(lambda hedged: llm_gateway.agenerate(
+            lifecycle.gemini_client,
+            model=GEMINI_MODEL,
+            contents=prompt,
+            config=config,
+            coalesce=not hedged
+        ))
+        return _parse_rewrite(response, user_input, client_user_id, outcome)
 
     except GoogleAPICallError as e:
-        logger.error(f"Gemini API error in rewrite_query: {str(e)}")
+        record_error("rewrite", e)
+        logger.error(f"Gemini API error in arewrite_query: {str(e)}")
+        _set_outcome(outcome, REWRITE_FAILED)
         return user_input
     except Exception as e:
-        logger.error(f"Unexpected error in rewrite_query: {str(e)}")
+        record_error("rewrite", e)
+        logger.error(f"Unexpected error in arewrite_query: {str(e)}")
+        _set_outcome(outcome, REWRITE_FAILED)
         return user_input
 
 
@@ -251,109 +376,485 @@ def get_greeting(profile):
     return ""
 
 
-# Thread-safe session purge mechanism
-_sessions_lock = threading.Lock()
+def _create_memory(session_id: str) -> ConversationBufferWindowMemory:
+    return ConversationBufferWindowMemory(
+        memory_key="history",
+        chat_memory=DjangoChatMessageHistory(session_id=session_id, max_turns=settings.CHAT_HISTORY_TURNS),
+        return_messages=True,
+        k=settings.CHAT_HISTORY_TURNS
+    )
+
 
-def purge_old_sessions():
+def _stateful_chat() -> bool:
+    return settings.GEMINI_GENERATION_MODE == GENERATION_MODE_CHAT
+
+
+def _generation_config(sess: Dict[str, Any]) -> GenerateContentConfig:
     """
-    Remove sessions inactive for over 2 hours to conserve memory.
+    Generation config for a session; the system text (with the one-time greeting)
+    is fixed on the session's first generation.
     """
-    cutoff = datetime.now() - timedelta(minutes=120)
-    for uid, sess in list(user_sessions.items()):
-        if sess["last_activity"] < cutoff:
-            del user_sessions[uid]
+    if sess.get("system_text") is None:
+        sess["system_text"] = get_greeting(sess["profile"]) + get_system_instruction()
+    return GenerateContentConfig(
+        system_instruction=sess["system_text"],
+        temperature=TEMPERATURE,
+        max_output_tokens=MAX_OUTPUT_TOKENS,
+        http_options=_http_timeout(settings.GEMINI_TIMEOUT),
+    )
 
 
-def initialize_session(client_user_id: str, client_user_name: str) -> None:
+def _local_session(client_user_id: str, client_user_name: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
     """
-    Create a new session if not already active.
-    Load chat memory from Django DB, initialize Gemini chat client.
+    Fetch (or create) the in-memory session and mark it active. Returns the session and
+    its shared state to claim (with a new session_id if it has none yet).
+    Idle sessions are dropped by the session store's background reaper.
     """
-    purge_old_sessions()
-    with _sessions_lock:
-        sess: dict[str, Any] = user_sessions[client_user_id]
-        sess["last_activity"] = datetime.now()
+    sess: dict[str, Any] = user_sessions.touch(client_user_id)
+    with user_sessions.lock_for(client_user_id):
         sess["profile"]["name"] = client_user_name
+        proposed = shared_state(sess)
+        proposed["session_id"] = proposed["session_id"] or str(uuid.uuid4())
+        proposed["profile"] = dict(proposed["profile"])
+        return sess, proposed
 
-        if not sess.get("session_id"):
-            sess["session_id"] = str(uuid.uuid4())
 
-        # Create DB entries for ClientUser and Conversation
-        try:
-            client_user, _ = ClientUser.objects.get_or_create(
-                user_id=client_user_id,
-                defaults={"name": client_user_name}
-            )
-            Conversation.objects.get_or_create(
-                session_id=sess["session_id"],
-                defaults={"client_user": client_user}
-            )
-        except DatabaseError as e:
-            logger.error("DB init failed for %s: %s", client_user_id, e)
-
-        # Initialize Gemini chat and memory only once
-        if sess.get("chat") is None and sess.get("memory") is None:
-            memory = ConversationBufferWindowMemory(
-                memory_key="history",
-                chat_memory=DjangoChatMessageHistory(session_id=sess["session_id"]),
-                return_messages=True,
-                window_size=5
-            )
-            sess["memory"] = memory
+def _merge_state(client_user_id: str, sess: Dict[str, Any], proposed: Dict[str, Any],
+                 claimed: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Merge the shared state read for this turn into the session. Shared values win (another
+    worker may have changed them), except the user's name from this request and the
+    greeted flag, which stays set once any worker has greeted. Returns the merged state
+    when the shared copy is missing something of this session's, or is due a keep-alive
+    write (every SESSION_SYNC_INTERVAL seconds), else None.
+    """
+    with user_sessions.lock_for(client_user_id):
+        if sess.get("session_id") and sess["session_id"] != claimed["session_id"]:
+            # The shared session expired and was restarted: drop state tied to the old one
+            sess.update(memory=None, chat=None, aio_chat=None, system_text=None)
+        profile = claimed.get("profile") or {}
+        sess["session_id"] = claimed["session_id"]
+        sess["language"] = claimed.get("language") or sess["language"]
+        sess["profile"] = {
+            **sess["profile"],
+            **profile,
+            "name": sess["profile"]["name"],
+            "greeted": bool(sess["profile"].get("greeted") or profile.get("greeted")),
+        }
+        state = shared_state(sess)
+        state["profile"] = dict(state["profile"])
+        sess["synced_state"] = state
+        if claimed is proposed:
+            # Just written by the backend
+            sess["synced_at"] = time.monotonic()
+            return None
+        if state == claimed and time.monotonic() - sess.get("synced_at", 0.0) <= settings.SESSION_SYNC_INTERVAL:
+            return None
+        sess["synced_at"] = time.monotonic()
+        return state
+
+
+def _unsynced_state(client_user_id: str, sess: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    The session's shared state if this turn changed it (e.g. used the greeting), else None.
+    """
+    with user_sessions.lock_for(client_user_id):
+        state = shared_state(sess)
+        state["profile"] = dict(state["profile"])
+        return None if state == sess.get("synced_state") else state
+
+
+def _sync_session(client_user_id: str, sess: Dict[str, Any], proposed: Dict[str, Any]) -> None:
+    """
+    Read the user's shared state, merge it into the session and write back the result
+    if the shared copy needs it.
+    """
+    state = _merge_state(client_user_id, sess, proposed, session_backend.claim(client_user_id, proposed))
+    if state is not None:
+        session_backend.save(client_user_id, state)
+
+
+async def _async_session(client_user_id: str, sess: Dict[str, Any], proposed: Dict[str, Any]) -> None:
+    """
+    Async version of _sync_session.
+    """
+    state = _merge_state(client_user_id, sess, proposed, await session_backend.aclaim(client_user_id, proposed))
+    if state is not None:
+        await session_backend.asave(client_user_id, state)
+
+
+def _touch_session(client_user_id: str, client_user_name: str) -> Dict[str, Any]:
+    """
+    Fetch (or create) the session, continuing the user's shared session (same
+    session_id, profile) if another worker or an earlier process started one.
+    The shared state is re-read on every turn, so changes made by other workers
+    are picked up instead of overwritten.
+    """
+    sess, proposed = _local_session(client_user_id, client_user_name)
+    try:
+        _sync_session(client_user_id, sess, proposed)
+    except DatabaseError as e:
+        logger.error(f"Session backend unavailable for {client_user_id}: {e}")
+        _merge_state(client_user_id, sess, proposed, proposed)
+    return sess
+
 
-            system_text = get_greeting(sess["profile"]) + get_system_instruction()
-            sess["chat"] = GEMINI_CLIENT.chats.create(
+async def _atouch_session(client_user_id: str, client_user_name: str) -> Dict[str, Any]:
+    """
+    Async version of _touch_session.
+    """
+    sess, proposed = _local_session(client_user_id, client_user_name)
+    try:
+        await _async_session(client_user_id, sess, proposed)
+    except DatabaseError as e:
+        logger.error(f"Session backend unavailable for {client_user_id}: {e}")
+        _merge_state(client_user_id, sess, proposed, proposed)
+    return sess
+
+
+@timed("session")
+def initialize_session(client_user_id: str, client_user_name: str) -> Dict[str, Any]:
+    """
+    Create a new session if not already active.
+    Load chat memory from Django DB, initialize Gemini chat client.
+    """
+    sess = _touch_session(client_user_id, client_user_name)
+
+    # Create DB entries for ClientUser and Conversation (cached after the first turn)
+    try:
+        identity_cache.ensure(client_user_id, client_user_name, sess["session_id"])
+    except DatabaseError as e:
+        identity_cache.forget(client_user_id, sess["session_id"])
+        logger.error("DB init failed for %s: %s", client_user_id, e)
+
+    with user_sessions.lock_for(client_user_id):
+        # Initialize memory (and the Gemini chat in "chat" mode) only once
+        if sess.get("memory") is None:
+            sess["memory"] = _create_memory(sess["session_id"])
+        if _stateful_chat() and sess.get("chat") is None:
+            sess["chat"] = lifecycle.gemini_client.chats.create(
                 model=GEMINI_MODEL,
-                config=GenerateContentConfig(
-                    system_instruction=system_text,
-                    temperature=TEMPERATURE,
-                    max_output_tokens=MAX_OUTPUT_TOKENS,
-                )
+                config=_generation_config(sess)
             )
+    return sess
 
 
-def retrieve_documents(user_text: str, faiss_retriever, bm25_retriever, k: int = 4) -> List[Document]:
+@timed("session")
+async def ainitialize_session(client_user_id: str, client_user_name: str) -> Dict[str, Any]:
     """
-    Retrieve and combine top-k documents from both FAISS and BM25 retrievers.
-    Deduplicates based on page content or source.
+    Async version of initialize_session: DB rows are created with the async ORM and, in
+    "chat" mode, the session gets an async Gemini chat. The session shard lock is never
+    held across an await.
     """
+    sess = await _atouch_session(client_user_id, client_user_name)
+
+    # Create DB entries for ClientUser and Conversation (cached after the first turn)
     try:
-        vector_docs = faiss_retriever.invoke(user_text)
-        bm25_docs = bm25_retriever.invoke(user_text)
+        await identity_cache.aensure(client_user_id, client_user_name, sess["session_id"])
+    except DatabaseError as e:
+        identity_cache.forget(client_user_id, sess["session_id"])
+        logger.error("DB init failed for %s: %s", client_user_id, e)
+
+    with user_sessions.lock_for(client_user_id):
+        if sess.get("memory") is None:
+            sess["memory"] = _create_memory(sess["session_id"])
+        if _stateful_chat() and sess.get("aio_chat") is None:
+            sess["aio_chat"] = lifecycle.gemini_client.aio.chats.create(
+                model=GEMINI_MODEL,
+                config=_generation_config(sess)
+            )
+    return sess
 
-        seen, combined = set(), []
-        for doc in vector_docs + bm25_docs:
-            key = doc.metadata.get('source') or doc.page_content[:100]
-            if key not in seen:
-                seen.add(key)
-                combined.append(doc)
 
-        logger.info(f"Retrieved {min(len(combined), k)} documents for query: '{user_text}'")
-        return combined[:k]
+@timed("retrieval")
+def retrieve_documents(user_text: str, retriever, k: int = 4) -> List[Document]:
+    """
+    Retrieve the top-k chunks for a query from the hybrid (FAISS + BM25) retriever.
+    Candidates from both indexes are fused by score and deduplicated by chunk ID.
+    """
+    try:
+        results = retriever.search(user_text, k=k)
+        logger.info(
+            f"Retrieved {len(results)} documents for query: '{user_text}' "
+            f"(scores: {[round(score, 4) for _, score in results]})"
+        )
+        return [doc for doc, _ in results]
 
     except Exception as e:
         logger.error(f"Document retrieval failed: {e}")
         return []
 
 
-def text_pipeline_session(user_text: str, client_user_id: str, profile_update: Optional[Dict[str, Any]] = None) -> str:
+def _same_query(original: str, rewritten: str) -> bool:
     """
-    Main pipeline for handling a user message.
-    1. Initializes session
-    2. Handles greetings/thanks
-    3. Rewrites the query (if needed)
-    4. Retrieves context documents
-    5. Builds prompt and sends to Gemini
-    6. Saves memory and returns JSON response
+    True if the rewrite left the query unchanged, or changed it so little
+    (by embedding similarity) that the original retrieval results still apply.
     """
-    purge_old_sessions()
-    with _sessions_lock:
-        sess = user_sessions[client_user_id]
-        sess["last_activity"] = datetime.now()
+    if normalize_query(original) == normalize_query(rewritten):
+        return True
+    try:
+        retriever = lifecycle.retriever
+        similarity = rewrite_gate.cosine_similarity(retriever.embed_query(original), retriever.embed_query(rewritten))
+        return similarity >= settings.SPECULATIVE_REUSE_SIMILARITY
+    except Exception as e:
+        logger.error(f"Speculative similarity check failed: {e}")
+        return False
 
-    name = profile_update.get("name") if profile_update else f"User_{client_user_id}"
-    initialize_session(client_user_id, name)
 
+def speculative_rewrite_and_retrieve(user_text: str, memory: ConversationBufferWindowMemory,
+                                     client_user_id: str, k: int, outcome: Optional[Dict[str, Any]] = None) -> tuple:
+    """
+    Start retrieval for the raw user text on the retrieval pool while rewrite_query runs.
+    If the rewrite comes back (nearly) unchanged the speculative results are used directly;
+    otherwise only the rewritten query is retrieved.
+    Returns (rewritten_query, documents).
+    """
+    speculative = _retrieval_executor.submit(bind_context(retrieve_documents, user_text, lifecycle.retriever, k))
+    rewritten = rewrite_query(user_text, memory, client_user_id, outcome)
+
+    if _same_query(user_text, rewritten):
+        _record_speculation("reused", client_user_id)
+        docs = speculative.result()
+    else:
+        _record_speculation("discarded", client_user_id)
+        speculative.cancel()
+        docs = retrieve_documents(rewritten, lifecycle.retriever, k=k)
+
+    return rewritten, docs
+
+
+async def aspeculative_rewrite_and_retrieve(user_text: str, memory: ConversationBufferWindowMemory,
+                                            client_user_id: str, k: int,
+                                            outcome: Optional[Dict[str, Any]] = None) -> tuple:
+    """
+    Async version of speculative_rewrite_and_retrieve; retrieval runs on the retrieval pool.
+    """
+    loop = asyncio.get_running_loop()
+    retriever = lifecycle.retriever
+    speculative = loop.run_in_executor(_retrieval_executor, bind_context(retrieve_documents, user_text, retriever, k))
+    rewritten = await arewrite_query(user_text, memory, client_user_id, outcome)
+
+    if await loop.run_in_executor(_retrieval_executor, bind_context(_same_query, user_text, rewritten)):
+        _record_speculation("reused", client_user_id)
+        docs = await speculative
+    else:
+        _record_speculation("discarded", client_user_id)
+        speculative.cancel()
+        docs = await loop.run_in_executor(_retrieval_executor, bind_context(retrieve_documents, rewritten, retriever, k))
+
+    return rewritten, docs
+
+
+def _record_speculation(outcome: str, client_user_id: str) -> None:
+    with _speculation_lock:
+        _speculation_stats[outcome] += 1
+    logger.info(f"[{client_user_id}] Speculative retrieval {outcome}")
+
+
+def get_speculation_stats() -> dict:
+    with _speculation_lock:
+        return {"reused": _speculation_stats["reused"], "discarded": _speculation_stats["discarded"]}
+
+
+@timed("prompt_build")
+def build_prompt(question: str, docs: List[Document]) -> str:
+    """
+    Build the Gemini input for one turn from the retrieved context and the question.
+    """
+    context_parts = []
+    for doc in docs:
+        content = doc.page_content
+        if 'youtube_link' in doc.metadata:
+            content += f"\n[Available YouTube Tutorial: {doc.metadata['youtube_link']}]"
+        context_parts.append(content)
+
+    context = "\n\n".join(context_parts) if context_parts else "No relevant context found."
+
+    return (
+        f"**Retrieved Context**\n{context}\n\n"
+        f"**Question**: {question}\n\n"
+        "Generate response:"
+    )
+
+
+def _window(messages: list, k: int) -> list:
+    """
+    Last k exchanges (2k messages), the window ConversationBufferWindowMemory applies.
+    """
+    return messages[-k * 2:] if k > 0 else []
+
+
+def build_contents(history_msgs: list, prompt: str) -> List[Dict[str, Any]]:
+    """
+    Gemini contents for a stateless call: the windowed history as alternating user/model
+    turns (plain questions and answers, without their retrieved context), then the
+    current prompt.
+    """
+    contents = [
+        {"role": "user" if isinstance(m, HumanMessage) else "model", "parts": [{"text": m.content}]}
+        for m in history_msgs
+    ]
+    contents.append({"role": "user", "parts": [{"text": prompt}]})
+    return contents
+
+
+def _log_usage(turn: Dict[str, Any], response) -> None:
+    """
+    Log per-call token counts, so input size can be checked over long sessions.
+    """
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return
+    logger.info(
+        f"[{turn['client_user_id']}] Gemini usage ({settings.GEMINI_GENERATION_MODE}): "
+        f"prompt_tokens={usage.prompt_token_count} output_tokens={usage.candidates_token_count} "
+        f"history_messages={len(turn.get('history') or [])}"
+    )
+
+
+@timed("generation")
+def generate_reply(turn: Dict[str, Any]) -> str:
+    """
+    Generate the answer for a prepared turn (raises on Gemini errors).
+    Retries, timeouts and hedging come from generation_caller. A stateful chat is never
+    hedged nor retried after a timeout (the timed-out send keeps running), since a
+    duplicate message would be appended to its history.
+    """
+    sess = turn["sess"]
+    if _stateful_chat():
+        def attempt(hedged):
+            with llm_gateway.slot():
+                return sess["chat"].send_message(turn["prompt"])
+    else:
+        contents = build_contents(turn["history"], turn["prompt"])
+        config = _generation_config(sess)
+
+        def attempt(hedged):
+            return llm_gateway.generate(
+                lifecycle.gemini_client,
+                model=GEMINI_MODEL,
+                contents=contents,
+                config=config,
+                coalesce=not hedged
+            )
+
+    reply = generation_caller.call(attempt, hedge=not _stateful_chat(),
+                                   retry_timeouts=not _stateful_chat())
+    _log_usage(turn, reply)
+    return reply.text.strip()
+
+
+@timed("generation")
+async def agenerate_reply(turn: Dict[str, Any]) -> str:
+    """
+    Async version of generate_reply.
+    """
+    sess = turn["sess"]
+    if _stateful_chat():
+        async def attempt(hedged):
+            async with llm_gateway.aslot():
+                return await sess["aio_chat"].send_message(turn["prompt"])
+    else:
+        contents = build_contents(turn["history"], turn["prompt"])
+        config = _generation_config(sess)
+
+        def attempt(hedged):
+            return llm_gateway.agenerate(
+                lifecycle.gemini_client,
+                model=GEMINI_MODEL,
+                contents=contents,
+                config=config,
+                coalesce=not hedged
+            )
+
+    reply = await generation_caller.acall(attempt, hedge=not _stateful_chat(),
+                                          retry_timeouts=not _stateful_chat())
+    _log_usage(turn, reply)
+    return reply.text.strip()
+
+
+def generate_reply_stream(turn: Dict[str, Any]) -> Iterator[str]:
+    """
+    Streaming version of generate_reply, yielding text fragments.
+    Streams are not coalesced, retried or hedged, but count towards the circuit breaker.
+    The upstream stream is drained by a pump thread into a buffer, so the gateway slot
+    is held only until Gemini has finished, not while a slow client reads the reply.
+    If the consumer stops early, the pump closes the upstream stream.
+    """
+    sess = turn["sess"]
+
+    def open_stream():
+        if _stateful_chat():
+            return sess["chat"].send_message_stream(turn["prompt"])
+        return lifecycle.gemini_client.models.generate_content_stream(
+            model=GEMINI_MODEL,
+            contents=build_contents(turn["history"], turn["prompt"]),
+            config=_generation_config(sess)
+        )
+
+    # Replies are capped at MAX_OUTPUT_TOKENS, so the buffer stays small
+    chunks = queue.Queue()
+    abandoned = threading.Event()
+
+    def pump():
+        try:
+            last = None
+            with span("generation"), llm_gateway.slot():
+                stream = generation_caller.stream(open_stream)
+                try:
+                    for chunk in stream:
+                        if abandoned.is_set():
+                            break
+                        last = chunk
+                        chunks.put(("text", chunk.text or ""))
+                finally:
+                    stream.close()
+            chunks.put(("done", last))
+        except BaseException as e:
+            chunks.put(("error", e))
+
+    threading.Thread(target=bind_context(pump), name="generation-stream", daemon=True).start()
+    try:
+        while True:
+            kind, value = chunks.get()
+            if kind == "text":
+                yield value
+            elif kind == "error":
+                raise value
+            else:
+                # Usage totals are reported on the final chunk
+                _log_usage(turn, value)
+                return
+    finally:
+        abandoned.set()
+
+
+def _new_turn(user_text: str, client_user_id: str) -> Dict[str, Any]:
+    return {
+        "user_text": user_text,
+        "client_user_id": client_user_id,
+        "request_at": timezone.now(),
+        "response": None,
+        "cache_args": None,
+        "rewrite": {"status": None},
+    }
+
+
+def _not_ready_response() -> str:
+    logger.error("Chat stack not ready: %s", lifecycle.error or "timed out")
+    return json.dumps({
+        "responseType": "basic",
+        "content": {
+            "answer": "The assistant is starting up. Please try again in a moment."
+        }
+    })
+
+
+@timed("canned_reply")
+def _canned_response(user_text: str) -> Optional[str]:
+    """
+    Fixed replies for greetings and thank-you messages (no retrieval or Gemini call).
+    """
     normalized = user_text.strip().lower()
 
     # Respond to greetings
@@ -374,70 +875,317 @@ def text_pipeline_session(user_text: str, client_user_id: str, profile_update: O
             }
         })
 
-    # Rewrite query to standalone form if it's a follow-up
-    rewritten = rewrite_query(user_text, sess["memory"], client_user_id)
+    return None
 
-    # Retrieve context from vector and BM25 indexes
-    docs = retrieve_documents(
-        rewritten,
-        faiss_retriever=vector_db.as_retriever(search_kwargs={"k": 4}),
-        bm25_retriever=bm25_index,
-        k=4
+
+@timed("semantic_cache")
+def _semantic_cache_lookup(turn: Dict[str, Any]) -> Optional[str]:
+    """
+    Look the turn up in the semantic answer cache. Only questions known to be standalone
+    are eligible: the gate classified them so (or there is no history), or the Gemini
+    rewrite ran and returned them unchanged. A follow-up the rewrite changed, or whose
+    rewrite was skipped or failed, may depend on history. Sets turn["cache_args"] so the
+    generated answer can be stored afterwards.
+    """
+    rewritten, docs = turn["rewritten"], turn["docs"]
+    if not (settings.SEMANTIC_CACHE_ENABLED and docs and turn["rewrite"]["status"] in CACHEABLE_REWRITES
+            and normalize_query(rewritten) == normalize_query(turn["user_text"])):
+        return None
+
+    turn["cache_args"] = (
+        lifecycle.retriever.embed_query(rewritten),
+        [doc.metadata["chunk_id"] for doc in docs],
+        lifecycle.retriever.corpus_version,
     )
+    cached = semantic_cache.lookup(*turn["cache_args"])
+    if cached is not None:
+        logger.info(f"[{turn['client_user_id']}] Semantic cache hit for: '{rewritten}'")
+    return cached
 
-    # Build full context string for Gemini input
-    context_parts = []
-    for doc in docs:
-        content = doc.page_content
-        if 'youtube_link' in doc.metadata:
-            content += f"\n[Available YouTube Tutorial: {doc.metadata['youtube_link']}]"
-        context_parts.append(content)
 
-    context = "\n\n".join(context_parts) if context_parts else "No relevant context found."
+def prepare_turn(user_text: str, client_user_id: str, profile_update: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Run every pipeline stage that happens before generation (session, greetings/thanks,
+    rewrite, retrieval, semantic cache, prompt build).
+    Returns a turn dict; if its "response" is set, the turn was answered without Gemini.
+    """
+    turn = _new_turn(user_text, client_user_id)
 
-    prompt = (
-        f"**Retrieved Context**\n{context}\n\n"
-        f"**Question**: {rewritten}\n\n"
-        "Generate response:"
-    )
+    # Wait for the background warm-up if a request arrives before it finished
+    if not lifecycle.ensure_ready(timeout=settings.CHAT_READY_TIMEOUT):
+        turn["response"] = _not_ready_response()
+        return turn
 
-    # Call Gemini API
-    try:
-        reply = sess["chat"].send_message(prompt)
-        response_text = reply.text.strip()
+    name = profile_update.get("name") if profile_update else f"User_{client_user_id}"
+    sess = initialize_session(client_user_id, name)
+    turn["sess"] = sess
+
+    turn["response"] = _canned_response(user_text)
+    if turn["response"] is not None:
+        return turn
+
+    if settings.SPECULATIVE_RETRIEVAL:
+        # Rewrite and retrieve concurrently, reusing the raw-text results when possible
+        rewritten, docs = speculative_rewrite_and_retrieve(
+            user_text, sess["memory"], client_user_id, k=settings.RETRIEVAL_TOP_K, outcome=turn["rewrite"]
+        )
+    else:
+        # Rewrite query to standalone form if it's a follow-up
+        rewritten = rewrite_query(user_text, sess["memory"], client_user_id, turn["rewrite"])
+
+        # Retrieve context from vector and BM25 indexes
+        docs = retrieve_documents(rewritten, lifecycle.retriever, k=settings.RETRIEVAL_TOP_K)
+
+    turn["rewritten"] = rewritten
+    turn["docs"] = docs
+
+    cached = _semantic_cache_lookup(turn)
+    if cached is not None:
+        sess["memory"].chat_memory.add_turn(user_text, cached, turn["request_at"])
+        turn["response"] = cached
+        return turn
+
+    if gemini_breaker.is_open:
+        logger.warning(f"[{client_user_id}] Gemini circuit open → degraded answer")
+        turn["response"] = degraded_response(docs)
+        finish_turn(turn, turn["response"], generated=False)
+        return turn
+
+    if not _stateful_chat():
+        turn["history"] = sess["memory"].load_memory_variables({}).get("history", [])
+    turn["prompt"] = build_prompt(rewritten, docs)
+    return turn
+
+
+async def aprepare_turn(user_text: str, client_user_id: str,
+                        profile_update: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Async version of prepare_turn. Embedding, FAISS/BM25 search and the SQLite answer
+    cache run on the bounded retrieval pool so the event loop is never blocked.
+    """
+    turn = _new_turn(user_text, client_user_id)
+    loop = asyncio.get_running_loop()
+
+    # Wait for the background warm-up if a request arrives before it finished
+    if not await loop.run_in_executor(None, lifecycle.ensure_ready, settings.CHAT_READY_TIMEOUT):
+        turn["response"] = _not_ready_response()
+        return turn
+
+    name = profile_update.get("name") if profile_update else f"User_{client_user_id}"
+    sess = await ainitialize_session(client_user_id, name)
+    turn["sess"] = sess
+
+    turn["response"] = _canned_response(user_text)
+    if turn["response"] is not None:
+        return turn
+
+    k = settings.RETRIEVAL_TOP_K
+    if settings.SPECULATIVE_RETRIEVAL:
+        rewritten, docs = await aspeculative_rewrite_and_retrieve(
+            user_text, sess["memory"], client_user_id, k=k, outcome=turn["rewrite"]
+        )
+    else:
+        rewritten = await arewrite_query(user_text, sess["memory"], client_user_id, turn["rewrite"])
+        docs = await loop.run_in_executor(
+            _retrieval_executor, bind_context(retrieve_documents, rewritten, lifecycle.retriever, k)
+        )
+
+    turn["rewritten"] = rewritten
+    turn["docs"] = docs
+
+    cached = await loop.run_in_executor(_retrieval_executor, bind_context(_semantic_cache_lookup, turn))
+    if cached is not None:
+        await sess["memory"].chat_memory.aadd_turn(user_text, cached, turn["request_at"])
+        turn["response"] = cached
+        return turn
+
+    if gemini_breaker.is_open:
+        logger.warning(f"[{client_user_id}] Gemini circuit open → degraded answer")
+        turn["response"] = degraded_response(docs)
+        await afinish_turn(turn, turn["response"], generated=False)
+        return turn
+
+    if not _stateful_chat():
+        turn["history"] = _window(await sess["memory"].chat_memory.aget_messages(), sess["memory"].k)
+    turn["prompt"] = build_prompt(rewritten, docs)
+    return turn
+
+
+def generation_error_response(e: Exception, docs: Optional[List[Document]] = None) -> str:
+    """
+    Log a failed Gemini generation call and return the matching fallback answer.
+    When Gemini is unavailable the retrieved guide section is served instead.
+    """
+    record_error("generation", e)
+    if docs and is_upstream_failure(e):
+        logger.error("Gemini unavailable, serving degraded answer: %r", e)
+        return degraded_response(docs)
 
-    except google_exceptions.InvalidArgument:
-        logger.warning("InvalidArgument from Gemini API", exc_info=True)
-        response_text = json.dumps({
+    if isinstance(e, google_exceptions.InvalidArgument):
+        logger.warning("InvalidArgument from Gemini API", exc_info=e)
+        return json.dumps({
             "responseType": "basic",
             "content": {
                 "answer": "Your question couldn't be processed. Please rephrase or try a different topic."
             }
         })
 
-    except GoogleAPICallError:
-        logger.error("Gemini generation API error", exc_info=True)
-        response_text = json.dumps({
+    if isinstance(e, LLMQueueTimeout):
+        logger.error("Gemini generation not attempted: %s", e)
+        return json.dumps({
             "responseType": "basic",
             "content": {
-                "answer": "I'm having trouble answering that. Could you please try again in a moment?"
+                "answer": "The assistant is busy right now. Please try again in a moment."
             }
         })
 
-    except Exception as e:
-
-        logger.critical("Unexpected server error", exc_info=True)
-        print("Exception type:", type(e).__name__)  # Print exception type
-        print("Exception message:", str(e))  # Print exception message
-        response_text = json.dumps({
+    if isinstance(e, GoogleAPICallError):
+        logger.error("Gemini generation API error", exc_info=e)
+        return json.dumps({
             "responseType": "basic",
             "content": {
-                "answer": "Something went wrong on our end. Please try again shortly. 🙏"
+                "answer": "I'm having trouble answering that. Could you please try again in a moment?"
             }
         })
 
+    logger.critical("Unexpected server error", exc_info=e)
+    return json.dumps({
+        "responseType": "basic",
+        "content": {
+            "answer": "Something went wrong on our end. Please try again shortly. 🙏"
+        }
+    })
+
+
+def finish_turn(turn: Dict[str, Any], response_text: str, generated: bool) -> None:
+    """
+    Persist a generated turn: store it in the semantic cache (successful generations
+    only) and save the exchange to memory (queued for the turn writer in write-behind mode).
+    """
+    from chat.views import clean_response
+
+    cleaned = clean_response(response_text)
+    if generated and turn["cache_args"]:
+        semantic_cache.store(turn["rewritten"], *turn["cache_args"], cleaned)
+
     # Save to memory
+    sess = turn["sess"]
+    with span("persistence"):
+        sess["memory"].chat_memory.add_turn(turn["user_text"], cleaned, turn["request_at"])
+
+    # Share state this turn changed (the greeting) before the user's next turn
+    client_user_id = turn["client_user_id"]
+    proposed = _unsynced_state(client_user_id, sess)
+    if proposed is not None:
+        try:
+            _sync_session(client_user_id, sess, proposed)
+        except DatabaseError as e:
+            logger.error(f"Session backend unavailable for {client_user_id}: {e}")
+
+
+async def afinish_turn(turn: Dict[str, Any], response_text: str, generated: bool) -> None:
+    """
+    Async version of finish_turn.
+    """
     from chat.views import clean_response
-    sess["memory"].chat_memory.add_user_message(user_text)
-    sess["memory"].chat_memory.add_ai_message(clean_response(response_text))
+
+    cleaned = clean_response(response_text)
+    if generated and turn["cache_args"]:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(
+            _retrieval_executor, bind_context(semantic_cache.store, turn["rewritten"], *turn["cache_args"], cleaned)
+        )
+
+    # Save to memory
+    sess = turn["sess"]
+    with span("persistence"):
+        await sess["memory"].chat_memory.aadd_turn(turn["user_text"], cleaned, turn["request_at"])
+
+    # Share state this turn changed (the greeting) before the user's next turn
+    client_user_id = turn["client_user_id"]
+    proposed = _unsynced_state(client_user_id, sess)
+    if proposed is not None:
+        try:
+            await _async_session(client_user_id, sess, proposed)
+        except DatabaseError as e:
+            logger.error(f"Session backend unavailable for {client_user_id}: {e}")
+
+
+def text_pipeline_session(user_text: str, client_user_id: str, profile_update: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Main pipeline for handling a user message.
+    1. Initializes session
+    2. Handles greetings/thanks
+    3. Rewrites the query (if needed)
+    4. Retrieves context documents
+    5. Answers from the semantic cache if enabled and a near-duplicate was answered before
+    6. Builds prompt and sends to Gemini
+    7. Saves memory and returns JSON response
+    """
+    turn = prepare_turn(user_text, client_user_id, profile_update)
+    if turn["response"] is not None:
+        return turn["response"]
+
+    # Call Gemini API
+    try:
+        response_text = generate_reply(turn)
+        generated = True
+    except Exception as e:
+        response_text = generation_error_response(e, turn["docs"])
+        generated = False
+
+    finish_turn(turn, response_text, generated)
+    return response_text
+
+
+def stream_pipeline_session(user_text: str, client_user_id: str,
+                            profile_update: Optional[Dict[str, Any]] = None) -> Iterator[Tuple[str, Any]]:
+    """
+    Streaming variant of text_pipeline_session using Gemini's streaming API.
+    Yields ("meta", {"responseType": ...}) and ("delta", {"answer": ...}) events as soon as
+    they can be parsed from the partial reply, then ("final", response_text) once the full
+    reply is available and the turn has been saved to memory.
+    """
+    turn = prepare_turn(user_text, client_user_id, profile_update)
+    if turn["response"] is not None:
+        yield "final", turn["response"]
+        return
+
+    parser = PartialAnswerParser()
+    parts = []
+    try:
+        for text in generate_reply_stream(turn):
+            parts.append(text)
+            yield from parser.feed(text)
+        response_text = "".join(parts).strip()
+        generated = True
+    except Exception as e:
+        response_text = generation_error_response(e, turn["docs"])
+        generated = False
+
+    finish_turn(turn, response_text, generated)
+    yield "final", response_text
+
+
+async def atext_pipeline_session(user_text: str, client_user_id: str,
+                                 profile_update: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Async version of text_pipeline_session for the ASGI entry point: Gemini calls use the
+    async client, session/history writes use the async ORM, and CPU-bound retrieval runs
+    on the bounded retrieval pool, so an in-flight request holds no worker thread while
+    waiting on Gemini.
+    """
+    turn = await aprepare_turn(user_text, client_user_id, profile_update)
+    if turn["response"] is not None:
+        return turn["response"]
+
+    # Call Gemini API
+    try:
+        response_text = await agenerate_reply(turn)
+        generated = True
+    except Exception as e:
+        response_text = generation_error_response(e, turn["docs"])
+        generated = False
+
+    await afinish_turn(turn, response_text, generated)
     return response_text
@@ -1,16 +1,49 @@
+import os
 import json
+import time
+import pickle
+import shutil
+import hashlib
 import logging
+import tempfile
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import islice
 from django.conf import settings
 from langchain.schema import Document
-from langchain_community.document_loaders import PyPDFLoader
 from langchain_community.vectorstores import FAISS
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain.retrievers.ensemble import EnsembleRetriever
-from langchain_community.retrievers import BM25Retriever
+from chat.utils.bm25 import SparseBM25Index
+from chat.utils.hybrid_retriever import HybridRetriever
+from chat.utils.pdf_pages import count_pages, parse_pages
 
 logger = logging.getLogger(__name__)
 
+# Embedding model and chunking parameters (part of the snapshot key)
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+CHUNK_SIZE = 500
+CHUNK_OVERLAP = 100
+CHUNK_SEPARATORS = [
+    "\n- ",  # bullet points
+    "\n• ",
+    "\n\n",  # paragraph
+    "\n",  # line
+    " ",  # word
+    ""  # fallback
+]
+
+# Bump whenever the on-disk snapshot layout changes
+SNAPSHOT_FORMAT_VERSION = 3
+SNAPSHOT_MANIFEST = "manifest.json"
+SNAPSHOT_FAISS_NAME = "index"
+SNAPSHOT_BM25_FILE = "bm25.npz"
+SNAPSHOT_DOCS_FILE = "documents.pkl"
+
+EMBEDDING_BACKEND_TORCH = "torch"
+EMBEDDING_BACKEND_ONNX = "onnx"
+
 
 # Load JSON guide data from file specified in settings
 def load_json_data():
@@ -132,76 +165,497 @@ def process_json_data(json_data):
     return processed_docs
 
 
-# Load and parse PDF file as Document objects
-def load_pdf_data():
+def pdf_sources():
     """
-    Loads data from a PDF file defined in Django settings.
-    Uses LangChain's PyPDFLoader.
-    Returns a list of Document objects or an empty list on failure.
+    Returns the PDF files under PDF_DATA_DIR, sorted by name.
     """
     try:
-        return PyPDFLoader(settings.PDF_DATA_PATH).load()
-    except Exception as e:
-        logger.error(f"PDF load error: {str(e)}")
+        names = sorted(os.listdir(settings.PDF_DATA_DIR))
+    except OSError as e:
+        logger.error(f"PDF directory error: {str(e)}")
         return []
+    return [
+        os.path.join(settings.PDF_DATA_DIR, name)
+        for name in names
+        if name.lower().endswith(".pdf") and not name.startswith(".")
+    ]
+
+
+def iter_pdf_pages(paths, workers=None, pages_per_task=None):
+    """
+    Yields (path, total_pages, page index, page label, text) for every page of `paths`,
+    in order. Page ranges of `pages_per_task` pages are parsed in a pool of `workers`
+    processes with at most two ranges per worker in flight, so parsing runs ahead of
+    the consumer by a bounded number of pages. A file or range that fails to parse is
+    logged and skipped.
+    """
+    workers = workers or settings.INGEST_WORKERS or os.cpu_count() or 1
+    pages_per_task = max(pages_per_task or settings.INGEST_PAGES_PER_TASK, 1)
+
+    tasks = []
+    for path in paths:
+        try:
+            total = count_pages(path)
+        except Exception as e:
+            logger.error(f"PDF load error ({os.path.basename(path)}): {str(e)}")
+            continue
+        tasks += [(path, start, min(start + pages_per_task, total), total) for start in range(0, total, pages_per_task)]
+
+    def pages(task, parsed):
+        path, _, _, total = task
+        for page, label, text in parsed:
+            yield path, total, page, label, text
+
+    if workers <= 1 or len(tasks) <= 1:
+        for task in tasks:
+            try:
+                parsed = parse_pages(*task[:3])
+            except Exception as e:
+                logger.error(f"PDF parse error ({os.path.basename(task[0])} pages {task[1]}-{task[2]}): {str(e)}")
+                continue
+            yield from pages(task, parsed)
+        return
+
+    # spawn: never fork a process that may hold model threads or DB connections
+    context = multiprocessing.get_context("spawn")
+    remaining = iter(tasks)
+    with ProcessPoolExecutor(max_workers=min(workers, len(tasks)), mp_context=context) as pool:
+        in_flight = deque((task, pool.submit(parse_pages, *task[:3])) for task in islice(remaining, 2 * workers))
+        while in_flight:
+            task, future = in_flight.popleft()
+            following = next(remaining, None)
+            if following is not None:
+                in_flight.append((following, pool.submit(parse_pages, *following[:3])))
+            try:
+                parsed = future.result()
+            except Exception as e:
+                logger.error(f"PDF parse error ({os.path.basename(task[0])} pages {task[1]}-{task[2]}): {str(e)}")
+                continue
+            yield from pages(task, parsed)
+
+
+def iter_pdf_documents(paths=None):
+    """
+    Yields one Document per PDF page (metadata as PyPDFLoader's: source, total_pages,
+    page, page_label) as pages are parsed.
+    """
+    for path, total, page, label, text in iter_pdf_pages(pdf_sources() if paths is None else paths):
+        yield Document(
+            page_content=text,
+            metadata={"source": path, "total_pages": total, "page": page, "page_label": label},
+        )
+
+
+def _file_digest(path):
+    """
+    Returns the SHA-256 hex digest of a file's bytes, or "missing" if it cannot be read.
+    """
+    try:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+    except OSError:
+        return "missing"
+
+
+def compute_corpus_hash():
+    """
+    Builds the snapshot key from everything that changes the index contents:
+    the source files, the splitter parameters and the embedding model (name and, when
+    its vectors differ from the torch model's, the backend variant).
+    """
+    key = {
+        "format": SNAPSHOT_FORMAT_VERSION,
+        "json": _file_digest(settings.JSON_DATA_PATH),
+        "pdfs": {os.path.basename(path): _file_digest(path) for path in pdf_sources()},
+        "chunk_size": CHUNK_SIZE,
+        "chunk_overlap": CHUNK_OVERLAP,
+        "separators": CHUNK_SEPARATORS,
+        "embedding_model": EMBEDDING_MODEL_NAME,
+    }
+    variant = embedding_variant()
+    if variant:
+        key["embedding_variant"] = variant
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def embedding_variant():
+    """
+    Identifies embedding backends whose vectors are not interchangeable with the torch
+    model's. The fp32 ONNX export reproduces the torch vectors (export_onnx_embeddings
+    checks this), so existing snapshots stay valid; int8 weights shift the vectors, so
+    the quantized model gets its own snapshot, built with the vectors it produces.
+    """
+    if settings.EMBEDDING_BACKEND == EMBEDDING_BACKEND_ONNX and settings.EMBEDDING_ONNX_QUANTIZED:
+        return "onnx-int8"
+    return ""
+
+
+def load_local_embedding_model(backend=None):
+    """
+    Loads the embedding model into this process with the configured EMBEDDING_BACKEND:
+    sentence-transformers on torch, or the ONNX export on ONNX Runtime.
+    """
+    backend = backend or settings.EMBEDDING_BACKEND
+    if backend == EMBEDDING_BACKEND_ONNX:
+        from chat.utils.onnx_embeddings import OnnxEmbeddings
+
+        return OnnxEmbeddings(
+            settings.EMBEDDING_ONNX_DIR,
+            quantized=settings.EMBEDDING_ONNX_QUANTIZED,
+            threads=settings.EMBEDDING_ONNX_THREADS,
+        )
+
+    from langchain_huggingface import HuggingFaceEmbeddings
+
+    return HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME)
+
+
+def get_embedding_model():
+    """
+    Returns the embedding model used for both indexing and querying: a client of the
+    embedding sidecar when EMBEDDING_SIDECAR is on (falling back to the in-process
+    model while the sidecar is down), otherwise the in-process model.
+    """
+    if settings.EMBEDDING_SIDECAR:
+        from chat.utils.embedding_service import SidecarEmbeddings
+
+        return SidecarEmbeddings(
+            settings.EMBEDDING_SOCKET_PATH,
+            fallback=load_local_embedding_model,
+            timeout=settings.EMBEDDING_SIDECAR_TIMEOUT,
+            retry_interval=settings.EMBEDDING_SIDECAR_RETRY_INTERVAL,
+            bulk_timeout=settings.EMBEDDING_SIDECAR_BULK_TIMEOUT,
+        )
+    return load_local_embedding_model()
+
+
+def assign_chunk_ids(docs):
+    """
+    Gives every chunk a stable `chunk_id` in its metadata, derived from where it came
+    from (guide/section or PDF file/page) and its content. IDs survive rebuilds as long
+    as the chunk itself is unchanged, and are unique even for PDF chunks sharing a source.
+    """
+    return list(iter_chunk_ids(docs))
+
+
+def iter_chunk_ids(docs):
+    """
+    Streaming form of assign_chunk_ids: yields each chunk once its id is assigned.
+    """
+    seen = set()
+    for doc in docs:
+        meta = doc.metadata
+        if "guide_title" in meta:
+            origin = f"guide|{meta.get('guide_title')}|{meta.get('section_title')}"
+        else:
+            origin = f"pdf|{os.path.basename(str(meta.get('source', '')))}|{meta.get('page', '')}"
+
+        base = hashlib.sha1(f"{origin}\n{doc.page_content}".encode("utf-8")).hexdigest()[:16]
+        chunk_id, n = base, 1
+        while chunk_id in seen:
+            # Identical text repeated within the same origin
+            chunk_id = f"{base}-{n}"
+            n += 1
+        seen.add(chunk_id)
+        meta["chunk_id"] = chunk_id
+        yield doc
+
+
+def iter_documents(progress=None):
+    """
+    Yields the chunks to index: the JSON guide sections, then the chunks of every PDF
+    page, split as pages arrive from the parser pool. Falls back to a single dummy
+    document when no source produced a chunk. `progress` (a dict) counts parsed pages.
+    """
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
+        separators=CHUNK_SEPARATORS,
+        length_function=len
+    )
+
+    def chunks():
+        yield from process_json_data(load_json_data())
+        for page in iter_pdf_documents():
+            if progress is not None:
+                progress["pages"] = progress.get("pages", 0) + 1
+            yield from text_splitter.split_documents([page])
+
+    produced = False
+    for doc in iter_chunk_ids(chunks()):
+        produced = True
+        yield doc
+
+    if not produced:
+        logger.warning("Using dummy document")
+        yield from assign_chunk_ids([Document(page_content="dummy", metadata={})])
+
+
+def build_documents():
+    """
+    Loads the JSON guide and PDF sources and returns the combined list of chunks to index.
+    """
+    return list(iter_documents())
+
+
+def _batches(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def build_vector_store(docs, embedding_model, batch_size=None, progress=None):
+    """
+    Embeds `docs` (any iterable, consumed lazily) in batches of `batch_size` chunks and
+    adds each batch to the FAISS index as soon as it is embedded, so embedding output is
+    never held for more than one batch. Logs progress and throughput.
+    Returns (faiss_vector_store, documents).
+    """
+    batch_size = max(batch_size or settings.INGEST_EMBED_BATCH_SIZE, 1)
+    progress = {} if progress is None else progress
+    vector_store, documents = None, []
+    started = last_log = time.perf_counter()
+
+    for batch in _batches(docs, batch_size):
+        texts = [doc.page_content for doc in batch]
+        text_embeddings = zip(texts, embedding_model.embed_documents(texts))
+        metadatas = [doc.metadata for doc in batch]
+        ids = [doc.metadata["chunk_id"] for doc in batch]
+        if vector_store is None:
+            vector_store = FAISS.from_embeddings(text_embeddings, embedding_model, metadatas=metadatas, ids=ids)
+        else:
+            vector_store.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+        documents.extend(batch)
+
+        now = time.perf_counter()
+        if now - last_log >= 5:
+            last_log = now
+            logger.info(
+                f"Indexed {len(documents)} chunks from {progress.get('pages', 0)} PDF pages "
+                f"({len(documents) / (now - started):.1f} chunks/s)"
+            )
+
+    elapsed = time.perf_counter() - started
+    logger.info(
+        f"Indexed {len(documents)} chunks from {progress.get('pages', 0)} PDF pages in {elapsed:.2f}s "
+        f"({len(documents) / elapsed if elapsed else 0.0:.1f} chunks/s)"
+    )
+    return vector_store, documents
+
+
+def save_snapshot(corpus_hash, vector_store, bm25_index, combined_docs):
+    """
+    Writes a versioned snapshot (FAISS index + docstore, BM25 inverted index, documents and
+    a chunk manifest) under VECTOR_INDEX_DIR/<corpus_hash>.
+    The snapshot is written to a temporary directory first and renamed into place, so
+    concurrent workers never observe a partially written snapshot.
+    """
+    index_dir = settings.VECTOR_INDEX_DIR
+    os.makedirs(index_dir, exist_ok=True)
+    target = os.path.join(index_dir, corpus_hash)
+    tmp_dir = tempfile.mkdtemp(prefix=f".{corpus_hash}-", dir=index_dir)
+
+    try:
+        vector_store.save_local(tmp_dir, index_name=SNAPSHOT_FAISS_NAME)
+        bm25_index.save(os.path.join(tmp_dir, SNAPSHOT_BM25_FILE))
+        with open(os.path.join(tmp_dir, SNAPSHOT_DOCS_FILE), "wb") as f:
+            pickle.dump(combined_docs, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        manifest = {
+            "format": SNAPSHOT_FORMAT_VERSION,
+            "corpus_hash": corpus_hash,
+            "created_at": datetime.now().isoformat(),
+            "embedding_model": EMBEDDING_MODEL_NAME,
+            "embedding_backend": settings.EMBEDDING_BACKEND,
+            "embedding_variant": embedding_variant(),
+            "chunk_size": CHUNK_SIZE,
+            "chunk_overlap": CHUNK_OVERLAP,
+            "sources": {
+                "json": settings.JSON_DATA_PATH,
+                "pdf": pdf_sources(),
+            },
+            "chunk_count": len(combined_docs),
+            "chunks": [
+                {
+                    "chunk_id": doc.metadata.get("chunk_id"),
+                    "source": doc.metadata.get("source"),
+                    "page": doc.metadata.get("page"),
+                    "guide_title": doc.metadata.get("guide_title"),
+                    "section_title": doc.metadata.get("section_title"),
+                    "length": len(doc.page_content),
+                }
+                for doc in combined_docs
+            ],
+        }
+        # The manifest is written last and marks the snapshot as complete
+        with open(os.path.join(tmp_dir, SNAPSHOT_MANIFEST), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+        try:
+            os.rename(tmp_dir, target)
+        except OSError:
+            # Another worker published the same snapshot first
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return
+
+        logger.info(f"Saved vector snapshot {corpus_hash} ({len(combined_docs)} chunks)")
+        _prune_snapshots(keep=corpus_hash)
+
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+
+def _snapshot_variant(path):
+    """
+    Embedding variant recorded in a snapshot's manifest, or None for an incomplete snapshot.
+    """
+    try:
+        with open(os.path.join(path, SNAPSHOT_MANIFEST), "r", encoding="utf-8") as f:
+            return json.load(f).get("embedding_variant", "")
+    except (OSError, ValueError):
+        return None
+
+
+def _prune_snapshots(keep):
+    """
+    Removes superseded snapshots, keeping `keep` and the most recent snapshot of every
+    other embedding variant (so switching EMBEDDING_ONNX_QUANTIZED back and forth
+    reuses the previous index instead of re-embedding), plus temporary directories
+    abandoned by builds that crashed more than an hour ago.
+    """
+    index_dir = settings.VECTOR_INDEX_DIR
+    kept_variants = {_snapshot_variant(os.path.join(index_dir, keep))}
+    candidates = []
+    for name in os.listdir(index_dir):
+        path = os.path.join(index_dir, name)
+        if name == keep or not os.path.isdir(path):
+            continue
+        if name.startswith("."):
+            if time.time() - os.path.getmtime(path) >= 3600:
+                shutil.rmtree(path, ignore_errors=True)
+            continue  # otherwise possibly another worker's build in progress
+        candidates.append((os.path.getmtime(path), path))
+
+    # Newest first: the first complete snapshot seen for a variant is the one kept
+    for _, path in sorted(candidates, reverse=True):
+        variant = _snapshot_variant(path)
+        if variant is not None and variant not in kept_variants:
+            kept_variants.add(variant)
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def _load_faiss_store(path, embedding_model):
+    """
+    Loads the FAISS store saved by save_local. With FAISS_MMAP the index vectors are
+    memory-mapped read-only from the snapshot file instead of copied onto the heap, so
+    they live in the page cache shared by every worker on the host.
+    """
+    if not settings.FAISS_MMAP:
+        # Snapshots are produced by this process family only, so unpickling is trusted
+        return FAISS.load_local(
+            path,
+            embedding_model,
+            index_name=SNAPSHOT_FAISS_NAME,
+            allow_dangerous_deserialization=True,
+        )
+
+    import faiss
+
+    # IO_FLAG_MMAP_IFC maps flat (IndexFlat*) codes; older builds only support IO_FLAG_MMAP
+    flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+    index = faiss.read_index(os.path.join(path, f"{SNAPSHOT_FAISS_NAME}.faiss"), flags)
+    with open(os.path.join(path, f"{SNAPSHOT_FAISS_NAME}.pkl"), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    return FAISS(embedding_model, index, docstore, index_to_docstore_id)
+
+
+def load_snapshot(corpus_hash, embedding_model):
+    """
+    Loads a previously saved snapshot for `corpus_hash`.
+    Returns (faiss_vector_store, bm25_index, combined_documents) or None when no
+    complete snapshot with a matching format exists.
+    """
+    path = os.path.join(settings.VECTOR_INDEX_DIR, corpus_hash)
+    manifest_path = os.path.join(path, SNAPSHOT_MANIFEST)
+    if not os.path.isfile(manifest_path):
+        return None
+
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("format") != SNAPSHOT_FORMAT_VERSION:
+            return None
+
+        vector_store = _load_faiss_store(path, embedding_model)
+        with open(os.path.join(path, SNAPSHOT_DOCS_FILE), "rb") as f:
+            combined_docs = pickle.load(f)
+        bm25_index = SparseBM25Index.load(os.path.join(path, SNAPSHOT_BM25_FILE))
+        return vector_store, bm25_index, combined_docs
+
+    except Exception as e:
+        logger.error(f"Vector snapshot {corpus_hash} could not be loaded: {str(e)}")
+        return None
 
 
 def setup_vector_db():
     """
-    Sets up the vector database and ensemble retriever:
-    1. Loads both JSON and PDF documents.
-    2. Splits PDF content using RecursiveCharacterTextSplitter.
+    Sets up the vector database and hybrid retriever:
+    1. Loads the snapshot for the current corpus hash if one exists on disk.
+    2. Otherwise streams the JSON guide and every PDF in PDF_DATA_DIR through the
+       ingestion pipeline (pages parsed in a process pool, split with
+       RecursiveCharacterTextSplitter as they arrive, embedded and added to FAISS in
+       batches), builds the BM25 index and saves a new snapshot.
     3. Creates:
-       - FAISS vector retriever with HuggingFace embeddings.
-       - BM25 keyword-based retriever.
-       - Ensemble retriever combining both with weighted logic.
+       - FAISS vector retriever with the configured embedding model.
+       - Sparse BM25 keyword index (see SparseBM25Index).
+       - Hybrid retriever fusing scored results from both (see HybridRetriever).
     Returns:
-        (ensemble_retriever, faiss_vector_store, bm25_retriever, combined_documents)
+        (hybrid_retriever, faiss_vector_store, bm25_index, combined_documents)
     """
     try:
-        # Load and process data
-        json_docs = process_json_data(load_json_data())
-        pdf_docs = load_pdf_data()
-
-        if not json_docs and not pdf_docs:
-            logger.warning("Using dummy document")
-            combined_docs = [Document(page_content="dummy", metadata={})]
+        started = time.perf_counter()
+        corpus_hash = compute_corpus_hash()
+        embedding_model = get_embedding_model()
+
+        snapshot = load_snapshot(corpus_hash, embedding_model)
+        if snapshot:
+            vector_store, bm25_index, combined_docs = snapshot
+            logger.info(f"Loaded vector snapshot {corpus_hash} in {time.perf_counter() - started:.3f}s")
         else:
-            combined_docs = json_docs
-
-            # Chunk PDF documents if available
-            if pdf_docs:
-                text_splitter = RecursiveCharacterTextSplitter(
-                    chunk_size=500,
-                    chunk_overlap=100,
-                    separators=[
-                        "\n- ",  # bullet points
-                        "\n• ",
-                        "\n\n",  # paragraph
-                        "\n",  # line
-                        " ",  # word
-                        ""  # fallback
-                    ],
-                    length_function=len
-                )
-                pdf_chunks = text_splitter.split_documents(pdf_docs)
-                combined_docs += pdf_chunks
-
-        # 1. Create FAISS retriever
-        embedding_model = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-        vector_store = FAISS.from_documents(combined_docs, embedding_model)
-        faiss_retriever = vector_store.as_retriever()
-
-        # Create BM25 keyword retriever
-        bm25_retriever = BM25Retriever.from_documents(combined_docs)
-
-        # Combine both using EnsembleRetriever
-        retriever = EnsembleRetriever(
-            retrievers=[faiss_retriever, bm25_retriever],
-            weights=[0.7, 0.3]  # Tunable based on testing
+            # 1. Create FAISS vector store, batch by batch as chunks are produced
+            progress = {}
+            vector_store, combined_docs = build_vector_store(
+                iter_documents(progress), embedding_model, progress=progress
+            )
+
+            # Create BM25 keyword index
+            bm25_index = SparseBM25Index.build(doc.page_content for doc in combined_docs)
+            logger.info(f"Built vector index {corpus_hash} in {time.perf_counter() - started:.3f}s")
+
+            try:
+                save_snapshot(corpus_hash, vector_store, bm25_index, combined_docs)
+            except Exception as e:
+                logger.error(f"Vector snapshot save failed: {str(e)}")
+
+        # Fuse both indexes with score-aware hybrid retrieval
+        retriever = HybridRetriever(
+            vector_store,
+            bm25_index,
+            combined_docs,
+            fusion=settings.RETRIEVAL_FUSION,
+            weights=settings.RETRIEVAL_WEIGHTS,  # Tunable based on testing
+            candidate_k=settings.RETRIEVAL_CANDIDATE_K,
+            min_score=settings.RETRIEVAL_MIN_SCORE,
+            adaptive_ratio=settings.RETRIEVAL_ADAPTIVE_RATIO,
+            corpus_version=corpus_hash,
         )
 
-        return retriever, vector_store, bm25_retriever, combined_docs
+        return retriever, vector_store, bm25_index, combined_docs
 
     except Exception as e:
         logger.error(f"Vector DB setup failed: {str(e)}")
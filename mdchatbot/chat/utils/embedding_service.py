@@ -0,0 +1,234 @@
+import os
+import json
+import time
+import queue
+import socket
+import struct
+import logging
+import threading
+import socketserver
+from collections import Counter
+from concurrent.futures import Future
+from typing import Callable, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+# Wire format (both directions): 4-byte big-endian length + JSON header, then for
+# responses `count * dim` little-endian float32 values
+_LENGTH = struct.Struct(">I")
+
+
+def _send_message(sock: socket.socket, header: dict, payload: bytes = b"") -> None:
+    body = json.dumps(header).encode("utf-8")
+    sock.sendall(_LENGTH.pack(len(body)) + body + payload)
+
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    chunks, remaining = [], size
+    while remaining:
+        chunk = sock.recv(min(remaining, 1 << 20))
+        if not chunk:
+            raise ConnectionError("embedding socket closed")
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b"".join(chunks)
+
+
+def _recv_header(sock: socket.socket) -> dict:
+    (size,) = _LENGTH.unpack(_recv_exact(sock, _LENGTH.size))
+    return json.loads(_recv_exact(sock, size).decode("utf-8"))
+
+
+class MicroBatcher:
+    """
+    Collects texts from concurrent requests and embeds them in one model call.
+
+    A batch is closed `window` seconds after its first request arrives, or as soon as
+    it holds `max_batch` texts; each request's Future then receives its own rows.
+    """
+
+    def __init__(self, model: Embeddings, window: float = 0.005, max_batch: int = 64):
+        self.model = model
+        self.window = window
+        self.max_batch = max(max_batch, 1)
+        self._queue = queue.Queue()
+        self._stats = Counter()
+        self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, texts: List[str]) -> Future:
+        future = Future()
+        self._queue.put((texts, future))
+        return future
+
+    def _run(self) -> None:
+        while True:
+            pending = [self._queue.get()]
+            size = len(pending[0][0])
+            deadline = time.monotonic() + self.window
+            while size < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                pending.append(item)
+                size += len(item[0])
+
+            texts = [text for request_texts, _ in pending for text in request_texts]
+            try:
+                vectors = np.asarray(self.model.embed_documents(texts), dtype="<f4")
+            except Exception as e:
+                logger.error(f"Embedding batch of {len(texts)} texts failed: {e}")
+                for _, future in pending:
+                    future.set_exception(e)
+                continue
+
+            self._stats["batches"] += 1
+            self._stats["requests"] += len(pending)
+            self._stats["texts"] += len(texts)
+            start = 0
+            for request_texts, future in pending:
+                future.set_result(vectors[start:start + len(request_texts)])
+                start += len(request_texts)
+
+    def stats(self) -> dict:
+        stats = dict(self._stats)
+        stats["mean_batch_texts"] = round(stats["texts"] / stats["batches"], 2) if stats.get("batches") else 0.0
+        return stats
+
+
+class _EmbeddingRequestHandler(socketserver.BaseRequestHandler):
+    def handle(self) -> None:
+        # One connection serves many requests (clients keep a connection per thread)
+        while True:
+            try:
+                header = _recv_header(self.request)
+            except (ConnectionError, OSError):
+                return
+            try:
+                vectors = self.server.batcher.submit(header["texts"]).result()
+                _send_message(self.request, {"count": vectors.shape[0], "dim": vectors.shape[1]}, vectors.tobytes())
+            except Exception as e:
+                _send_message(self.request, {"error": str(e)})
+
+
+class EmbeddingServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Unix-socket embedding service owning the only model instance on the host.
+    """
+    daemon_threads = True
+    request_queue_size = 1024  # every worker thread connects at once after a restart
+
+    def __init__(self, socket_path: str, model: Embeddings, window: float = 0.005, max_batch: int = 64):
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)  # stale socket from a previous run
+        os.makedirs(os.path.dirname(socket_path) or ".", exist_ok=True)
+        self.batcher = MicroBatcher(model, window=window, max_batch=max_batch)
+        super().__init__(socket_path, _EmbeddingRequestHandler)
+
+    def server_close(self) -> None:
+        super().server_close()
+        try:
+            os.unlink(self.server_address)
+        except OSError:
+            pass
+
+
+class SidecarEmbeddings(Embeddings):
+    """
+    Embeddings client for the embedding_server sidecar.
+
+    Each thread keeps one connection to the socket. If the sidecar cannot be reached,
+    the call falls back to a local model (built by `fallback` on first need) and the
+    sidecar is retried after `retry_interval` seconds. Queries wait at most `timeout`
+    seconds for the sidecar; embed_documents (index builds, many texts per call) waits
+    `bulk_timeout` seconds.
+    """
+
+    def __init__(self, socket_path: str, fallback: Callable[[], Embeddings], timeout: float = 2.0,
+                 retry_interval: float = 5.0, bulk_timeout: float = 120.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.bulk_timeout = bulk_timeout
+        self.retry_interval = retry_interval
+        self._fallback_factory = fallback
+        self._fallback: Optional[Embeddings] = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._down_until = 0.0
+        self._stats = Counter()
+
+    def _connection(self) -> socket.socket:
+        sock = getattr(self._local, "sock", None)
+        if sock is None or getattr(self._local, "pid", None) != os.getpid():
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            self._local.sock = sock
+            self._local.pid = os.getpid()
+        return sock
+
+    def _drop_connection(self) -> None:
+        sock = getattr(self._local, "sock", None)
+        self._local.sock = None
+        if sock is not None:
+            try:
+                sock.close()
+            except OSError:
+                pass
+
+    def _remote(self, texts: List[str], timeout: float) -> List[List[float]]:
+        sock = self._connection()
+        sock.settimeout(timeout)
+        _send_message(sock, {"texts": texts})
+        header = _recv_header(sock)
+        if "error" in header:
+            raise RuntimeError(header["error"])
+        data = _recv_exact(sock, header["count"] * header["dim"] * 4)
+        return np.frombuffer(data, dtype="<f4").reshape(header["count"], header["dim"]).tolist()
+
+    def _local_model(self) -> Embeddings:
+        with self._lock:
+            if self._fallback is None:
+                logger.warning("Embedding sidecar unavailable → loading the model in-process")
+                self._fallback = self._fallback_factory()
+            return self._fallback
+
+    def _embed(self, texts: List[str], timeout: float) -> List[List[float]]:
+        if not texts:
+            return []
+        if time.monotonic() >= self._down_until:
+            try:
+                vectors = self._remote(texts, timeout)
+                with self._lock:
+                    self._stats["remote"] += 1
+                return vectors
+            except (OSError, ConnectionError, ValueError, RuntimeError) as e:
+                self._drop_connection()
+                with self._lock:
+                    self._down_until = time.monotonic() + self.retry_interval
+                logger.error(f"Embedding sidecar call failed: {e}")
+        with self._lock:
+            self._stats["fallback"] += 1
+        return self._local_model().embed_documents(texts)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed(list(texts), self.bulk_timeout)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed([text], self.timeout)[0]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "socket": self.socket_path,
+                "remote_calls": self._stats["remote"],
+                "fallback_calls": self._stats["fallback"],
+                "fallback_loaded": self._fallback is not None,
+            }
@@ -0,0 +1,182 @@
+import re
+import json
+import time
+import random
+import asyncio
+import threading
+from types import SimpleNamespace
+from typing import Any, List, Optional
+
+from google.genai import errors
+
+# Canned bodies in both response formats the system instruction asks for
+DEFAULT_RESPONSES = [
+    {
+        "responseType": "basic",
+        "content": {
+            "answer": "<p>✅ This is a canned answer from the offline Gemini stand-in.</p>"
+        }
+    },
+    {
+        "responseType": "procedure",
+        "content": {
+            "header": {"title": "🔧 Canned Procedure", "introduction": "Offline stand-in response."},
+            "body": [
+                {"id": 1, "title": "✅ Step one", "description": "📱 Open the Mobile Dairy app."},
+                {"id": 2, "title": "🔧 Step two", "description": "⚙️ Open settings and save."}
+            ],
+            "footer": {"url": None, "title": None}
+        }
+    },
+]
+
+REWRITE_INPUT = re.compile(r"User Input: (.*)\nStandalone Question:", re.DOTALL)
+
+
+def _prompt_text(contents: Any) -> str:
+    if isinstance(contents, str):
+        return contents
+    texts = []
+    for content in contents or []:
+        parts = content.get("parts", []) if isinstance(content, dict) else getattr(content, "parts", [])
+        for part in parts:
+            texts.append(part.get("text", "") if isinstance(part, dict) else getattr(part, "text", "") or "")
+    return "\n".join(texts)
+
+
+class FakeGeminiClient:
+    """
+    Offline stand-in for google.genai.Client (models, chats and their .aio variants).
+
+    Latency is drawn from a log-normal distribution around `latency_median` seconds
+    (`latency_sigma` = 0 makes it fixed); `error_rate` of calls raise a 503 ServerError.
+    Query-rewrite prompts echo the user input back; every other call returns one of
+    `responses` (JSON bodies), chosen at random. Token counts are estimated at four
+    characters per token.
+    """
+
+    def __init__(
+        self,
+        latency_median: float = 1.0,
+        latency_sigma: float = 0.3,
+        error_rate: float = 0.0,
+        responses: Optional[List[dict]] = None,
+        seed: Optional[int] = None,
+    ):
+        self.latency_median = latency_median
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.responses = [json.dumps(r, ensure_ascii=False) for r in (responses or DEFAULT_RESPONSES)]
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+
+        self.models = _Models(self)
+        self.chats = _Chats(self)
+        self.aio = SimpleNamespace(models=_AsyncModels(self), chats=_AsyncChats(self))
+
+    def _draw(self) -> tuple:
+        with self._lock:
+            self.calls += 1
+            latency = self.latency_median * self._random.lognormvariate(0, self.latency_sigma) \
+                if self.latency_sigma > 0 else self.latency_median
+            failed = self._random.random() < self.error_rate
+            body = self._random.choice(self.responses)
+        return latency, failed, body
+
+    def _response(self, prompt: str, body: str, failed: bool):
+        if failed:
+            raise errors.ServerError(503, {"error": {"code": 503, "message": "fake upstream unavailable", "status": "UNAVAILABLE"}})
+
+        rewrite = REWRITE_INPUT.search(prompt)
+        text = rewrite.group(1).strip() if rewrite else body
+        return SimpleNamespace(
+            text=text,
+            usage_metadata=SimpleNamespace(
+                prompt_token_count=len(prompt) // 4,
+                candidates_token_count=len(text) // 4,
+            ),
+        )
+
+    def generate(self, contents: Any, config: Any = None):
+        latency, failed, body = self._draw()
+        time.sleep(latency)
+        return self._response(_prompt_text(contents), body, failed)
+
+    async def agenerate(self, contents: Any, config: Any = None):
+        latency, failed, body = self._draw()
+        await asyncio.sleep(latency)
+        return self._response(_prompt_text(contents), body, failed)
+
+    def generate_stream(self, contents: Any, config: Any = None, chunks: int = 8):
+        latency, failed, body = self._draw()
+        response = self._response(_prompt_text(contents), body, failed)
+        text = response.text
+        size = max(1, -(-len(text) // chunks))
+        for start in range(0, len(text), size):
+            time.sleep(latency / chunks)
+            last = start + size >= len(text)
+            yield SimpleNamespace(
+                text=text[start:start + size],
+                usage_metadata=response.usage_metadata if last else None,
+            )
+
+
+class _Models:
+    def __init__(self, client: FakeGeminiClient):
+        self._client = client
+
+    def generate_content(self, model: str, contents: Any, config: Any = None):
+        return self._client.generate(contents, config)
+
+    def generate_content_stream(self, model: str, contents: Any, config: Any = None):
+        return self._client.generate_stream(contents, config)
+
+
+class _AsyncModels:
+    def __init__(self, client: FakeGeminiClient):
+        self._client = client
+
+    async def generate_content(self, model: str, contents: Any, config: Any = None):
+        return await self._client.agenerate(contents, config)
+
+
+class _FakeChat:
+    # Like the SDK chat, a completed exchange is appended to the history
+    def __init__(self, client: FakeGeminiClient):
+        self._client = client
+        self._history = []
+        self._lock = threading.Lock()
+
+    def _record(self, message, response):
+        with self._lock:
+            self._history.extend([("user", _prompt_text(message)), ("model", response.text)])
+        return response
+
+    def get_history(self) -> list:
+        with self._lock:
+            return list(self._history)
+
+    def send_message(self, message, config: Any = None):
+        return self._record(message, self._client.generate(message, config))
+
+    def send_message_stream(self, message, config: Any = None):
+        return self._client.generate_stream(message, config)
+
+
+class _AsyncFakeChat(_FakeChat):
+    async def send_message(self, message, config: Any = None):
+        return self._record(message, await self._client.agenerate(message, config))
+
+
+class _Chats:
+    def __init__(self, client: FakeGeminiClient):
+        self._client = client
+
+    def create(self, model: str, config: Any = None, history: Any = None):
+        return _FakeChat(self._client)
+
+
+class _AsyncChats(_Chats):
+    def create(self, model: str, config: Any = None, history: Any = None):
+        return _AsyncFakeChat(self._client)
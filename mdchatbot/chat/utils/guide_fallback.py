@@ -0,0 +1,83 @@
+import re
+import json
+from typing import List, Optional
+
+from langchain.schema import Document
+
+# Step lines written by process_json_data: "3. Title: description" / "   - bullet" / "   Image URL: ..."
+STEP_PATTERN = re.compile(r"^(\d+)\.\s*(.*)$")
+BULLET_PREFIX = "   - "
+IMAGE_PREFIX = "   Image URL:"
+
+
+def procedure_from_guide(doc: Document) -> Optional[dict]:
+    """
+    Rebuild a "procedure" response from a JSON guide section chunk, without the LLM.
+    Returns None for documents that are not guide sections with steps (e.g. PDF chunks).
+    """
+    section_title = doc.metadata.get("section_title")
+    if not section_title:
+        return None
+
+    steps = []
+    intro_lines = []
+    seen_title = False
+
+    for line in doc.page_content.splitlines():
+        # Steps only start after the section title (guide descriptions may hold numbered lists too)
+        match = STEP_PATTERN.match(line) if seen_title else None
+        if match:
+            title, _, description = match.group(2).partition(": ")
+            steps.append({"id": len(steps) + 1, "title": title.strip(), "description": description.strip()})
+        elif steps and line.startswith(BULLET_PREFIX):
+            item = line[len(BULLET_PREFIX):].strip()
+            steps[-1]["description"] += ("<br>" if steps[-1]["description"] else "") + f"• {item}"
+        elif steps and line.startswith(IMAGE_PREFIX):
+            images = steps[-1].setdefault("imageURL", [])
+            images.append({f"url-{len(images) + 1}": line[len(IMAGE_PREFIX):].strip(), "altText": steps[-1]["title"]})
+        elif not steps:
+            # Section description sits between the section title and the first step
+            if line.strip() == section_title:
+                seen_title = True
+            elif seen_title and line.strip():
+                intro_lines.append(line.strip())
+
+    if not steps:
+        return None
+
+    for step in steps:
+        if not step["description"]:
+            step["description"] = step["title"]
+
+    youtube = doc.metadata.get("youtube_link")
+    return {
+        "responseType": "procedure",
+        "content": {
+            "header": {
+                "title": section_title,
+                "introduction": " ".join(intro_lines) or doc.metadata.get("guide_title", ""),
+            },
+            "body": steps,
+            "footer": {
+                "url": youtube,
+                "title": f"{section_title} video tutorial" if youtube else None,
+            },
+        },
+    }
+
+
+def degraded_response(docs: List[Document]) -> str:
+    """
+    Answer used while Gemini is unavailable: the top retrieved guide section as a
+    procedure, or an apology when the best match is not a guide section.
+    """
+    procedure = procedure_from_guide(docs[0]) if docs else None
+    if procedure is not None:
+        return json.dumps(procedure, ensure_ascii=False)
+
+    return json.dumps({
+        "responseType": "basic",
+        "content": {
+            "answer": "I'm having trouble answering that. Could you please try again in a moment?"
+        }
+    })
@@ -0,0 +1,134 @@
+import logging
+from typing import List, Tuple, Dict, Sequence
+
+from langchain.schema import Document
+
+from chat.utils.metrics import timed
+from chat.utils.retrieval_cache import retrieval_cache
+
+logger = logging.getLogger(__name__)
+
+FUSION_RRF = "rrf"
+FUSION_WEIGHTED = "weighted"
+
+
+class HybridRetriever:
+    """
+    Score-aware hybrid retriever over the FAISS vector store and the BM25 index.
+
+    Both indexes return scored candidates keyed by the stable `chunk_id` assigned at
+    ingestion, which are fused with either reciprocal-rank fusion ("rrf") or a weighted
+    sum of min-max normalized scores ("weighted"). Results can be trimmed with an
+    absolute score cut-off and an adaptive k relative to the best fused score.
+
+    Query embeddings and ranked results are cached per corpus version (see RetrievalCache),
+    so repeated questions skip both the embedding model and the index scans.
+    """
+
+    def __init__(
+        self,
+        vector_store,
+        bm25_index,
+        documents: List[Document],
+        fusion: str = FUSION_RRF,
+        weights: Sequence[float] = (0.7, 0.3),
+        rrf_k: int = 60,
+        candidate_k: int = 20,
+        min_score: float = 0.0,
+        adaptive_ratio: float = 0.0,
+        corpus_version: str = None,
+        cache=retrieval_cache,
+    ):
+        if fusion not in (FUSION_RRF, FUSION_WEIGHTED):
+            raise ValueError(f"Unknown fusion method: {fusion}")
+
+        self.vector_store = vector_store
+        self.bm25 = bm25_index
+        self.documents = documents
+        self.doc_by_id: Dict[str, Document] = {doc.metadata["chunk_id"]: doc for doc in documents}
+        self.fusion = fusion
+        self.weights = tuple(weights)
+        self.rrf_k = rrf_k
+        self.candidate_k = candidate_k
+        self.min_score = min_score
+        self.adaptive_ratio = adaptive_ratio
+        self.corpus_version = corpus_version
+        self.cache = cache
+        # A new corpus version (index rebuild) invalidates everything cached for the old one
+        self.cache.bind_version(corpus_version)
+
+    @timed("embedding")
+    def embed_query(self, query: str) -> List[float]:
+        """
+        Embed the query with the index's embedding model, reusing a cached vector if present.
+        """
+        vector = self.cache.get_vector(query)
+        if vector is None:
+            vector = self.vector_store.embeddings.embed_query(query)
+            self.cache.put_vector(query, vector)
+        return vector
+
+    @timed("vector_search")
+    def vector_candidates(self, vector: List[float], k: int) -> List[Tuple[str, float]]:
+        """
+        Top-k (chunk_id, cosine similarity) pairs from FAISS for a query embedding.
+        Embeddings are unit-normalized, so squared L2 distance d maps to cosine 1 - d/2.
+        """
+        results = self.vector_store.similarity_search_with_score_by_vector(vector, k=k)
+        return [(doc.metadata["chunk_id"], 1.0 - float(dist) / 2.0) for doc, dist in results]
+
+    @timed("bm25_search")
+    def keyword_candidates(self, query: str, k: int) -> List[Tuple[str, float]]:
+        """
+        Top-k (chunk_id, BM25 score) pairs; only documents containing a query term are scored.
+        """
+        return [(self.documents[i].metadata["chunk_id"], score) for i, score in self.bm25.search(query, k)]
+
+    @timed("fusion")
+    def fuse(self, ranked_lists: List[List[Tuple[str, float]]]) -> List[Tuple[str, float]]:
+        """
+        Fuse several ranked (chunk_id, score) lists into one list sorted by fused score.
+        """
+        fused: Dict[str, float] = {}
+
+        for weight, ranked in zip(self.weights, ranked_lists):
+            if not ranked:
+                continue
+
+            if self.fusion == FUSION_RRF:
+                for rank, (chunk_id, _) in enumerate(ranked, start=1):
+                    fused[chunk_id] = fused.get(chunk_id, 0.0) + weight / (self.rrf_k + rank)
+            else:
+                values = [score for _, score in ranked]
+                low, high = min(values), max(values)
+                span = (high - low) or 1.0
+                for chunk_id, score in ranked:
+                    norm = (score - low) / span if high > low else 1.0
+                    fused[chunk_id] = fused.get(chunk_id, 0.0) + weight * norm
+
+        return sorted(fused.items(), key=lambda item: item[1], reverse=True)
+
+    def cut(self, fused: List[Tuple[str, float]], k: int) -> List[Tuple[str, float]]:
+        """
+        Apply the absolute score cut-off, then the adaptive cut relative to the best score.
+        """
+        kept = [item for item in fused[:k] if item[1] >= self.min_score]
+        if kept and self.adaptive_ratio > 0:
+            floor = kept[0][1] * self.adaptive_ratio
+            kept = [item for item in kept if item[1] >= floor]
+        return kept
+
+    def search(self, query: str, k: int = 4) -> List[Tuple[Document, float]]:
+        """
+        Retrieve up to k (Document, fused score) pairs for the query.
+        """
+        ranked = self.cache.get_results(query, k)
+        if ranked is None:
+            candidate_k = max(k, self.candidate_k)
+            ranked_lists = [
+                self.vector_candidates(self.embed_query(query), candidate_k),
+                self.keyword_candidates(query, candidate_k),
+            ]
+            ranked = self.cut(self.fuse(ranked_lists), k)
+            self.cache.put_results(query, k, ranked)
+        return [(self.doc_by_id[chunk_id], score) for chunk_id, score in ranked]
@@ -0,0 +1,130 @@
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from django.conf import settings
+from django.utils import timezone
+
+from chat.models import ClientUser, Conversation
+
+
+class IdentityCache:
+    """
+    Bounded LRU maps of client_user_id -> (ClientUser pk, stored name) and
+    session_id -> Conversation pk.
+
+    Rows are looked up (or created) on first use only; afterwards a message for a known
+    user and session costs no queries, and the ClientUser name is written only when
+    the client sends a different one.
+    """
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._users: "OrderedDict[str, tuple]" = OrderedDict()
+        self._conversations: "OrderedDict[str, int]" = OrderedDict()
+        self._counters = {"hits": 0, "misses": 0, "name_updates": 0}
+
+    def _get(self, entries: OrderedDict, key):
+        with self._lock:
+            value = entries.get(key)
+            if value is not None:
+                entries.move_to_end(key)
+            return value
+
+    def _put(self, entries: OrderedDict, key, value) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            entries[key] = value
+            entries.move_to_end(key)
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self._counters[key] += 1
+
+    def conversation_id(self, session_id: str) -> Optional[int]:
+        """
+        Cached Conversation pk for a session, or None if unknown.
+        """
+        return self._get(self._conversations, session_id)
+
+    def forget(self, client_user_id, session_id: Optional[str] = None) -> None:
+        """
+        Drop cached identities (e.g. after a DB error suggesting a row was deleted).
+        """
+        with self._lock:
+            self._users.pop(str(client_user_id), None)
+            if session_id is not None:
+                self._conversations.pop(session_id, None)
+
+    def ensure(self, client_user_id, client_user_name: str, session_id: str) -> int:
+        """
+        Make sure the ClientUser and Conversation rows exist; returns the Conversation pk.
+        """
+        user_key = str(client_user_id)
+        user = self._get(self._users, user_key)
+        if user is None:
+            self._count("misses")
+            client_user, _ = ClientUser.objects.get_or_create(
+                user_id=client_user_id,
+                defaults={"name": client_user_name}
+            )
+            user = (client_user.pk, client_user.name)
+        else:
+            self._count("hits")
+
+        if user[1] != client_user_name:
+            ClientUser.objects.filter(pk=user[0]).update(name=client_user_name, updated=timezone.now())
+            self._count("name_updates")
+        self._put(self._users, user_key, (user[0], client_user_name))
+
+        conversation_id = self._get(self._conversations, session_id)
+        if conversation_id is None:
+            conversation, _ = Conversation.objects.get_or_create(
+                session_id=session_id,
+                defaults={"client_user_id": user[0]}
+            )
+            conversation_id = conversation.pk
+            self._put(self._conversations, session_id, conversation_id)
+        return conversation_id
+
+    async def aensure(self, client_user_id, client_user_name: str, session_id: str) -> int:
+        """
+        Async version of ensure.
+        """
+        user_key = str(client_user_id)
+        user = self._get(self._users, user_key)
+        if user is None:
+            self._count("misses")
+            client_user, _ = await ClientUser.objects.aget_or_create(
+                user_id=client_user_id,
+                defaults={"name": client_user_name}
+            )
+            user = (client_user.pk, client_user.name)
+        else:
+            self._count("hits")
+
+        if user[1] != client_user_name:
+            await ClientUser.objects.filter(pk=user[0]).aupdate(name=client_user_name, updated=timezone.now())
+            self._count("name_updates")
+        self._put(self._users, user_key, (user[0], client_user_name))
+
+        conversation_id = self._get(self._conversations, session_id)
+        if conversation_id is None:
+            conversation, _ = await Conversation.objects.aget_or_create(
+                session_id=session_id,
+                defaults={"client_user_id": user[0]}
+            )
+            conversation_id = conversation.pk
+            self._put(self._conversations, session_id, conversation_id)
+        return conversation_id
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._counters, "users": len(self._users), "conversations": len(self._conversations)}
+
+
+identity_cache = IdentityCache(max_entries=settings.IDENTITY_CACHE_SIZE)
@@ -1,28 +1,177 @@
 # chat/utils/langchain_memory.py
 
+import time
+import threading
+from collections import deque
+from datetime import datetime
+from typing import Optional
+
+from django.conf import settings
+from django.utils import timezone
 from langchain_core.chat_history import BaseChatMessageHistory
 from chat.models import Conversation, ConversationHistory
+from chat.utils.identity_cache import identity_cache
+from chat.utils.session_store import SESSION_BACKEND_DATABASE
+from chat.utils.turn_writer import turn_writer, write_behind
 from langchain.schema.messages import AIMessage, HumanMessage
 
+
+def _to_messages(rows) -> list:
+    """
+    Convert (user_text, assistant_text) rows, oldest first, into LangChain messages.
+    """
+    msgs = []
+    for user_text, assistant_text in rows:
+        if user_text:
+            msgs.append(HumanMessage(content=user_text))
+        if assistant_text:
+            msgs.append(AIMessage(content=assistant_text))
+    return msgs
+
+
 class DjangoChatMessageHistory(BaseChatMessageHistory):
     """
     Custom chat message history that uses Django models to store and retrieve
     conversation history (user + assistant messages) for LangChain memory.
+
+    With `max_turns` set, only the last `max_turns` ConversationHistory rows are read
+    (ORDER BY request_at DESC LIMIT, served by the (conversation, request_at) index) and
+    kept in an in-process ring buffer that writes update, so a turn costs the same for
+    long and short sessions. The buffer is reloaded from the database after
+    CHAT_HISTORY_CACHE_TTL seconds and, when sessions are shared between workers
+    (SESSION_BACKEND=database), as soon as the session's row count shows another worker
+    wrote a turn; neither happens while this session has turns waiting in the
+    write-behind queue (see add_turn).
     """
 
-    def __init__(self, session_id: str):
+    def __init__(self, session_id: str, max_turns: Optional[int] = None):
         """
         Initialize the message history with a unique session_id.
         This is typically tied to a user session in the chat system.
         """
         self.session_id = session_id
+        self.max_turns = max_turns
+        self._lock = threading.Lock()
+        self._rows = None  # deque of [user_text, assistant_text], oldest first
+        self._loaded_at = 0.0
+        self._writes = 0  # bumped on every write; a load that raced a write is not cached
+        self._pending = 0  # turns queued in the turn writer and not yet committed
+        self._count = None  # rows this process expects in the database (None = unknown)
+
+    # -- ring buffer ------------------------------------------------------
+
+    def _windowed(self) -> bool:
+        return self.max_turns is not None
+
+    @staticmethod
+    def _shared() -> bool:
+        # Other workers may write turns for the same session
+        return settings.SESSION_BACKEND == SESSION_BACKEND_DATABASE
+
+    def _session_rows(self):
+        """
+        Queryset of all the session's rows; its count reveals turns written by other workers.
+        """
+        return ConversationHistory.objects.filter(conversation__session_id=self.session_id)
+
+    def _recent_rows(self):
+        """
+        Queryset of the last max_turns rows, newest first.
+        """
+        return ConversationHistory.objects.filter(
+            conversation__session_id=self.session_id
+        ).order_by("-request_at").values_list("user_text", "assistant_text")[:self.max_turns]
+
+    def _buffered(self):
+        """
+        Returns (rows or None, write generation, expected row count or None); rows None
+        means load from the database, and a row count means check it before using them.
+        """
+        ttl = settings.CHAT_HISTORY_CACHE_TTL
+        with self._lock:
+            expired = ttl <= 0 or time.monotonic() - self._loaded_at > ttl
+            if self._pending:
+                # Turns of this session are still queued: the database is behind the buffer
+                if self._rows is None:
+                    return None, self._writes, None
+                return [list(row) for row in self._rows], self._writes, None
+            if self._rows is None or expired or (self._shared() and self._count is None):
+                return None, self._writes, None
+            return [list(row) for row in self._rows], self._writes, self._count if self._shared() else None
+
+    def _fill(self, rows_newest_first, generation: int, count=None) -> list:
+        rows = [list(row) for row in reversed(rows_newest_first)]
+        with self._lock:
+            if generation == self._writes:
+                self._rows = deque(rows, maxlen=max(self.max_turns, 1))
+                self._loaded_at = time.monotonic()
+                self._count = count
+        return rows
+
+    def _record_user(self, message: str) -> None:
+        with self._lock:
+            self._writes += 1
+            if self._count is not None:
+                self._count += 1
+            if self._rows is not None:
+                self._rows.append([message, None])
+
+    def _record_ai(self, message: str) -> None:
+        # Mirrors add_ai_message: fill the newest unanswered row, else start a new one
+        with self._lock:
+            self._writes += 1
+            self._count = None  # may have updated a row or inserted one
+            if self._rows is None:
+                return
+            for row in reversed(self._rows):
+                if row[1] is None:
+                    row[1] = message
+                    return
+            self._rows.append([None, message])
+
+    def _record_turn(self, user_text: str, assistant_text: str) -> None:
+        with self._lock:
+            self._writes += 1
+            if self._count is not None:
+                self._count += 1
+            if self._rows is not None:
+                self._rows.append([user_text, assistant_text])
+
+    def _turn_written(self) -> None:
+        with self._lock:
+            self._pending -= 1
+
+    def _queue_turn(self, user_text: str, assistant_text: str, request_at: datetime) -> bool:
+        """
+        Hand the turn to the write-behind writer; False if it must be written now.
+        """
+        if not write_behind():
+            return False
+        with self._lock:
+            self._pending += 1
+        if turn_writer.submit(self.session_id, user_text, assistant_text, request_at,
+                              on_written=self._turn_written):
+            return True
+        self._turn_written()
+        return False
+
+    # -- reads ------------------------------------------------------------
 
     @property
     def messages(self):
         """
-        Return the full message history as a list of LangChain `HumanMessage` and `AIMessage`.
-        Fetches from the Django ConversationHistory model, ordered by request time.
+        Return the message history as a list of LangChain `HumanMessage` and `AIMessage`,
+        ordered by request time (only the last `max_turns` exchanges when windowed).
         """
+        if self._windowed():
+            rows, generation, count = self._buffered()
+            if rows is not None and count is not None and self._session_rows().count() != count:
+                rows = None  # another worker wrote a turn
+            if rows is None:
+                count = self._session_rows().count() if self._shared() else None
+                rows = self._fill(list(self._recent_rows()), generation, count)
+            return _to_messages(rows)
+
         try:
             convo = Conversation.objects.get(session_id=self.session_id)
             history = ConversationHistory.objects.filter(conversation=convo).order_by("request_at")
@@ -36,6 +185,64 @@ class DjangoChatMessageHistory(BaseChatMessageHistory):
         except Conversation.DoesNotExist:
             return []
 
+    async def aget_messages(self):
+        """
+        Async version of `messages`, using Django's async ORM.
+        """
+        if self._windowed():
+            rows, generation, count = self._buffered()
+            if rows is not None and count is not None and await self._session_rows().acount() != count:
+                rows = None  # another worker wrote a turn
+            if rows is None:
+                count = await self._session_rows().acount() if self._shared() else None
+                rows = self._fill([row async for row in self._recent_rows()], generation, count)
+            return _to_messages(rows)
+
+        try:
+            convo = await Conversation.objects.aget(session_id=self.session_id)
+        except Conversation.DoesNotExist:
+            return []
+
+        msgs = []
+        async for h in ConversationHistory.objects.filter(conversation=convo).order_by("request_at"):
+            if h.user_text:
+                msgs.append(HumanMessage(content=h.user_text))
+            if h.assistant_text:
+                msgs.append(AIMessage(content=h.assistant_text))
+        return msgs
+
+    # -- writes -----------------------------------------------------------
+
+    def add_turn(self, user_text: str, assistant_text: str, request_at: Optional[datetime] = None):
+        """
+        Store a complete exchange as a single ConversationHistory row stamped with
+        `request_at` (when the user sent the message; defaults to now). In write-behind
+        mode the row is queued for the turn writer and reads are served from the buffer.
+        """
+        request_at = request_at or timezone.now()
+        if not self._queue_turn(user_text, assistant_text, request_at):
+            conversation_id = identity_cache.conversation_id(self.session_id) or \
+                Conversation.objects.values_list("id", flat=True).get(session_id=self.session_id)
+            ConversationHistory.objects.create(
+                conversation_id=conversation_id, user_text=user_text, assistant_text=assistant_text,
+                request_at=request_at,
+            )
+        self._record_turn(user_text, assistant_text)
+
+    async def aadd_turn(self, user_text: str, assistant_text: str, request_at: Optional[datetime] = None):
+        """
+        Async version of add_turn.
+        """
+        request_at = request_at or timezone.now()
+        if not self._queue_turn(user_text, assistant_text, request_at):
+            conversation_id = identity_cache.conversation_id(self.session_id) or \
+                await Conversation.objects.values_list("id", flat=True).aget(session_id=self.session_id)
+            await ConversationHistory.objects.acreate(
+                conversation_id=conversation_id, user_text=user_text, assistant_text=assistant_text,
+                request_at=request_at,
+            )
+        self._record_turn(user_text, assistant_text)
+
     def add_user_message(self, message: str):
         """
         Add a new user message to the conversation history.
@@ -43,6 +250,7 @@ class DjangoChatMessageHistory(BaseChatMessageHistory):
         """
         convo, _ = Conversation.objects.get_or_create(session_id=self.session_id)
         ConversationHistory.objects.create(conversation=convo, user_text=message)
+        self._record_user(message)
 
     def add_ai_message(self, message: str):
         """
@@ -61,6 +269,31 @@ class DjangoChatMessageHistory(BaseChatMessageHistory):
         else:
             # Fallback if user message was not saved first (shouldn't normally happen)
             ConversationHistory.objects.create(conversation=convo, assistant_text=message)
+        self._record_ai(message)
+
+    async def aadd_user_message(self, message: str):
+        """
+        Async version of add_user_message.
+        """
+        convo, _ = await Conversation.objects.aget_or_create(session_id=self.session_id)
+        await ConversationHistory.objects.acreate(conversation=convo, user_text=message)
+        self._record_user(message)
+
+    async def aadd_ai_message(self, message: str):
+        """
+        Async version of add_ai_message.
+        """
+        convo = await Conversation.objects.aget(session_id=self.session_id)
+        last_entry = await ConversationHistory.objects.filter(
+            conversation=convo, assistant_text__isnull=True
+        ).order_by("-request_at").afirst()
+
+        if last_entry:
+            last_entry.assistant_text = message
+            await last_entry.asave()
+        else:
+            await ConversationHistory.objects.acreate(conversation=convo, assistant_text=message)
+        self._record_ai(message)
 
     def clear(self):
         """
@@ -69,3 +302,7 @@ class DjangoChatMessageHistory(BaseChatMessageHistory):
         """
         convo = Conversation.objects.get(session_id=self.session_id)
         ConversationHistory.objects.filter(conversation=convo).delete()
+        with self._lock:
+            self._writes += 1
+            self._rows = None
+            self._count = None
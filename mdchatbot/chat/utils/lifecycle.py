@@ -0,0 +1,194 @@
+import os
+import sys
+import time
+import logging
+import threading
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Query used to exercise the embedding model and both indexes before reporting ready
+WARMUP_QUERY = "How to start a shift?"
+
+
+def should_warm_up() -> bool:
+    """
+    Decide whether this process serves chat traffic and should warm the retrieval stack.
+    Management commands (migrate, shell, ...) and the runserver autoreloader parent skip it.
+    """
+    if not settings.CHAT_WARMUP_ON_STARTUP:
+        return False
+
+    if os.path.basename(sys.argv[0]) == "manage.py":
+        command = sys.argv[1] if len(sys.argv) > 1 else ""
+        if command != "runserver":
+            return False
+        # The autoreloader parent only watches files; the child (RUN_MAIN) serves requests
+        if "--noreload" not in sys.argv and os.environ.get("RUN_MAIN") != "true":
+            return False
+
+    return True
+
+
+class ChatLifecycle:
+    """
+    Owns the expensive chat dependencies (Gemini client, embedding model, FAISS/BM25
+    retrievers) so importing the chat modules has no side effects.
+    Initialization runs once, either on a background thread started from
+    ChatConfig.ready() or on first use via ensure_ready().
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._ready = threading.Event()
+        self._thread = None
+
+        self.gemini_client = None
+        self.embedding_model = None
+        self.retriever = None
+        self.vector_db = None
+        self.bm25_index = None
+        self.documents = None
+
+        self.error = None
+        self.failed_at = None  # monotonic time of the last failed initialization
+        self.started_at = None
+        self.ready_at = None
+
+    @property
+    def is_ready(self) -> bool:
+        return self._ready.is_set()
+
+    def start(self) -> None:
+        """
+        Start initialization on a background thread (no-op if already started or ready,
+        or within CHAT_INIT_RETRY_BACKOFF seconds of a failed attempt).
+        """
+        with self._lock:
+            if self._thread is not None or self.is_ready:
+                return
+            if self.failed_at is not None and time.monotonic() - self.failed_at < settings.CHAT_INIT_RETRY_BACKOFF:
+                return
+            self._done.clear()
+            self.error = None
+            self.started_at = time.time()
+            self._thread = threading.Thread(target=self._initialize, name="chat-warmup", daemon=True)
+            self._thread.start()
+
+    def ensure_ready(self, timeout: float = None) -> bool:
+        """
+        Block until the stack is ready, starting initialization if needed.
+        Returns False if initialization failed or did not finish within `timeout` seconds.
+        """
+        if self.is_ready:
+            return True
+        self.start()
+        self._done.wait(timeout)
+        return self.is_ready
+
+    def status(self) -> dict:
+        """
+        Return a JSON-serializable summary for the readiness endpoint.
+        """
+        if self.is_ready:
+            state = "ready"
+        elif self.error:
+            state = "failed"
+        elif self._thread is not None:
+            state = "starting"
+        else:
+            state = "idle"
+
+        from chat.utils import rewrite_gate
+        from chat.utils.answer_cache import semantic_cache
+        from chat.utils.chatbot import get_speculation_stats
+        from chat.utils.llm_gateway import llm_gateway
+        from chat.utils.resilience import gemini_breaker, rewrite_caller, generation_caller
+        from chat.utils.retrieval_cache import retrieval_cache
+        from chat.utils.turn_writer import turn_writer
+        from chat.utils.identity_cache import identity_cache
+        from chat.utils.session_store import user_sessions
+
+        return {
+            "status": state,
+            "error": self.error,
+            "documents": len(self.documents) if self.documents else 0,
+            "corpus_version": getattr(self.retriever, "corpus_version", None),
+            "startup_seconds": round(self.ready_at - self.started_at, 3) if self.ready_at else None,
+            "retrieval_cache": retrieval_cache.stats(),
+            "rewrite_gate": rewrite_gate.get_stats(),
+            "speculative_retrieval": get_speculation_stats(),
+            "semantic_cache": semantic_cache.stats(),
+            "llm_gateway": llm_gateway.stats(),
+            "gemini_resilience": {
+                "circuit": gemini_breaker.stats(),
+                "rewrite": rewrite_caller.stats(),
+                "generation": generation_caller.stats(),
+            },
+            "embedding_backend": settings.EMBEDDING_BACKEND,
+            "embedding_sidecar": self.embedding_model.stats() if hasattr(self.embedding_model, "stats") else None,
+            "turn_writer": turn_writer.stats(),
+            "identity_cache": identity_cache.stats(),
+            "sessions": user_sessions.stats(),
+        }
+
+    def after_fork(self) -> None:
+        """
+        Reset per-process resources in a forked worker (see gunicorn.conf.py). The
+        retrieval stack loaded by the parent is inherited and shared copy-on-write; the
+        Gemini client holds HTTP connection pools, which must not be shared across
+        processes, so each worker builds its own.
+        """
+        if self.gemini_client is not None:
+            from google import genai
+
+            self.gemini_client = genai.Client(api_key=settings.GEMINI_API_KEY)
+        with self._lock:
+            if not self.is_ready:
+                self._thread = None  # an unfinished parent warm-up does not exist here
+
+    def _initialize(self) -> None:
+        """
+        Build the Gemini client and retrieval stack, then run a warm-up query.
+        """
+        try:
+            # Imported lazily so that importing this module stays cheap
+            from google import genai
+            from chat.utils.data_processor import setup_vector_db
+
+            self.gemini_client = genai.Client(api_key=settings.GEMINI_API_KEY)
+
+            retriever, vector_db, bm25_index, documents = setup_vector_db()
+            if vector_db is None:
+                raise RuntimeError("vector DB setup failed")
+
+            self.retriever = retriever
+            self.vector_db = vector_db
+            self.bm25_index = bm25_index
+            self.documents = documents
+            self.embedding_model = vector_db.embeddings
+
+            # Warm-up: loads model weights/caches and touches both indexes
+            retriever.search(WARMUP_QUERY, k=1)
+
+            self.ready_at = time.time()
+            self._ready.set()
+            logger.info(f"Chat stack ready in {self.ready_at - self.started_at:.2f}s")
+
+        except Exception as e:
+            self.error = str(e)
+            self.failed_at = time.monotonic()
+            logger.error(f"Chat stack initialization failed: {str(e)}")
+
+        finally:
+            # Wake waiters before a later start() can clear _done for a retry
+            self._done.set()
+            if not self.is_ready:
+                with self._lock:
+                    self._thread = None  # allow start() to retry once the backoff expires
+
+
+# Process-wide lifecycle instance
+lifecycle = ChatLifecycle()
@@ -0,0 +1,243 @@
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import weakref
+import threading
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager, asynccontextmanager
+from typing import Any, Dict
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class LLMQueueTimeout(Exception):
+    """
+    Raised when a call waited longer than the queue timeout for a free slot.
+    """
+
+
+def request_key(model: str, contents: Any, config: Any) -> str:
+    """
+    Hash identifying a generate_content request (model, config and contents).
+    """
+    if hasattr(config, "model_dump"):
+        config = config.model_dump(mode="json", exclude_none=True)
+    payload = json.dumps({"model": model, "contents": contents, "config": config}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMGateway:
+    """
+    Single outbound path for Gemini calls in this process.
+
+    - Caps concurrent upstream calls at `max_concurrency`; callers beyond that queue for
+      up to `queue_timeout` seconds and then fail with LLMQueueTimeout.
+    - Coalesces identical in-flight generate_content requests (single-flight): the first
+      caller makes the upstream call and every concurrent duplicate receives its result.
+
+    Sync and async callers (on any event loop) draw from one process-wide semaphore
+    sized `max_concurrency`; async callers that have to wait for a slot wait on a
+    small thread pool, so the event loop is never blocked.
+    """
+
+    def __init__(self, max_concurrency: int = 8, queue_timeout: float = 10.0):
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, Future] = {}
+        self._async_state = weakref.WeakKeyDictionary()  # event loop -> in-flight futures
+        self._waiters = None  # thread pool for async callers waiting on a slot (created on demand)
+        self._stats = Counter()
+        self._wait_max = 0.0
+
+    # -- accounting -------------------------------------------------------
+
+    def _queued(self) -> float:
+        with self._lock:
+            self._stats["queue_depth"] += 1
+            self._stats["peak_queue_depth"] = max(self._stats["peak_queue_depth"], self._stats["queue_depth"])
+        return time.monotonic()
+
+    def _dequeued(self, started: float, acquired: bool) -> None:
+        waited = time.monotonic() - started
+        with self._lock:
+            self._stats["queue_depth"] -= 1
+            self._stats["wait_seconds_total"] += waited
+            self._wait_max = max(self._wait_max, waited)
+            if acquired:
+                self._stats["calls"] += 1
+                self._stats["in_flight"] += 1
+            else:
+                self._stats["queue_timeouts"] += 1
+
+    def _released(self) -> None:
+        with self._lock:
+            self._stats["in_flight"] -= 1
+
+    def _timeout(self) -> LLMQueueTimeout:
+        logger.warning(f"LLM gateway queue timeout after {self.queue_timeout}s")
+        return LLMQueueTimeout(f"no LLM slot free within {self.queue_timeout}s")
+
+    # -- sync -------------------------------------------------------------
+
+    @contextmanager
+    def slot(self):
+        """
+        Hold one upstream slot for the duration of the block (e.g. a streaming call).
+        """
+        started = self._queued()
+        acquired = self._semaphore.acquire(timeout=self.queue_timeout)
+        self._dequeued(started, acquired)
+        if not acquired:
+            raise self._timeout()
+        try:
+            yield
+        finally:
+            self._semaphore.release()
+            self._released()
+
+    def generate(self, client, model: str, contents: Any, config: Any, coalesce: bool = True):
+        """
+        client.models.generate_content through the gateway (capped and, unless
+        `coalesce` is False, coalesced with identical in-flight requests).
+        """
+        if not coalesce:
+            with self.slot():
+                return client.models.generate_content(model=model, contents=contents, config=config)
+
+        key = request_key(model, contents, config)
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+            else:
+                self._stats["coalesced"] += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            with self.slot():
+                response = client.models.generate_content(model=model, contents=contents, config=config)
+            future.set_result(response)
+            return response
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    # -- async ------------------------------------------------------------
+
+    def _loop_inflight(self) -> dict:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            inflight = self._async_state.get(loop)
+            if inflight is None:
+                inflight = self._async_state[loop] = {}
+        return inflight
+
+    def _waiter_pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._waiters is None:
+                self._waiters = ThreadPoolExecutor(
+                    max_workers=max(self.max_concurrency * 4, 16), thread_name_prefix="llm-slot-wait"
+                )
+            return self._waiters
+
+    def _acquire_by(self, deadline: float) -> bool:
+        return self._semaphore.acquire(timeout=max(deadline - time.monotonic(), 0.0))
+
+    def _release_if_acquired(self, future) -> None:
+        # A waiter whose caller was cancelled must give back the slot it acquired
+        if not future.cancelled() and future.exception() is None and future.result():
+            self._semaphore.release()
+
+    @asynccontextmanager
+    async def aslot(self):
+        """
+        Async version of slot(), drawing from the same process-wide semaphore.
+        """
+        started = self._queued()
+        acquired = self._semaphore.acquire(blocking=False)
+        if not acquired:
+            deadline = started + self.queue_timeout
+            waiter = asyncio.get_running_loop().run_in_executor(self._waiter_pool(), self._acquire_by, deadline)
+            try:
+                acquired = await asyncio.shield(waiter)
+            except asyncio.CancelledError:
+                waiter.add_done_callback(self._release_if_acquired)
+                self._dequeued(started, False)
+                raise
+        self._dequeued(started, acquired)
+        if not acquired:
+            raise self._timeout()
+        try:
+            yield
+        finally:
+            self._semaphore.release()
+            self._released()
+
+    async def agenerate(self, client, model: str, contents: Any, config: Any, coalesce: bool = True):
+        """
+        Async version of generate() using client.aio.
+        """
+        if not coalesce:
+            async with self.aslot():
+                return await client.aio.models.generate_content(model=model, contents=contents, config=config)
+
+        inflight = self._loop_inflight()
+        key = request_key(model, contents, config)
+        future = inflight.get(key)
+        if future is not None:
+            with self._lock:
+                self._stats["coalesced"] += 1
+            # shield: a cancelled waiter must not cancel the shared call
+            return await asyncio.shield(future)
+
+        future = inflight[key] = asyncio.get_running_loop().create_future()
+        try:
+            async with self.aslot():
+                response = await client.aio.models.generate_content(model=model, contents=contents, config=config)
+            future.set_result(response)
+            return response
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # mark retrieved when nobody else was waiting
+            raise
+        finally:
+            inflight.pop(key, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            calls = self._stats["calls"]
+            return {
+                "max_concurrency": self.max_concurrency,
+                "queue_timeout": self.queue_timeout,
+                "in_flight": self._stats["in_flight"],
+                "queue_depth": self._stats["queue_depth"],
+                "peak_queue_depth": self._stats["peak_queue_depth"],
+                "calls": calls,
+                "coalesced": self._stats["coalesced"],
+                "queue_timeouts": self._stats["queue_timeouts"],
+                "avg_wait_seconds": round(self._stats["wait_seconds_total"] / calls, 4) if calls else 0.0,
+                "max_wait_seconds": round(self._wait_max, 4),
+            }
+
+
+# Process-wide gateway shared by the query rewrite and answer generation
+llm_gateway = LLMGateway(
+    max_concurrency=settings.LLM_MAX_CONCURRENCY,
+    queue_timeout=settings.LLM_QUEUE_TIMEOUT,
+)
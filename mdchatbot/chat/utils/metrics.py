@@ -0,0 +1,331 @@
+import time
+import asyncio
+import logging
+import threading
+import contextvars
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import partial, wraps
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+# Per-request trace (request ID, spans, DB query count); set by RequestMetricsMiddleware
+_current_request: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("chat_request", default=None)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    Monotonic counter with optional labels.
+    """
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple((name, labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> List[Tuple[str, tuple, float]]:
+        with self._lock:
+            return [(f"{self.name}_total", key, value) for key, value in self._values.items()]
+
+
+class Histogram:
+    """
+    Cumulative-bucket histogram with optional labels.
+    """
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._values: Dict[tuple, list] = {}  # labels -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple((name, labels[name]) for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def samples(self) -> List[Tuple[str, tuple, float]]:
+        out = []
+        with self._lock:
+            items = [(key, list(state)) for key, state in self._values.items()]
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                out.append((f"{self.name}_bucket", key + (("le", _format_value(float(bound))),), cumulative))
+            out.append((f"{self.name}_bucket", key + (("le", "+Inf"),), state[-1]))
+            out.append((f"{self.name}_sum", key, state[-2]))
+            out.append((f"{self.name}_count", key, state[-1]))
+        return out
+
+
+class MetricsRegistry:
+    """
+    Process-local metrics rendered in the Prometheus text exposition format.
+    Collectors are called at scrape time and return
+    (name, kind, documentation, [(labels dict, value), ...]) tuples.
+    """
+
+    def __init__(self):
+        self._metrics: List = []
+        self._collectors: List[Callable[[], list]] = []
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets=LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector: Callable[[], list]) -> None:
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+        for collector in self._collectors:
+            try:
+                families = collector()
+            except Exception as e:
+                logger.error(f"Metrics collector failed: {e}")
+                continue
+            for name, kind, documentation, samples in families:
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {kind}")
+                sample_name = f"{name}_total" if kind == "counter" else name
+                for labels, value in samples:
+                    if value is None:
+                        continue
+                    lines.append(f"{sample_name}{_format_labels(tuple(labels.items()))} {_format_value(value)}")
+
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+STAGE_SECONDS = registry.histogram(
+    "chat_stage_duration_seconds", "Time spent in each chat pipeline stage.", ["stage"]
+)
+REQUEST_SECONDS = registry.histogram(
+    "chat_http_request_duration_seconds", "HTTP request latency by route.", ["route", "method", "status"]
+)
+REQUEST_DB_QUERIES = registry.histogram(
+    "chat_http_request_db_queries", "Database queries executed per HTTP request.", ["route"], buckets=COUNT_BUCKETS
+)
+GEMINI_ERRORS = registry.counter(
+    "chat_gemini_errors", "Failed Gemini calls by call site and exception type.", ["call", "type"]
+)
+DB_QUERIES = registry.counter("chat_db_queries", "Database queries executed by this process.")
+
+
+# -- request trace ---------------------------------------------------------
+
+def start_request(request_id: str) -> Tuple[dict, contextvars.Token]:
+    trace = {"id": request_id, "spans": [], "db_queries": 0}
+    return trace, _current_request.set(trace)
+
+
+def end_request(token: contextvars.Token) -> None:
+    _current_request.reset(token)
+
+
+def current_request_id() -> Optional[str]:
+    trace = _current_request.get()
+    return trace["id"] if trace else None
+
+
+def current_trace() -> Optional[dict]:
+    return _current_request.get()
+
+
+@contextmanager
+def span(stage: str):
+    """
+    Time a pipeline stage into chat_stage_duration_seconds and the current request trace.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        trace = _current_request.get()
+        if trace is not None:
+            trace["spans"].append((stage, elapsed))
+
+
+def timed(stage: str):
+    """
+    Decorator recording each call of a (sync or async) function as a span.
+    """
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(stage):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_error(call: str, exc: BaseException) -> None:
+    GEMINI_ERRORS.inc(call=call, type=type(exc).__name__)
+
+
+def count_query(execute, sql, params, many, context):
+    """
+    Database execute wrapper (installed on every connection) counting queries.
+    Profiled requests (trace["sql"] set by chat.utils.profiler) also log each query.
+    """
+    DB_QUERIES.inc()
+    trace = _current_request.get()
+    if trace is None:
+        return execute(sql, params, many, context)
+
+    trace["db_queries"] += 1
+    queries = trace.get("sql")
+    if queries is None:
+        return execute(sql, params, many, context)
+
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        queries.append({
+            "sql": sql,
+            "ms": round((time.perf_counter() - started) * 1000, 3),
+            "many": many,
+            "thread": threading.current_thread().name,
+        })
+
+
+def bind_context(func: Callable, *args) -> Callable[[], object]:
+    """
+    Callable running func(*args) in a copy of the current context, so that spans
+    recorded on executor threads are attached to the calling request.
+    """
+    return partial(contextvars.copy_context().run, _run_traced, func, *args)
+
+
+def _run_traced(func: Callable, *args):
+    trace = _current_request.get()
+    profiler = trace.get("profiler") if trace is not None else None
+    if profiler is None:
+        return func(*args)
+    with profiler.attached():
+        return func(*args)
+
+
+# -- collectors for stats kept by other modules ----------------------------
+
+def _chat_stats() -> list:
+    from chat.utils import rewrite_gate
+    from chat.utils.answer_cache import semantic_cache
+    from chat.utils.chatbot import get_speculation_stats
+    from chat.utils.llm_gateway import llm_gateway
+    from chat.utils.resilience import gemini_breaker, CircuitBreaker
+    from chat.utils.retrieval_cache import retrieval_cache
+    from chat.utils.lifecycle import lifecycle
+    from chat.utils.turn_writer import turn_writer
+    from chat.utils.session_store import user_sessions
+
+    retrieval = retrieval_cache.stats()
+    semantic = semantic_cache.stats()
+    gate = rewrite_gate.get_stats()
+    gateway = llm_gateway.stats()
+    breaker = gemini_breaker.stats()
+    writer = turn_writer.stats()
+    sessions = user_sessions.stats()
+    circuit_states = [CircuitBreaker.CLOSED, CircuitBreaker.HALF_OPEN, CircuitBreaker.OPEN]
+
+    return [
+        ("chat_ready", "gauge", "1 once the retrieval stack is warm.", [({}, int(lifecycle.is_ready))]),
+        ("chat_retrieval_cache_events", "counter", "Retrieval cache lookups by outcome.", [
+            ({"event": key}, value) for key, value in retrieval.items() if key not in ("version", "size")
+        ]),
+        ("chat_retrieval_cache_entries", "gauge", "Queries currently held by the retrieval cache.", [
+            ({}, retrieval["size"])
+        ]),
+        ("chat_semantic_cache_events", "counter", "Semantic answer cache operations by outcome.", [
+            ({"event": key}, value) for key, value in semantic.items() if key != "enabled"
+        ]),
+        ("chat_rewrite_decisions", "counter", "Query rewrite gate decisions by reason.", [
+            ({"reason": reason}, count) for reason, count in gate["reasons"].items()
+        ]),
+        ("chat_speculative_retrieval", "counter", "Speculative retrieval outcomes.", [
+            ({"outcome": outcome}, count) for outcome, count in get_speculation_stats().items()
+        ]),
+        ("chat_llm_in_flight", "gauge", "Gemini calls currently in flight.", [({}, gateway["in_flight"])]),
+        ("chat_llm_queue_depth", "gauge", "Gemini calls waiting for a gateway slot.", [({}, gateway["queue_depth"])]),
+        ("chat_llm_gateway_events", "counter", "LLM gateway calls, coalesced requests and queue timeouts.", [
+            ({"event": key}, gateway[key]) for key in ("calls", "coalesced", "queue_timeouts")
+        ]),
+        ("chat_gemini_circuit_state", "gauge", "Gemini circuit breaker state (0 closed, 1 half-open, 2 open).", [
+            ({}, circuit_states.index(breaker["state"]))
+        ]),
+        ("chat_sessions", "gauge", "Chat sessions held in this process.", [({}, sessions["sessions"])]),
+        ("chat_session_evictions", "counter", "Chat sessions dropped by the reaper (idle) or the LRU cap.", [
+            ({"reason": reason}, count) for reason, count in sessions["evictions"].items()
+        ]),
+        ("chat_turn_writer_pending", "gauge", "Conversation turns waiting for the write-behind writer.", [
+            ({}, writer["pending"])
+        ]),
+        ("chat_turn_writer_events", "counter", "Write-behind turns written, failed or rejected by a full queue.", [
+            ({"event": key}, writer[key]) for key in ("written", "failed", "queue_full")
+        ]),
+    ]
+
+
+registry.register_collector(_chat_stats)
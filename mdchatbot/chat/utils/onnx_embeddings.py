@@ -0,0 +1,126 @@
+import os
+import json
+import logging
+import threading
+from typing import List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+# Files written by `python manage.py export_onnx_embeddings`
+ONNX_MODEL_FILE = "model.onnx"
+ONNX_QUANTIZED_MODEL_FILE = "model_int8.onnx"
+ONNX_TOKENIZER_FILE = "tokenizer.json"
+ONNX_MANIFEST = "onnx_manifest.json"
+
+
+def onnx_model_path(model_dir: str, quantized: bool = False) -> str:
+    return os.path.join(model_dir, ONNX_QUANTIZED_MODEL_FILE if quantized else ONNX_MODEL_FILE)
+
+
+class OnnxEmbeddings(Embeddings):
+    """
+    Sentence embeddings from an ONNX export of the sentence-transformers model, run with
+    ONNX Runtime on CPU (no torch needed at serving time).
+
+    Reproduces the sentence-transformers pipeline recorded in the export manifest:
+    tokenize (truncated to max_seq_length), transformer, mean pooling over the attention
+    mask and, for models with a Normalize module, L2 normalization. Texts are embedded
+    in length-sorted batches of `batch_size` so short texts are not padded to long ones.
+
+    The ONNX Runtime session is created lazily per process: its thread pool does not
+    survive fork, so a session built in a preloading master is rebuilt in each worker.
+    """
+
+    def __init__(self, model_dir: str, quantized: bool = False, threads: int = 0, batch_size: int = 32):
+        self.model_dir = model_dir
+        self.quantized = quantized
+        self.model_path = onnx_model_path(model_dir, quantized)
+        self.threads = threads
+        self.batch_size = max(batch_size, 1)
+        if not os.path.isfile(self.model_path):
+            raise FileNotFoundError(
+                f"ONNX embedding model not found at {self.model_path}; "
+                f"run `python manage.py export_onnx_embeddings{' --quantize' if quantized else ''}`"
+            )
+        with open(os.path.join(model_dir, ONNX_MANIFEST), "r", encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        self.max_seq_length = self.manifest.get("max_seq_length", 256)
+        self.normalize = self.manifest.get("normalize", True)
+        self._lock = threading.Lock()
+        self._session = None
+        self._input_names = ()
+        self._tokenizer = None
+        self._pid = None
+
+    def _ensure_session(self):
+        if self._session is not None and self._pid == os.getpid():
+            return self._session, self._tokenizer
+        with self._lock:
+            if self._session is not None and self._pid == os.getpid():
+                return self._session, self._tokenizer
+            try:
+                import onnxruntime as ort
+                from tokenizers import Tokenizer
+            except ImportError as e:
+                raise ImportError("EMBEDDING_BACKEND=onnx requires the onnxruntime and tokenizers packages") from e
+
+            tokenizer = Tokenizer.from_file(os.path.join(self.model_dir, ONNX_TOKENIZER_FILE))
+            tokenizer.enable_truncation(max_length=self.max_seq_length)
+            tokenizer.enable_padding(
+                pad_id=self.manifest.get("pad_token_id", 0),
+                pad_token=self.manifest.get("pad_token", "[PAD]"),
+            )
+
+            options = ort.SessionOptions()
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            # Same per-worker budget as torch (gunicorn.conf.py sets OMP_NUM_THREADS)
+            threads = self.threads or int(os.environ.get("OMP_NUM_THREADS", 0))
+            if threads:
+                options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+            session = ort.InferenceSession(self.model_path, options, providers=["CPUExecutionProvider"])
+
+            self._input_names = tuple(i.name for i in session.get_inputs())
+            self._tokenizer = tokenizer
+            self._session = session
+            self._pid = os.getpid()
+            logger.info(f"Loaded ONNX embedding model {self.model_path} ({threads or 'default'} threads)")
+            return session, tokenizer
+
+    def _embed_batch(self, session, tokenizer, texts: List[str]) -> np.ndarray:
+        encodings = tokenizer.encode_batch(texts)
+        feeds = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+        hidden = session.run(None, {name: feeds[name] for name in self._input_names})[0]
+
+        # Mean pooling over real (non-padding) tokens
+        mask = feeds["attention_mask"][:, :, None].astype(np.float32)
+        vectors = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if self.normalize:
+            vectors /= np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+        return vectors.astype(np.float32)
+
+    def embed_array(self, texts: List[str]) -> np.ndarray:
+        session, tokenizer = self._ensure_session()
+        texts = [text.replace("\n", " ") for text in texts]
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        out: Optional[np.ndarray] = None
+        for start in range(0, len(order), self.batch_size):
+            rows = order[start:start + self.batch_size]
+            vectors = self._embed_batch(session, tokenizer, [texts[i] for i in rows])
+            if out is None:
+                out = np.empty((len(texts), vectors.shape[1]), dtype=np.float32)
+            out[rows] = vectors
+        return out if out is not None else np.empty((0, self.manifest.get("dim", 0)), dtype=np.float32)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embed_array(list(texts)).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_array([text])[0].tolist()
@@ -0,0 +1,24 @@
+"""
+PDF text extraction for the ingestion pipeline. Runs in spawned worker processes, so it
+imports nothing but pypdf (workers start without loading Django, langchain or models).
+"""
+from typing import List, Tuple
+
+from pypdf import PdfReader
+
+
+def count_pages(path: str) -> int:
+    return len(PdfReader(path).pages)
+
+
+def parse_pages(path: str, start: int, stop: int) -> List[Tuple[int, str, str]]:
+    """
+    Extracts pages [start, stop) of a PDF; returns (page index, page label, text) tuples
+    with the same text PyPDFLoader produces.
+    """
+    reader = PdfReader(path)
+    labels = reader.page_labels
+    return [
+        (page, labels[page], reader.pages[page].extract_text(extraction_mode="plain").strip())
+        for page in range(start, stop)
+    ]
@@ -0,0 +1,225 @@
+import os
+import sys
+import time
+import logging
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from typing import Optional
+
+from django.conf import settings
+from django.utils import timezone
+
+from chat.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+PROFILE_ID_HEADER = "X-Profile-ID"
+
+SPEEDSCOPE_SCHEMA = "https://www.speedscope.app/file-format-schema.json"
+
+_SITE_MARKERS = ("site-packages" + os.sep, "dist-packages" + os.sep)
+
+
+def _short_path(filename: str) -> str:
+    # Project files relative to BASE_DIR, libraries relative to site-packages
+    for marker in _SITE_MARKERS:
+        index = filename.find(marker)
+        if index >= 0:
+            return filename[index + len(marker):]
+    base = str(settings.BASE_DIR) + os.sep
+    return filename[len(base):] if filename.startswith(base) else filename
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """
+    Wall-clock sampling profiler for the threads serving one request.
+
+    A background thread snapshots the stacks of the attached threads every `interval`
+    seconds via sys._current_frames() and counts identical stacks, so the profiled code
+    runs unmodified. Threads are attached for as long as they work on the request (the
+    request thread, plus retrieval pool threads through metrics.bind_context). Results
+    are kept as collapsed stacks ("root;...;leaf count"), the flamegraph.pl input format.
+    """
+
+    def __init__(self, interval: float = 0.005, max_samples: int = 20000):
+        self.interval = interval
+        self.max_samples = max_samples
+        self.stacks = Counter()
+        self.samples = 0
+        self.started_at = None
+        self.duration = 0.0
+        self._threads = {}  # thread ident -> thread name
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = None
+
+    @contextmanager
+    def attached(self):
+        """
+        Sample the current thread while the block runs.
+        """
+        ident = threading.get_ident()
+        with self._lock:
+            already = ident in self._threads
+            self._threads[ident] = threading.current_thread().name
+        try:
+            yield
+        finally:
+            if not already:
+                with self._lock:
+                    self._threads.pop(ident, None)
+
+    def _sample(self) -> None:
+        sampler_ident = threading.get_ident()
+        while not self._stop.wait(self.interval) and self.samples < self.max_samples:
+            with self._lock:
+                threads = dict(self._threads)
+            frames = sys._current_frames()
+            for ident, name in threads.items():
+                frame = frames.get(ident)
+                if frame is None or ident == sampler_ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.append(name)
+                self.stacks[";".join(reversed(stack))] += 1
+                self.samples += 1
+
+    def start(self) -> "SamplingProfiler":
+        self.started_at = time.perf_counter()
+        self._sampler = threading.Thread(target=self._sample, name="request-profiler", daemon=True)
+        self._sampler.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        self.duration = time.perf_counter() - self.started_at
+
+    def collapsed(self) -> str:
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common())
+
+
+def speedscope_profile(collapsed: str, interval_ms: float, name: str) -> dict:
+    """
+    Convert collapsed stacks into a speedscope "sampled" profile (weights in ms).
+    """
+    frames, frame_index, samples, weights = [], {}, [], []
+    for line in collapsed.splitlines():
+        stack, _, count = line.rpartition(" ")
+        if not stack:
+            continue
+        sample = []
+        for label in stack.split(";"):
+            if label not in frame_index:
+                frame_index[label] = len(frames)
+                frames.append({"name": label})
+            sample.append(frame_index[label])
+        samples.append(sample)
+        weights.append(int(count) * interval_ms)
+
+    total = sum(weights)
+    return {
+        "$schema": SPEEDSCOPE_SCHEMA,
+        "name": name,
+        "exporter": "mdchatbot",
+        "activeProfileIndex": 0,
+        "shared": {"frames": frames},
+        "profiles": [{
+            "type": "sampled",
+            "name": name,
+            "unit": "milliseconds",
+            "startValue": 0,
+            "endValue": total,
+            "samples": samples,
+            "weights": weights,
+        }],
+    }
+
+
+def should_profile(request) -> bool:
+    """
+    Profiling is only honoured for staff users who ask for it with the
+    X-Profile header or the ?profile=1 query flag.
+    """
+    if not settings.REQUEST_PROFILING_ENABLED:
+        return False
+    flag = request.headers.get("X-Profile") or request.query_params.get("profile")
+    if flag not in ("1", "true", "yes"):
+        return False
+    user = getattr(request, "user", None)
+    return bool(user and user.is_authenticated and user.is_staff)
+
+
+@contextmanager
+def profile_request(trace: Optional[dict]):
+    """
+    Run the block under a SamplingProfiler and collect its SQL queries into the request
+    trace (see chat.utils.metrics). Yields the profiler.
+    """
+    profiler = SamplingProfiler(interval=settings.REQUEST_PROFILING_INTERVAL_MS / 1000.0)
+    if trace is not None:
+        trace["profiler"] = profiler
+        trace["sql"] = []
+    profiler.start()
+    try:
+        with profiler.attached():
+            yield profiler
+    finally:
+        profiler.stop()
+        if trace is not None:
+            trace.pop("profiler", None)
+
+
+def capture(request, handler, client_user_id=None):
+    """
+    Run handler(request) under the profiler and store a RequestProfile linked to the
+    conversation turn it saved. The capture's ID is returned in the X-Profile-ID header;
+    a failure to store it never fails the request.
+    """
+    from chat.models import ConversationHistory, RequestProfile
+    from chat.utils.turn_writer import turn_writer
+
+    trace = metrics.current_trace()
+    started_at = timezone.now()
+    response = None
+    try:
+        with profile_request(trace) as profiler:
+            response = handler(request)
+    finally:
+        queries = trace.pop("sql", []) if trace is not None else []
+        try:
+            turn = None
+            if client_user_id is not None:
+                turn_writer.flush()  # the turn may still be in the write-behind queue
+                turn = ConversationHistory.objects.filter(
+                    conversation__client_user__user_id=client_user_id, request_at__gte=started_at
+                ).order_by("-request_at").first()
+            saved = RequestProfile.objects.create(
+                request_id=(trace or {}).get("id") or getattr(request, "request_id", ""),
+                requested_by=request.user,
+                client_user_id=client_user_id,
+                conversation_history=turn,
+                path=request.path,
+                status_code=response.status_code if response is not None else 500,
+                duration_ms=round(profiler.duration * 1000, 3),
+                sample_interval_ms=settings.REQUEST_PROFILING_INTERVAL_MS,
+                sample_count=profiler.samples,
+                collapsed_stacks=profiler.collapsed(),
+                sql_queries=queries,
+            )
+            if response is not None:
+                response[PROFILE_ID_HEADER] = str(saved.pk)
+            logger.info(f"Stored request profile {saved.pk}: {profiler.samples} samples, {len(queries)} queries")
+        except Exception as e:
+            logger.error(f"Failed to store request profile: {e}")
+    return response
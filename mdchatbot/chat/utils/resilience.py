@@ -0,0 +1,435 @@
+import time
+import random
+import asyncio
+import logging
+import threading
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Awaitable, Callable, Iterable, Iterator, Optional
+
+import httpx
+from django.conf import settings
+
+from chat.utils.llm_gateway import LLMQueueTimeout
+from chat.utils.metrics import bind_context
+
+logger = logging.getLogger(__name__)
+
+# HTTP statuses worth retrying: timeouts, rate limiting and transient server errors
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+class CallTimeout(Exception):
+    """
+    Raised when an upstream call did not finish within its per-call timeout.
+    """
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of calling upstream while the circuit breaker is open.
+    """
+
+
+def status_code(exc: BaseException) -> Optional[int]:
+    """
+    HTTP status of a google-genai APIError or google.api_core GoogleAPICallError, if any.
+    """
+    code = getattr(exc, "code", None)
+    return code if isinstance(code, int) else None
+
+
+def is_retryable(exc: BaseException) -> bool:
+    if isinstance(exc, (CallTimeout, TimeoutError, ConnectionError, httpx.TransportError)):
+        return True
+    return status_code(exc) in RETRYABLE_STATUS_CODES
+
+
+def is_upstream_failure(exc: BaseException) -> bool:
+    """
+    True for errors meaning Gemini is unavailable (as opposed to a bad request).
+    """
+    return isinstance(exc, CircuitOpenError) or is_retryable(exc)
+
+
+class LatencyTracker:
+    """
+    Sliding window of recent call latencies (seconds) for percentile estimates.
+    """
+
+    def __init__(self, window: int = 200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, pct: float, min_samples: int = 1) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples or len(samples) < min_samples:
+            return None
+        index = min(len(samples) - 1, int(round(pct / 100.0 * (len(samples) - 1))))
+        return samples[index]
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+
+    Closed: calls pass. After `failure_threshold` consecutive upstream failures the
+    breaker opens and calls are rejected for `reset_timeout` seconds. It then goes
+    half-open and lets a single probe call through: success closes it, failure
+    re-opens it.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._stats = Counter()
+
+    def _current_state(self) -> str:
+        # Caller holds the lock
+        if self._state == self.OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+            self._state = self.HALF_OPEN
+            self._probe_in_flight = False
+        return self._state
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    @property
+    def is_open(self) -> bool:
+        return self.state == self.OPEN
+
+    def allow(self) -> bool:
+        """
+        Whether a call may go upstream now (claims the probe slot when half-open).
+        """
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            self._stats["rejected"] += 1
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.info("Gemini circuit closed")
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._stats["failures"] += 1
+            state = self._current_state()
+            if state == self.HALF_OPEN or (state == self.CLOSED and self._failures >= self.failure_threshold):
+                logger.warning(f"Gemini circuit opened after {self._failures} consecutive failures")
+                self._state = self.OPEN
+                self._opened_at = self._clock()
+                self._stats["opened"] += 1
+            self._probe_in_flight = False
+
+    def release(self) -> None:
+        """
+        Give back a probe slot without an outcome (the call never reached upstream).
+        """
+        with self._lock:
+            self._probe_in_flight = False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"state": self._current_state(), "consecutive_failures": self._failures, **self._stats}
+
+
+class ResilientCaller:
+    """
+    Per-call timeout, jittered exponential retry (retryable errors only), optional hedging
+    and circuit breaking around one kind of upstream call.
+
+    `attempt(hedged)` makes a single upstream call; `hedged` is True for the duplicate
+    request sent when the first one is slower than the `hedge_percentile` latency
+    (0 disables hedging). Use hedge=False for calls that must not be duplicated. A timed
+    out attempt keeps running in the background, so such calls also pass
+    retry_timeouts=False: errors returned by upstream are still retried, timeouts are not.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        breaker: CircuitBreaker,
+        timeout: float,
+        max_attempts: int = 3,
+        backoff_base: float = 0.5,
+        backoff_max: float = 4.0,
+        hedge_percentile: float = 0.0,
+        hedge_min_samples: int = 50,
+        executor: Optional[ThreadPoolExecutor] = None,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.name = name
+        self.breaker = breaker
+        self.timeout = timeout
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.executor = executor or ThreadPoolExecutor(max_workers=8, thread_name_prefix=f"llm-{name}")
+        self.sleep = sleep
+        self.latency = LatencyTracker()
+        self._lock = threading.Lock()
+        self._stats = Counter()
+
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self._stats[key] += 1
+
+    def backoff(self, attempt: int) -> float:
+        """
+        Full-jitter delay before retry number `attempt` (1-based).
+        """
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+
+    def hedge_delay(self) -> Optional[float]:
+        if self.hedge_percentile <= 0:
+            return None
+        delay = self.latency.percentile(self.hedge_percentile, self.hedge_min_samples)
+        return delay if delay is not None and delay < self.timeout else None
+
+    def _timed(self, attempt: Callable[[bool], Any], hedged: bool) -> Any:
+        started = time.monotonic()
+        result = attempt(hedged)
+        self.latency.record(time.monotonic() - started)
+        return result
+
+    def _record_outcome(self, exc: BaseException) -> bool:
+        """
+        Update the breaker for a failed attempt; returns whether to retry.
+        """
+        if isinstance(exc, LLMQueueTimeout):
+            self.breaker.release()  # never reached upstream
+            return False
+        if is_retryable(exc):
+            self.breaker.record_failure()
+            return True
+        self.breaker.record_success()  # upstream answered; the request itself was bad
+        return False
+
+    # -- sync -------------------------------------------------------------
+
+    def _run_once(self, attempt: Callable[[bool], Any], hedge: bool) -> Any:
+        deadline = time.monotonic() + self.timeout
+        primary = self.executor.submit(bind_context(self._timed, attempt, False))
+        pending = [primary]
+
+        delay = self.hedge_delay() if hedge else None
+        if delay is not None:
+            done, _ = wait(pending, timeout=delay)
+            if not done:
+                self._count("hedges")
+                pending.append(self.executor.submit(bind_context(self._timed, attempt, True)))
+
+        error = None
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            done, _ = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                pending.remove(future)
+                if future.exception() is None:
+                    if future is not primary:
+                        self._count("hedge_wins")
+                    return future.result()
+                error = error or future.exception()
+
+        if not pending and error is not None:
+            raise error
+        for future in pending:
+            future.cancel()  # only stops attempts that have not started yet
+        self._count("timeouts")
+        raise CallTimeout(f"{self.name} call exceeded {self.timeout}s")
+
+    def _should_retry(self, exc: BaseException, attempt_number: int, retry_timeouts: bool) -> bool:
+        retry = self._record_outcome(exc)
+        if isinstance(exc, CallTimeout) and not retry_timeouts:
+            return False
+        return retry and attempt_number < self.max_attempts
+
+    def call(self, attempt: Callable[[bool], Any], hedge: bool = True, retry_timeouts: bool = True) -> Any:
+        for n in range(1, self.max_attempts + 1):
+            if not self.breaker.allow():
+                self._count("short_circuited")
+                raise CircuitOpenError(f"{self.name}: Gemini circuit is open")
+            try:
+                result = self._run_once(attempt, hedge)
+            except Exception as e:
+                if not self._should_retry(e, n, retry_timeouts):
+                    raise
+                delay = self.backoff(n)
+                self._count("retries")
+                logger.warning(f"{self.name} attempt {n} failed ({e!r}); retrying in {delay:.2f}s")
+                self.sleep(delay)
+            else:
+                self.breaker.record_success()
+                return result
+
+    def stream(self, open_stream: Callable[[], Iterable]) -> Iterator:
+        """
+        Breaker accounting for a streaming call. Partial output cannot be retried or
+        hedged, so the stream is opened once; timeouts come from the HTTP client.
+        """
+        if not self.breaker.allow():
+            self._count("short_circuited")
+            raise CircuitOpenError(f"{self.name}: Gemini circuit is open")
+        finished = False
+        try:
+            yield from open_stream()
+            finished = True
+            self.breaker.record_success()
+        except Exception as e:
+            finished = True
+            self._record_outcome(e)
+            raise
+        finally:
+            if not finished:
+                self.breaker.release()  # consumer stopped early
+
+    # -- async ------------------------------------------------------------
+
+    async def _atimed(self, attempt: Callable[[bool], Awaitable], hedged: bool) -> Any:
+        started = time.monotonic()
+        result = await attempt(hedged)
+        self.latency.record(time.monotonic() - started)
+        return result
+
+    async def _arun_once(self, attempt: Callable[[bool], Awaitable], hedge: bool) -> Any:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        primary = asyncio.ensure_future(self._atimed(attempt, False))
+        pending = {primary}
+
+        delay = self.hedge_delay() if hedge else None
+        if delay is not None:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if not done:
+                self._count("hedges")
+                pending.add(asyncio.ensure_future(self._atimed(attempt, True)))
+
+        error = None
+        while pending:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                break
+            for task in done:
+                if task.exception() is None:
+                    if task is not primary:
+                        self._count("hedge_wins")
+                    _detach(pending)
+                    return task.result()
+                error = error or task.exception()
+
+        if not pending and error is not None:
+            raise error
+        _detach(pending)
+        self._count("timeouts")
+        raise CallTimeout(f"{self.name} call exceeded {self.timeout}s")
+
+    async def acall(self, attempt: Callable[[bool], Awaitable], hedge: bool = True,
+                    retry_timeouts: bool = True) -> Any:
+        """
+        Async version of call(); `attempt(hedged)` returns an awaitable.
+        """
+        for n in range(1, self.max_attempts + 1):
+            if not self.breaker.allow():
+                self._count("short_circuited")
+                raise CircuitOpenError(f"{self.name}: Gemini circuit is open")
+            try:
+                result = await self._arun_once(attempt, hedge)
+            except Exception as e:
+                if not self._should_retry(e, n, retry_timeouts):
+                    raise
+                delay = self.backoff(n)
+                self._count("retries")
+                logger.warning(f"{self.name} attempt {n} failed ({e!r}); retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+            else:
+                self.breaker.record_success()
+                return result
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        p50 = self.latency.percentile(50)
+        p95 = self.latency.percentile(95)
+        stats["latency_p50"] = round(p50, 4) if p50 is not None else None
+        stats["latency_p95"] = round(p95, 4) if p95 is not None else None
+        return stats
+
+
+def _detach(tasks) -> None:
+    """
+    Let losing or timed-out attempts finish in the background (cancelling them would
+    also cancel coalesced waiters in the gateway), without "exception never retrieved"
+    warnings.
+    """
+    for task in tasks:
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+
+# Shared by every Gemini call in the process (one upstream)
+gemini_breaker = CircuitBreaker(
+    failure_threshold=settings.GEMINI_CIRCUIT_FAILURES,
+    reset_timeout=settings.GEMINI_CIRCUIT_RESET_TIMEOUT,
+)
+
+_call_executor = ThreadPoolExecutor(max_workers=settings.GEMINI_CALL_WORKERS, thread_name_prefix="llm-call")
+
+rewrite_caller = ResilientCaller(
+    "rewrite",
+    gemini_breaker,
+    timeout=settings.GEMINI_REWRITE_TIMEOUT,
+    max_attempts=settings.GEMINI_MAX_ATTEMPTS,
+    backoff_base=settings.GEMINI_BACKOFF_BASE,
+    backoff_max=settings.GEMINI_BACKOFF_MAX,
+    hedge_percentile=settings.GEMINI_HEDGE_PERCENTILE,
+    hedge_min_samples=settings.GEMINI_HEDGE_MIN_SAMPLES,
+    executor=_call_executor,
+)
+
+generation_caller = ResilientCaller(
+    "generation",
+    gemini_breaker,
+    timeout=settings.GEMINI_TIMEOUT,
+    max_attempts=settings.GEMINI_MAX_ATTEMPTS,
+    backoff_base=settings.GEMINI_BACKOFF_BASE,
+    backoff_max=settings.GEMINI_BACKOFF_MAX,
+    hedge_percentile=settings.GEMINI_HEDGE_PERCENTILE,
+    hedge_min_samples=settings.GEMINI_HEDGE_MIN_SAMPLES,
+    executor=_call_executor,
+)
@@ -0,0 +1,109 @@
+import time
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from django.conf import settings
+
+
+def normalize_query(query: str) -> str:
+    """
+    Case-fold and collapse whitespace so trivially different spellings share an entry.
+    """
+    return " ".join(query.casefold().split())
+
+
+class RetrievalCache:
+    """
+    Bounded LRU/TTL cache in front of the retrieval layer.
+
+    Entries are keyed by (corpus version, normalized query) and hold the query embedding
+    plus the final ranked (chunk_id, score) lists per requested k. Binding a new corpus
+    version (i.e. after an index rebuild) drops every entry.
+    """
+
+    def __init__(self, max_entries: int = 2048, ttl: float = 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.version = None
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[tuple, dict]" = OrderedDict()
+        self._counters = {
+            "vector_hits": 0,
+            "vector_misses": 0,
+            "result_hits": 0,
+            "result_misses": 0,
+            "evictions": 0,
+            "invalidations": 0,
+        }
+
+    def bind_version(self, version: str) -> None:
+        """
+        Attach the cache to a corpus version, invalidating it if the version changed.
+        """
+        with self._lock:
+            if version != self.version:
+                if self._entries:
+                    self._counters["invalidations"] += 1
+                self._entries.clear()
+                self.version = version
+
+    def _entry(self, query: str, create: bool = False) -> Optional[dict]:
+        # Caller holds the lock
+        key = (self.version, normalize_query(query))
+        entry = self._entries.get(key)
+        now = time.monotonic()
+
+        if entry is not None and now - entry["created"] > self.ttl:
+            del self._entries[key]
+            entry = None
+
+        if entry is None and create:
+            entry = {"created": now, "vector": None, "results": {}}
+            if self.max_entries <= 0:
+                return entry  # caching disabled: hand back a throwaway entry
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counters["evictions"] += 1
+
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def get_vector(self, query: str) -> Optional[List[float]]:
+        with self._lock:
+            entry = self._entry(query)
+            vector = entry["vector"] if entry else None
+            self._counters["vector_hits" if vector is not None else "vector_misses"] += 1
+            return vector
+
+    def put_vector(self, query: str, vector: List[float]) -> None:
+        with self._lock:
+            self._entry(query, create=True)["vector"] = vector
+
+    def get_results(self, query: str, k: int) -> Optional[List[Tuple[str, float]]]:
+        with self._lock:
+            entry = self._entry(query)
+            results = entry["results"].get(k) if entry else None
+            self._counters["result_hits" if results is not None else "result_misses"] += 1
+            return results
+
+    def put_results(self, query: str, k: int, results: List[Tuple[str, float]]) -> None:
+        with self._lock:
+            self._entry(query, create=True)["results"][k] = list(results)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"version": self.version, "size": len(self._entries), **self._counters}
+
+
+# Process-wide cache shared by all retriever instances
+retrieval_cache = RetrievalCache(
+    max_entries=settings.RETRIEVAL_CACHE_SIZE,
+    ttl=settings.RETRIEVAL_CACHE_TTL,
+)
@@ -0,0 +1,108 @@
+import re
+import math
+import threading
+from collections import Counter
+from typing import Callable, List, Optional, Tuple
+
+from django.conf import settings
+from langchain.schema import HumanMessage
+
+from chat.utils.bm25 import tokenize
+
+# Pronouns, deictics and ordinals that usually point back into the conversation
+FOLLOW_UP_MARKERS = {
+    # English
+    "it", "its", "this", "that", "these", "those", "they", "them", "their", "theirs",
+    "he", "him", "his", "she", "her", "there", "one", "ones", "former", "latter",
+    "above", "previous", "same", "again", "else", "another", "other", "next",
+    "second", "third", "fourth", "fifth", "too",
+    # Hindi (Devanagari)
+    "यह", "वह", "ये", "वे", "इसे", "उसे", "इसका", "उसका", "इसकी", "उसकी", "इसके", "उसके",
+    "इसको", "उसको", "इसमें", "उसमें", "इससे", "उससे", "इन्हें", "उन्हें", "इनका", "उनका",
+    "वहां", "वहाँ", "यहां", "यहाँ", "वही", "यही", "फिर", "दूसरा", "दूसरी", "तीसरा", "तीसरी",
+    "अगला", "अगली", "पिछला", "पिछली",
+    # Hindi (romanized)
+    "yeh", "ye", "woh", "wo", "iska", "uska", "iski", "uski", "iske", "uske", "isko", "usko",
+    "isme", "usme", "isse", "usse", "inka", "unka", "wahan", "yahan", "wahi", "yahi", "phir",
+    "dusra", "dusri", "teesra", "teesri", "agla", "agli",
+    # Marathi (Devanagari)
+    "हे", "ते", "ती", "त्या", "ह्या", "याचे", "त्याचे", "याची", "त्याची", "याचा", "त्याचा",
+    "यात", "त्यात", "यामध्ये", "त्यामध्ये", "तिथे", "इथे", "तेच", "हेच", "पुढचा", "पुढची",
+    "पुढील", "तिसरा", "तिसरी", "मग", "आणखी",
+    # Marathi (romanized)
+    "tyacha", "tyachi", "tyache", "yacha", "yachi", "yache", "tyat", "tithe", "ithe", "mag", "ankhi",
+}
+
+# Conjunctions that signal an elliptical continuation when they open the message
+LEADING_CONJUNCTIONS = {"and", "also", "but", "so", "then", "or", "और", "तो", "आणि", "पण", "aur", "ani"}
+
+FOLLOW_UP_PHRASES = re.compile(r"\b(what|how)\s+about\b|\bsame\s+for\b|\bas\s+well\b", re.IGNORECASE)
+
+_stats_lock = threading.Lock()
+_stats = Counter()
+
+
+def cosine_similarity(a: List[float], b: List[float]) -> float:
+    """
+    Cosine similarity of two embedding vectors (0.0 if either is all zeros).
+    """
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+def needs_rewrite(
+    user_input: str,
+    history_msgs: list,
+    embed: Optional[Callable[[str], List[float]]] = None,
+) -> Tuple[bool, str]:
+    """
+    Cheap local check for whether a message depends on the conversation history.
+    Returns (needs_rewrite, reason). Only clear standalone questions are let through;
+    anything ambiguous still goes to the Gemini rewrite.
+    """
+    if not history_msgs:
+        return False, "no_history"
+
+    tokens = tokenize(user_input)
+    if not tokens:
+        return False, "empty"
+
+    if tokens[0] in LEADING_CONJUNCTIONS:
+        return True, "leading_conjunction"
+    if FOLLOW_UP_PHRASES.search(user_input):
+        return True, "follow_up_phrase"
+    if any(token in FOLLOW_UP_MARKERS for token in tokens):
+        return True, "anaphora"
+
+    if len(tokens) <= settings.REWRITE_GATE_SHORT_TOKENS:
+        # Very short messages are often ellipses ("FAT settings?") of the previous turn,
+        # unless they are clearly about something else than the last question.
+        last_user = next((m.content for m in reversed(history_msgs) if isinstance(m, HumanMessage)), None)
+        if embed is not None and last_user:
+            try:
+                if cosine_similarity(embed(user_input), embed(last_user)) < settings.REWRITE_GATE_TOPIC_SIMILARITY:
+                    return False, "topic_change"
+            except Exception:
+                pass
+        return True, "ellipsis"
+
+    return False, "standalone"
+
+
+def record(rewritten: bool, reason: str) -> None:
+    """
+    Count a gate decision (whether the Gemini rewrite ran, and why).
+    """
+    with _stats_lock:
+        _stats["rewritten" if rewritten else "skipped"] += 1
+        _stats[f"reason:{reason}"] += 1
+
+
+def get_stats() -> dict:
+    with _stats_lock:
+        return {
+            "rewritten": _stats["rewritten"],
+            "skipped": _stats["skipped"],
+            "reasons": {k.split(":", 1)[1]: v for k, v in _stats.items() if k.startswith("reason:")},
+        }
@@ -0,0 +1,270 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+from django.conf import settings
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+class _Shard:
+    __slots__ = ("lock", "entries")
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        # key -> [last access (monotonic), session]; kept in access order, and since every
+        # session has the same idle timeout, access order is also expiry order
+        self.entries: "OrderedDict[str, list]" = OrderedDict()
+
+
+class SessionStore:
+    """
+    In-process store of per-user chat sessions, split into `shards` independently
+    locked shards (a user's shard is picked by hashing the client_user_id).
+
+    Each shard keeps its sessions in least-recently-used order, so a touch is O(1) and
+    expired sessions are always at the front: a background reaper drops sessions idle
+    for more than `idle_timeout` seconds every `reap_interval` seconds, and a shard over
+    its share of `max_sessions` evicts its least recently used session on insert.
+    """
+
+    def __init__(self, factory: Callable[[], Dict[str, Any]], shards: int = 16, max_sessions: int = 10000,
+                 idle_timeout: float = 7200, reap_interval: float = 60):
+        self.factory = factory
+        self.idle_timeout = idle_timeout
+        self.reap_interval = reap_interval
+        self._shards = [_Shard() for _ in range(max(shards, 1))]
+        self._shard_cap = -(-max(max_sessions, 1) // len(self._shards)) if max_sessions > 0 else 0
+        self._stats_lock = threading.Lock()
+        self._evictions = {"idle": 0, "capacity": 0}
+        self._reaper = None
+        self._reaper_pid = None
+
+    def _shard(self, key) -> _Shard:
+        return self._shards[hash(str(key)) % len(self._shards)]
+
+    def _count(self, reason: str, amount: int = 1) -> None:
+        if amount:
+            with self._stats_lock:
+                self._evictions[reason] += amount
+
+    def lock_for(self, key) -> threading.RLock:
+        """
+        Lock of the shard holding `key`, for mutating a session in place.
+        """
+        return self._shard(key).lock
+
+    def touch(self, key) -> Dict[str, Any]:
+        """
+        Return the session for `key` (created if missing) and mark it active.
+        """
+        self._ensure_reaper()
+        key = str(key)
+        shard = self._shard(key)
+        with shard.lock:
+            entry = shard.entries.get(key)
+            if entry is None:
+                entry = shard.entries[key] = [0.0, self.factory()]
+                evicted = 0
+                while self._shard_cap and len(shard.entries) > self._shard_cap:
+                    shard.entries.popitem(last=False)
+                    evicted += 1
+                self._count("capacity", evicted)
+            else:
+                shard.entries.move_to_end(key)
+            entry[0] = time.monotonic()
+            entry[1]["last_activity"] = datetime.now()
+            return entry[1]
+
+    def get(self, key) -> Optional[Dict[str, Any]]:
+        key = str(key)
+        shard = self._shard(key)
+        with shard.lock:
+            entry = shard.entries.get(key)
+            return entry[1] if entry else None
+
+    def __getitem__(self, key) -> Dict[str, Any]:
+        return self.touch(key)
+
+    def __contains__(self, key) -> bool:
+        return self.get(key) is not None
+
+    def __len__(self) -> int:
+        return sum(len(shard.entries) for shard in self._shards)
+
+    def pop(self, key, default=None):
+        key = str(key)
+        shard = self._shard(key)
+        with shard.lock:
+            entry = shard.entries.pop(key, None)
+            return entry[1] if entry else default
+
+    def items(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        for shard in self._shards:
+            with shard.lock:
+                snapshot = [(key, entry[1]) for key, entry in shard.entries.items()]
+            yield from snapshot
+
+    def purge_expired(self) -> int:
+        """
+        Drop sessions idle for longer than idle_timeout; returns how many were dropped.
+        """
+        cutoff = time.monotonic() - self.idle_timeout
+        purged = 0
+        for shard in self._shards:
+            with shard.lock:
+                while shard.entries:
+                    key, entry = next(iter(shard.entries.items()))
+                    if entry[0] >= cutoff:
+                        break
+                    del shard.entries[key]
+                    purged += 1
+        self._count("idle", purged)
+        return purged
+
+    def _ensure_reaper(self) -> None:
+        # Started lazily, and again in a forked worker (threads do not survive fork)
+        if self._reaper_pid == os.getpid() or self.reap_interval <= 0:
+            return
+        with self._stats_lock:
+            if self._reaper_pid == os.getpid():
+                return
+            self._reaper_pid = os.getpid()
+            self._reaper = threading.Thread(target=self._reap, name="session-reaper", daemon=True)
+            self._reaper.start()
+
+    def _reap(self) -> None:
+        while True:
+            time.sleep(self.reap_interval)
+            try:
+                purged = self.purge_expired()
+                if purged:
+                    logger.info(f"Purged {purged} idle chat sessions")
+            except Exception as e:
+                logger.error(f"Session reaper failed: {e}")
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            evictions = dict(self._evictions)
+        return {"sessions": len(self), "shards": len(self._shards), "evictions": evictions}
+
+
+# -- shared session state ----------------------------------------------------
+
+# Session keys shared across workers; everything else (memory, Gemini chats, cached
+# system text) is process-local and rebuilt lazily
+SHARED_KEYS = ("session_id", "language", "profile")
+
+SESSION_BACKEND_MEMORY = "memory"
+SESSION_BACKEND_DATABASE = "database"
+
+
+def shared_state(sess: Dict[str, Any]) -> Dict[str, Any]:
+    return {key: sess.get(key) for key in SHARED_KEYS}
+
+
+class MemorySessionBackend:
+    """
+    Process-local backend: sessions live only in this process's SessionStore.
+    Suitable for a single worker and for tests.
+    """
+
+    def claim(self, client_user_id: str, state: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Return the live shared state for the user, storing `state` if there is none.
+        """
+        return state
+
+    def save(self, client_user_id: str, state: Dict[str, Any]) -> None:
+        pass
+
+    async def aclaim(self, client_user_id: str, state: Dict[str, Any]) -> Dict[str, Any]:
+        return state
+
+    async def asave(self, client_user_id: str, state: Dict[str, Any]) -> None:
+        pass
+
+
+class DatabaseSessionBackend(MemorySessionBackend):
+    """
+    Shares the serializable session state through the ChatSessionState table, so every
+    worker (and a restarted process) continues the same conversation. State idle for
+    longer than `idle_timeout` seconds is replaced, like a purged in-memory session.
+    """
+
+    def __init__(self, idle_timeout: float = 7200):
+        self.idle_timeout = idle_timeout
+
+    def _fresh(self, row) -> bool:
+        return (timezone.now() - row.updated).total_seconds() <= self.idle_timeout
+
+    def claim(self, client_user_id: str, state: Dict[str, Any]) -> Dict[str, Any]:
+        from chat.models import ChatSessionState
+
+        row, created = ChatSessionState.objects.get_or_create(
+            client_user_id=str(client_user_id), defaults={"state": state}
+        )
+        if created:
+            return state
+        if self._fresh(row):
+            return row.state
+        self.save(client_user_id, state)
+        return state
+
+    def save(self, client_user_id: str, state: Dict[str, Any]) -> None:
+        from chat.models import ChatSessionState
+
+        ChatSessionState.objects.update_or_create(client_user_id=str(client_user_id), defaults={"state": state})
+
+    async def aclaim(self, client_user_id: str, state: Dict[str, Any]) -> Dict[str, Any]:
+        from chat.models import ChatSessionState
+
+        row, created = await ChatSessionState.objects.aget_or_create(
+            client_user_id=str(client_user_id), defaults={"state": state}
+        )
+        if created:
+            return state
+        if self._fresh(row):
+            return row.state
+        await self.asave(client_user_id, state)
+        return state
+
+    async def asave(self, client_user_id: str, state: Dict[str, Any]) -> None:
+        from chat.models import ChatSessionState
+
+        await ChatSessionState.objects.aupdate_or_create(
+            client_user_id=str(client_user_id), defaults={"state": state}
+        )
+
+
+def get_session_backend():
+    if settings.SESSION_BACKEND == SESSION_BACKEND_DATABASE:
+        return DatabaseSessionBackend(idle_timeout=settings.SESSION_IDLE_TIMEOUT)
+    return MemorySessionBackend()
+
+
+def new_session() -> Dict[str, Any]:
+    return {
+        "chat": None,
+        "aio_chat": None,
+        "language": "en",
+        "profile": {"name": None, "greeted": False},
+        "last_activity": datetime.now(),
+        "session_id": None,
+        "memory": None
+    }
+
+
+user_sessions = SessionStore(
+    new_session,
+    shards=settings.SESSION_SHARDS,
+    max_sessions=settings.SESSION_MAX_ENTRIES,
+    idle_timeout=settings.SESSION_IDLE_TIMEOUT,
+    reap_interval=settings.SESSION_REAP_INTERVAL,
+)
+session_backend = get_session_backend()
@@ -0,0 +1,80 @@
+import re
+import json
+from typing import List, Tuple
+
+RESPONSE_TYPE_PATTERN = re.compile(r'"responseType"\s*:\s*"([^"\\]*)"')
+ANSWER_START_PATTERN = re.compile(r'"answer"\s*:\s*"')
+
+
+def sse_event(event: str, data) -> str:
+    """
+    Format one Server-Sent Events message with a JSON payload.
+    """
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _string_prefix(raw: str) -> Tuple[str, bool]:
+    """
+    Given the raw characters after an opening JSON quote, return the longest prefix that
+    can be decoded on its own and whether the closing quote was reached.
+    """
+    i = 0
+    while i < len(raw):
+        ch = raw[i]
+        if ch == '"':
+            return raw[:i], True
+        if ch == "\\":
+            # Escapes are only safe to cut after they are complete
+            width = 6 if raw[i + 1:i + 2] == "u" else 2
+            if i + width > len(raw):
+                return raw[:i], False
+            i += width
+            continue
+        i += 1
+    return raw, False
+
+
+class PartialAnswerParser:
+    """
+    Incremental parser for a Gemini reply that is still streaming.
+
+    Emits ("meta", {"responseType": ...}) as soon as the response type is known and
+    ("delta", {"answer": fragment}) for newly received text of a "basic" answer.
+    Procedure responses are only delivered with the final event.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.response_type = None
+        self.emitted = 0
+        self.done = False
+
+    def feed(self, text: str) -> List[Tuple[str, dict]]:
+        self.buffer += text
+        events = []
+
+        if self.response_type is None:
+            match = RESPONSE_TYPE_PATTERN.search(self.buffer)
+            if match:
+                self.response_type = match.group(1)
+                events.append(("meta", {"responseType": self.response_type}))
+
+        if self.done or self.response_type not in (None, "basic"):
+            return events
+
+        match = ANSWER_START_PATTERN.search(self.buffer)
+        if not match:
+            return events
+
+        raw, self.done = _string_prefix(self.buffer[match.end():])
+        try:
+            answer = json.loads(f'"{raw}"', strict=False)  # tolerate raw newlines
+        except json.JSONDecodeError:
+            return events
+        if answer and "\ud800" <= answer[-1] <= "\udbff":
+            answer = answer[:-1]  # first half of an escaped surrogate pair; wait for the rest
+
+        if len(answer) > self.emitted:
+            events.append(("delta", {"answer": answer[self.emitted:]}))
+            self.emitted = len(answer)
+        return events
@@ -0,0 +1,194 @@
+import os
+import time
+import queue
+import atexit
+import logging
+import threading
+from collections import Counter
+from datetime import datetime
+from typing import Callable, Optional
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, connection, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+PERSISTENCE_SYNC = "sync"
+PERSISTENCE_WRITE_BEHIND = "write_behind"
+
+
+class TurnWriter:
+    """
+    Write-behind persistence for conversation turns.
+
+    Each turn (user text + assistant text) is queued as one ConversationHistory row and
+    a background thread inserts queued rows with bulk_create, one transaction per batch
+    of up to `batch_size` rows, waiting at most `flush_interval` seconds to fill a batch.
+    The queue holds at most `max_queue` turns; when it is full, submit() returns False and
+    the caller writes the turn itself. Pending turns are flushed at interpreter exit.
+    Turns still queued are lost if the process is killed, hence CHAT_PERSISTENCE_MODE
+    ("sync" writes on the request path).
+    """
+
+    def __init__(self, max_queue: int = 1000, batch_size: int = 50, flush_interval: float = 0.5):
+        self.batch_size = max(batch_size, 1)
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max(max_queue, 1))
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stop = threading.Event()
+        self._stats = Counter()
+
+    def _count(self, key: str, amount: int = 1) -> None:
+        with self._lock:
+            self._stats[key] += amount
+
+    def _ensure_started(self) -> None:
+        # Started lazily, and again in a forked worker (threads do not survive fork)
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=self._queue.maxsize)
+            self._stop = threading.Event()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="turn-writer", daemon=True)
+            self._thread.start()
+
+    def submit(self, session_id: str, user_text: str, assistant_text: str, request_at: datetime,
+               on_written: Optional[Callable[[], None]] = None) -> bool:
+        """
+        Queue one turn; returns False (nothing queued) if the queue is full. The row keeps
+        `request_at` (when the user asked) and is answered now, not when it is flushed.
+        `on_written` is called from the writer thread once the row is committed or dropped.
+        """
+        self._ensure_started()
+        turn = (session_id, user_text, assistant_text, request_at, timezone.now(), on_written)
+        try:
+            self._queue.put_nowait(turn)
+        except queue.Full:
+            self._count("queue_full")
+            return False
+        self._count("queued")
+        return True
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """
+        Block until every turn queued before this call has been written.
+        """
+        if self._thread is None or self._pid != os.getpid():
+            return True
+        done = threading.Event()
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def close(self, timeout: float = 10.0) -> None:
+        """
+        Flush pending turns and stop the writer thread (registered with atexit).
+        """
+        if self._thread is None or self._pid != os.getpid():
+            return
+        self.flush(timeout)
+        self._stop.set()
+        self._thread.join(timeout)
+
+    def _run(self) -> None:
+        try:
+            while not self._stop.is_set():
+                batch, barriers = self._collect()
+                if batch:
+                    self._write(batch)
+                for barrier in barriers:
+                    barrier.set()
+        finally:
+            connection.close()
+
+    def _collect(self):
+        """
+        Wait for the first item, then gather up to batch_size turns within flush_interval.
+        Flush barriers end a batch early.
+        """
+        batch, barriers = [], []
+        try:
+            item = self._queue.get(timeout=0.5)
+        except queue.Empty:
+            return batch, barriers
+
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            if isinstance(item, threading.Event):
+                barriers.append(item)
+                break
+            batch.append(item)
+            remaining = deadline - time.monotonic()
+            if len(batch) >= self.batch_size or remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+        return batch, barriers
+
+    def _write(self, batch: list) -> None:
+        from chat.models import Conversation, ConversationHistory
+
+        close_old_connections()
+        try:
+            conversations = dict(
+                Conversation.objects.filter(session_id__in={turn[0] for turn in batch})
+                .values_list("session_id", "id")
+            )
+            rows = []
+            for session_id, user_text, assistant_text, request_at, answered_at, _ in batch:
+                if session_id not in conversations:
+                    logger.error(f"Dropping turn for unknown conversation {session_id}")
+                    continue
+                rows.append(ConversationHistory(
+                    conversation_id=conversations[session_id],
+                    user_text=user_text,
+                    assistant_text=assistant_text,
+                    request_at=request_at,
+                    response_at=answered_at,
+                ))
+            with transaction.atomic():
+                ConversationHistory.objects.bulk_create(rows)
+            self._count("written", len(rows))
+            self._count("batches")
+        except DatabaseError as e:
+            self._count("failed", len(batch))
+            logger.error(f"Failed to write {len(batch)} conversation turns: {e}")
+        finally:
+            for turn in batch:
+                if turn[5] is not None:
+                    turn[5]()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        return {
+            "mode": settings.CHAT_PERSISTENCE_MODE,
+            "pending": self._queue.qsize(),
+            "queued": stats.get("queued", 0),
+            "written": stats.get("written", 0),
+            "batches": stats.get("batches", 0),
+            "failed": stats.get("failed", 0),
+            "queue_full": stats.get("queue_full", 0),
+        }
+
+
+def write_behind() -> bool:
+    return settings.CHAT_PERSISTENCE_MODE == PERSISTENCE_WRITE_BEHIND
+
+
+turn_writer = TurnWriter(
+    max_queue=settings.CHAT_PERSISTENCE_QUEUE_SIZE,
+    batch_size=settings.CHAT_PERSISTENCE_BATCH_SIZE,
+    flush_interval=settings.CHAT_PERSISTENCE_FLUSH_INTERVAL,
+)
+atexit.register(turn_writer.close)
@@ -1,12 +1,29 @@
 from rest_framework.views import APIView
-from chat.utils.chatbot import text_pipeline_session
+from django.http import StreamingHttpResponse, JsonResponse, HttpResponse
+from django.views import View
+from asgiref.sync import sync_to_async
+from chat.utils.chatbot import text_pipeline_session, stream_pipeline_session, atext_pipeline_session
+from chat.utils.streaming import sse_event
+from chat.utils.lifecycle import lifecycle
+from chat.utils.metrics import registry, timed
+from chat.utils import profiler
 from .models import ClientUser, Conversation, ConversationHistory
 from datetime import datetime, timedelta
 import json
 import re
+import logging
+import ipaddress
 from rest_framework.response import Response
 from rest_framework import status
+from rest_framework.permissions import AllowAny, BasePermission
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from django.conf import settings
+from rest_framework.exceptions import APIException
 
+logger = logging.getLogger(__name__)
+
+@timed("clean_response")
 def clean_response(response_text: str) -> str:
     """
     Cleans the raw Gemini response by:
@@ -29,21 +46,54 @@ def clean_response(response_text: str) -> str:
         return json.dumps({"answer": response_text.strip()}, ensure_ascii=False)
 
 
+def chat_request_error(data):
+    """
+    Checks the client fields shared by the chat endpoints.
+    Returns an error message, or None if the request may proceed.
+    """
+    if not data.get('client_id'):
+        return "Missing Mandatory field client"
+
+    if data.get('client_id') not in [1]:
+        return "Invalid client, you do not have access to Assistant"
+
+    return None
+
+
+def validate_chat_request(request):
+    """
+    DRF wrapper around chat_request_error.
+    Returns an error Response, or None if the request may proceed.
+    """
+    error = chat_request_error(request.data)
+    if error:
+        return Response({"error": error}, status=status.HTTP_400_BAD_REQUEST)
+
+    return None
+
+
 class ChatAPIView(APIView):
     """
     POST endpoint for handling chat queries to the Mobile Dairy Assistant.
     Required fields: client_id, client_user_id, query
+    Staff can send "X-Profile: 1" (or ?profile=1) to store a profile of the request.
     """
 
     def post(self, request):
-        if not request.data.get('client_id'):
-            return Response({"error": "Missing Mandatory field client"}, status=status.HTTP_400_BAD_REQUEST)
+        error = validate_chat_request(request)
+        if error:
+            return error
 
-        if request.data.get('client_id') not in [1]:
-            return Response({"error": "Invalid client, you do not have access to Assistant"}, status=status.HTTP_400_BAD_REQUEST)
+        if profiler.should_profile(request):
+            return profiler.capture(request, self.answer, client_user_id=request.data.get('client_user_id'))
+        return self.answer(request)
 
+    def answer(self, request):
+        """
+        Runs the chat pipeline for a validated request.
+        """
         data = request.data
-        print("Received data:", data)  # Debug logging (optional)
+        logger.debug(f"Chat request for client_user_id={data.get('client_user_id')}")
 
         client_user_id = data.get('client_user_id')
         client_user_name = data.get('client_user_name', 'ClientUser')
@@ -66,6 +116,98 @@ class ChatAPIView(APIView):
         })
 
 
+class ChatStreamAPIView(APIView):
+    """
+    POST endpoint streaming the assistant's reply as Server-Sent Events.
+    Same fields as ChatAPIView. Emits:
+      - "meta":  {"responseType": ...} once the response type is known
+      - "delta": {"answer": ...} incremental answer text (basic responses only)
+      - "final": the same body ChatAPIView returns, after the turn has been saved
+    """
+
+    def post(self, request):
+        error = validate_chat_request(request)
+        if error:
+            return error
+
+        data = request.data
+        client_user_id = data.get('client_user_id')
+        client_user_name = data.get('client_user_name', 'ClientUser')
+        client_id = data.get('client_id')
+
+        def event_stream():
+            for event, payload in stream_pipeline_session(
+                user_text=data['query'],
+                client_user_id=client_user_id,
+                profile_update={"name": client_user_name}
+            ):
+                if event == "final":
+                    payload = {
+                        "response": json.loads(clean_response(payload)),
+                        "Client": client_id,
+                        "client_user_id": client_user_id
+                    }
+                yield sse_event(event, payload)
+
+        response = StreamingHttpResponse(event_stream(), content_type="text/event-stream")
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"  # Disable proxy buffering (nginx)
+        return response
+
+
+@sync_to_async
+def authenticate_and_parse(request):
+    """
+    Run the configured DRF authenticators and parsers for a plain Django request.
+    Returns (user or None, data).
+    """
+    drf_request = Request(request, authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+    user = drf_request.user
+    if not (user and user.is_authenticated):
+        return None, {}
+    return user, drf_request.data
+
+
+class AsyncChatAPIView(View):
+    """
+    Async POST endpoint (served natively under ASGI) with the same contract as ChatAPIView.
+    The request holds no worker thread while waiting on Gemini: the pipeline uses the async
+    Gemini client and async ORM, and runs retrieval on a bounded thread pool.
+    """
+
+    async def post(self, request):
+        try:
+            user, data = await authenticate_and_parse(request)
+        except APIException as e:
+            return JsonResponse({"detail": str(e.detail)}, status=e.status_code)
+        if user is None:
+            return JsonResponse(
+                {"detail": "Authentication credentials were not provided."},
+                status=status.HTTP_401_UNAUTHORIZED
+            )
+
+        error = chat_request_error(data)
+        if error:
+            return JsonResponse({"error": error}, status=status.HTTP_400_BAD_REQUEST)
+
+        client_user_id = data.get('client_user_id')
+        client_user_name = data.get('client_user_name', 'ClientUser')
+        client_id = data.get('client_id')
+
+        # Pass query to the async processing pipeline
+        response_text = await atext_pipeline_session(
+            user_text=data['query'],
+            client_user_id=client_user_id,
+            profile_update={"name": client_user_name}
+        )
+
+        return JsonResponse({
+            "response": json.loads(clean_response(response_text)),
+            "Client": client_id,
+            "client_user_id": client_user_id
+        }, json_dumps_params={"ensure_ascii": False})
+
+
 class ConversationHistoryAPIView(APIView):
     """
     POST endpoint to retrieve historical conversation logs.
@@ -136,3 +278,46 @@ class ConversationHistoryAPIView(APIView):
             "client_user_name": client_user.name,
             "history": history_data
         }, status=status.HTTP_200_OK)
+
+
+class ReadinessAPIView(APIView):
+    """
+    GET endpoint for orchestrator readiness probes.
+    Returns 200 once the retrieval index is loaded and the warm-up query has run, 503 otherwise.
+    """
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        payload = lifecycle.status()
+        code = status.HTTP_200_OK if lifecycle.is_ready else status.HTTP_503_SERVICE_UNAVAILABLE
+        return Response(payload, status=code)
+
+
+class MetricsPermission(BasePermission):
+    """
+    Metrics are readable by staff users and by scrapers connecting from a network in
+    METRICS_ALLOWED_IPS (matched on REMOTE_ADDR; X-Forwarded-For is not trusted).
+    """
+
+    def has_permission(self, request, view):
+        user = request.user
+        if user and user.is_authenticated and user.is_staff:
+            return True
+        try:
+            address = ipaddress.ip_address(request.META.get("REMOTE_ADDR", ""))
+        except ValueError:
+            return False
+        return any(address in ipaddress.ip_network(net, strict=False) for net in settings.METRICS_ALLOWED_IPS)
+
+
+class MetricsAPIView(APIView):
+    """
+    GET endpoint exposing this process's metrics in the Prometheus text format.
+    Under gunicorn every worker keeps its own counters, so a scrape returns the values
+    of whichever worker served it.
+    """
+    permission_classes = [MetricsPermission]
+
+    def get(self, request):
+        return HttpResponse(registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
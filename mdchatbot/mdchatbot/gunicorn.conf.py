@@ -0,0 +1,71 @@
+"""
+Production serving config:  gunicorn -c mdchatbot/gunicorn.conf.py mdchatbot.wsgi
+(ASGI: add GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker and serve mdchatbot.asgi)
+
+The app is preloaded in the master, which loads the retrieval stack (embedding model,
+FAISS index, BM25 index, documents) once before forking, so workers share those pages
+copy-on-write instead of each building its own copy. With FAISS_MMAP the index vectors
+are memory-mapped from the snapshot and shared through the page cache.
+
+Sizing (override with environment variables):
+  GUNICORN_WORKERS       worker processes (default: CPU count)
+  GUNICORN_THREADS       threads per worker, for requests waiting on Gemini (default: 4)
+  GUNICORN_TORCH_THREADS torch/BLAS/ONNX Runtime threads per worker (default: CPU count // workers)
+"""
+import gc
+import os
+
+cpu_count = os.cpu_count() or 1
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("GUNICORN_WORKERS", cpu_count))
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+preload_app = True
+# Above GEMINI_TIMEOUT plus retries, so slow upstream calls are not killed mid-request
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 120))
+graceful_timeout = 30
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 0))
+max_requests_jitter = max_requests // 10
+accesslog = "-"
+
+torch_threads = int(os.environ.get("GUNICORN_TORCH_THREADS", max(1, cpu_count // max(workers, 1))))
+
+# Must be set before torch / numpy are imported (the app is imported after this file)
+for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+    os.environ.setdefault(var, str(torch_threads))
+os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+
+
+def when_ready(server):
+    """
+    Runs in the master after the app is loaded and before workers are forked.
+    """
+    from django.db import connections
+    from chat.utils.lifecycle import lifecycle
+
+    if lifecycle.ensure_ready():
+        server.log.info("Retrieval stack loaded in the master; workers will share it")
+    else:
+        server.log.warning(f"Retrieval stack failed to load in the master: {lifecycle.error}")
+
+    # Never hand an open DB connection to the workers
+    connections.close_all()
+
+    # Move everything allocated so far out of the GC's reach, so collections in the
+    # workers do not touch (and un-share) the preloaded objects
+    gc.collect()
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    from chat.utils.lifecycle import lifecycle
+
+    try:
+        import torch
+
+        torch.set_num_threads(torch_threads)
+    except ImportError:
+        pass
+
+    lifecycle.after_fork()
@@ -42,6 +42,7 @@ INSTALLED_APPS = [
 
 # ✅ Middleware stack
 MIDDLEWARE = [
+    "chat.middleware.RequestMetricsMiddleware",  # ✅ Request ID, per-request spans and metrics
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -121,6 +122,15 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": os.environ.get("DJANGO_DB_PATH", BASE_DIR / "db.sqlite3"),
+        # Gunicorn workers share this file: WAL lets reads run during a write, writers wait
+        # up to `timeout` seconds for the lock instead of failing with "database is locked",
+        # and IMMEDIATE transactions take the write lock up front (a read transaction that
+        # later writes cannot wait for it). Use a server database for heavy write loads.
+        "OPTIONS": {
+            "timeout": config("SQLITE_TIMEOUT", default=20, cast=int),
+            "init_command": "PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;",
+            "transaction_mode": "IMMEDIATE",
+        },
     }
 }
 
@@ -147,6 +157,113 @@ STATIC_ROOT = os.path.join(PROJECT_DIR, 'static')
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 # ✅ Gemini + Document Paths
-PDF_DATA_PATH = os.path.join(BASE_DIR, "data", "Mobile_Dairy_Customer.pdf")
+PDF_DATA_DIR = config("PDF_DATA_DIR", default=os.path.join(BASE_DIR, "data"))  # Every *.pdf in it is indexed
 JSON_DATA_PATH = os.path.join(BASE_DIR, "data", "MobileDairyChat-New Format.json")
+# Persisted FAISS/BM25 snapshots, keyed by a hash of the sources and index parameters
+VECTOR_INDEX_DIR = config("VECTOR_INDEX_DIR", default=os.path.join(BASE_DIR, "data", "index"))
+FAISS_MMAP = config("FAISS_MMAP", default=True, cast=bool)  # Memory-map snapshot vectors (shared page cache)
 GEMINI_API_KEY = config('GEMINI_API_KEY')  # 🚨 Consider using env vars
+
+# ✅ Ingestion (index rebuilds: PDF pages parsed in a process pool, chunks embedded in batches)
+INGEST_WORKERS = config("INGEST_WORKERS", default=0, cast=int)  # Parser processes (0 = CPU count, 1 = in-process)
+INGEST_PAGES_PER_TASK = config("INGEST_PAGES_PER_TASK", default=8, cast=int)  # PDF pages per parser task
+INGEST_EMBED_BATCH_SIZE = config("INGEST_EMBED_BATCH_SIZE", default=64, cast=int)  # Chunks per embedding call / FAISS add
+
+# ✅ Embedding backend ("torch" = sentence-transformers, "onnx" = ONNX Runtime export from
+#    `python manage.py export_onnx_embeddings`; compare with `python manage.py benchmark_embeddings`)
+EMBEDDING_BACKEND = config("EMBEDDING_BACKEND", default="torch")
+EMBEDDING_ONNX_DIR = config("EMBEDDING_ONNX_DIR", default=os.path.join(BASE_DIR, "data", "models", "all-MiniLM-L6-v2-onnx"))
+EMBEDDING_ONNX_QUANTIZED = config("EMBEDDING_ONNX_QUANTIZED", default=False, cast=bool)  # int8 weights (own snapshot)
+EMBEDDING_ONNX_THREADS = config("EMBEDDING_ONNX_THREADS", default=0, cast=int)  # 0 = OMP_NUM_THREADS or ORT default
+
+# ✅ Embedding sidecar (one model per host, run with `python manage.py embedding_server`)
+EMBEDDING_SIDECAR = config("EMBEDDING_SIDECAR", default=False, cast=bool)  # Workers embed through the sidecar
+EMBEDDING_SOCKET_PATH = config("EMBEDDING_SOCKET_PATH", default=os.path.join(BASE_DIR, "data", "run", "embeddings.sock"))
+EMBEDDING_BATCH_WINDOW_MS = config("EMBEDDING_BATCH_WINDOW_MS", default=5, cast=float)  # Micro-batch collection window
+EMBEDDING_MAX_BATCH = config("EMBEDDING_MAX_BATCH", default=64, cast=int)  # Texts per forward pass
+EMBEDDING_SIDECAR_TIMEOUT = config("EMBEDDING_SIDECAR_TIMEOUT", default=2.0, cast=float)  # Seconds per sidecar query
+EMBEDDING_SIDECAR_BULK_TIMEOUT = config("EMBEDDING_SIDECAR_BULK_TIMEOUT", default=120.0, cast=float)  # Seconds per embed_documents call (index builds)
+EMBEDDING_SIDECAR_RETRY_INTERVAL = config("EMBEDDING_SIDECAR_RETRY_INTERVAL", default=5.0, cast=float)  # Seconds in-process after a failure
+
+# ✅ Chat stack lifecycle
+CHAT_WARMUP_ON_STARTUP = config("CHAT_WARMUP_ON_STARTUP", default=True, cast=bool)  # Warm index/model in background
+CHAT_READY_TIMEOUT = config("CHAT_READY_TIMEOUT", default=120, cast=float)  # Seconds a request waits for warm-up
+CHAT_INIT_RETRY_BACKOFF = config("CHAT_INIT_RETRY_BACKOFF", default=30, cast=float)  # Seconds before retrying a failed warm-up
+
+# ✅ Generation context
+# "stateless": each call sends the system instruction, the last CHAT_HISTORY_TURNS exchanges
+# and only the current turn's retrieved context. "chat": one long-lived Gemini chat per user.
+GEMINI_GENERATION_MODE = config("GEMINI_GENERATION_MODE", default="stateless")
+CHAT_HISTORY_TURNS = config("CHAT_HISTORY_TURNS", default=5, cast=int)  # Exchanges kept in memory/prompt
+CHAT_HISTORY_CACHE_TTL = config("CHAT_HISTORY_CACHE_TTL", default=300, cast=float)  # Seconds per history buffer (0 = always read DB)
+
+# ✅ Session store (in-process per-user chat sessions)
+SESSION_SHARDS = config("SESSION_SHARDS", default=16, cast=int)  # Independently locked shards
+SESSION_MAX_ENTRIES = config("SESSION_MAX_ENTRIES", default=10000, cast=int)  # LRU cap across shards (0 = no cap)
+SESSION_IDLE_TIMEOUT = config("SESSION_IDLE_TIMEOUT", default=7200, cast=float)  # Seconds before a session is purged
+SESSION_REAP_INTERVAL = config("SESSION_REAP_INTERVAL", default=60, cast=float)  # Seconds between reaper passes
+# "database": session_id/profile are shared by all workers and survive restarts (ChatSessionState
+# table); "memory": process-local sessions (single worker, tests)
+SESSION_BACKEND = config("SESSION_BACKEND", default="database")
+SESSION_SYNC_INTERVAL = config("SESSION_SYNC_INTERVAL", default=60, cast=float)  # Max seconds between keep-alive writes of unchanged shared state
+
+# ✅ Identity cache (ClientUser / Conversation primary keys known to this process)
+IDENTITY_CACHE_SIZE = config("IDENTITY_CACHE_SIZE", default=10000, cast=int)  # Entries per map (0 disables)
+
+# ✅ Turn persistence
+# "write_behind": turns are queued and bulk-inserted by a background thread (flushed at exit;
+# a crash loses at most the queued turns). "sync": each turn is written on the request path.
+CHAT_PERSISTENCE_MODE = config("CHAT_PERSISTENCE_MODE", default="write_behind")
+CHAT_PERSISTENCE_QUEUE_SIZE = config("CHAT_PERSISTENCE_QUEUE_SIZE", default=1000, cast=int)  # Full queue = sync write
+CHAT_PERSISTENCE_BATCH_SIZE = config("CHAT_PERSISTENCE_BATCH_SIZE", default=50, cast=int)  # Rows per transaction
+CHAT_PERSISTENCE_FLUSH_INTERVAL = config("CHAT_PERSISTENCE_FLUSH_INTERVAL", default=0.5, cast=float)  # Max seconds a turn waits
+
+# ✅ Outbound LLM gateway (per-process cap on concurrent Gemini calls)
+LLM_MAX_CONCURRENCY = config("LLM_MAX_CONCURRENCY", default=8, cast=int)
+LLM_QUEUE_TIMEOUT = config("LLM_QUEUE_TIMEOUT", default=10, cast=float)  # Seconds a call may wait for a slot
+
+# ✅ Gemini resilience (timeouts, retries, hedging, circuit breaker)
+GEMINI_TIMEOUT = config("GEMINI_TIMEOUT", default=30, cast=float)  # Seconds per generation attempt
+GEMINI_REWRITE_TIMEOUT = config("GEMINI_REWRITE_TIMEOUT", default=5, cast=float)  # Seconds per rewrite attempt
+GEMINI_MAX_ATTEMPTS = config("GEMINI_MAX_ATTEMPTS", default=3, cast=int)  # Retries only on 408/429/5xx/timeouts
+GEMINI_BACKOFF_BASE = config("GEMINI_BACKOFF_BASE", default=0.5, cast=float)  # Full-jitter exponential backoff
+GEMINI_BACKOFF_MAX = config("GEMINI_BACKOFF_MAX", default=4, cast=float)
+GEMINI_HEDGE_PERCENTILE = config("GEMINI_HEDGE_PERCENTILE", default=0, cast=float)  # e.g. 95; 0 disables hedging
+GEMINI_HEDGE_MIN_SAMPLES = config("GEMINI_HEDGE_MIN_SAMPLES", default=50, cast=int)  # Latency samples before hedging
+GEMINI_CIRCUIT_FAILURES = config("GEMINI_CIRCUIT_FAILURES", default=5, cast=int)  # Consecutive failures to open
+GEMINI_CIRCUIT_RESET_TIMEOUT = config("GEMINI_CIRCUIT_RESET_TIMEOUT", default=30, cast=float)  # Seconds before a probe
+GEMINI_CALL_WORKERS = config("GEMINI_CALL_WORKERS", default=32, cast=int)  # Threads running sync Gemini attempts
+
+# ✅ Hybrid retrieval (FAISS + BM25 fusion)
+RETRIEVAL_FUSION = config("RETRIEVAL_FUSION", default="rrf")  # "rrf" or "weighted"
+RETRIEVAL_WEIGHTS = config("RETRIEVAL_WEIGHTS", default="0.7,0.3", cast=Csv(float))  # vector, keyword
+RETRIEVAL_TOP_K = config("RETRIEVAL_TOP_K", default=4, cast=int)  # Max chunks sent to Gemini
+RETRIEVAL_CANDIDATE_K = config("RETRIEVAL_CANDIDATE_K", default=20, cast=int)  # Candidates pulled per index
+RETRIEVAL_MIN_SCORE = config("RETRIEVAL_MIN_SCORE", default=0.0, cast=float)  # Absolute fused-score cut-off
+RETRIEVAL_ADAPTIVE_RATIO = config("RETRIEVAL_ADAPTIVE_RATIO", default=0.0, cast=float)  # Keep scores >= ratio * best
+RETRIEVAL_CACHE_SIZE = config("RETRIEVAL_CACHE_SIZE", default=2048, cast=int)  # Cached queries (0 disables)
+RETRIEVAL_CACHE_TTL = config("RETRIEVAL_CACHE_TTL", default=3600, cast=float)  # Seconds per cached query
+
+# ✅ Local rewrite gate (skips the Gemini rewrite for standalone questions)
+REWRITE_GATE_ENABLED = config("REWRITE_GATE_ENABLED", default=True, cast=bool)
+REWRITE_GATE_SHORT_TOKENS = config("REWRITE_GATE_SHORT_TOKENS", default=3, cast=int)  # Shorter messages treated as ellipsis
+REWRITE_GATE_TOPIC_SIMILARITY = config("REWRITE_GATE_TOPIC_SIMILARITY", default=0.35, cast=float)  # Below = new topic
+
+# ✅ Speculative retrieval (retrieve the raw text while the rewrite is in flight)
+SPECULATIVE_RETRIEVAL = config("SPECULATIVE_RETRIEVAL", default=True, cast=bool)
+SPECULATIVE_REUSE_SIMILARITY = config("SPECULATIVE_REUSE_SIMILARITY", default=0.95, cast=float)  # Reuse if rewrite is this close
+RETRIEVAL_WORKERS = config("RETRIEVAL_WORKERS", default=4, cast=int)  # Threads in the shared retrieval pool
+
+# ✅ Semantic answer cache (opt-in; SQLite file shared by all workers on the host)
+SEMANTIC_CACHE_ENABLED = config("SEMANTIC_CACHE_ENABLED", default=False, cast=bool)
+SEMANTIC_CACHE_PATH = config("SEMANTIC_CACHE_PATH", default=os.path.join(BASE_DIR, "data", "cache", "answers.sqlite3"))
+SEMANTIC_CACHE_THRESHOLD = config("SEMANTIC_CACHE_THRESHOLD", default=0.92, cast=float)  # Min cosine similarity
+SEMANTIC_CACHE_MAX_ENTRIES = config("SEMANTIC_CACHE_MAX_ENTRIES", default=5000, cast=int)
+SEMANTIC_CACHE_TTL = config("SEMANTIC_CACHE_TTL", default=7 * 24 * 3600, cast=float)  # Seconds
+
+# ✅ Metrics endpoint (staff users, or scrapers from these addresses/networks; values are per process)
+METRICS_ALLOWED_IPS = config("METRICS_ALLOWED_IPS", default="127.0.0.1,::1", cast=Csv())
+
+# ✅ Per-request profiling (staff only; send "X-Profile: 1" or ?profile=1 to /api/chat/)
+REQUEST_PROFILING_ENABLED = config("REQUEST_PROFILING_ENABLED", default=True, cast=bool)
+REQUEST_PROFILING_INTERVAL_MS = config("REQUEST_PROFILING_INTERVAL_MS", default=5, cast=float)  # Sampling interval
@@ -18,6 +18,7 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 from authentication.views import CustomObtainAuthTokenViewSet
+from chat.views import ReadinessAPIView, MetricsAPIView
 
 urlpatterns = [
     # Django admin panel route (for managing users, models, etc.)
@@ -28,4 +29,10 @@ urlpatterns = [
 
     # Endpoint to obtain authentication token (likely for login)
     path('api/auth_token/', CustomObtainAuthTokenViewSet.as_view(), name='auth_token'),
+
+    # Readiness probe: 200 only once the retrieval stack is warm
+    path('healthz/ready', ReadinessAPIView.as_view(), name='healthz-ready'),
+
+    # Prometheus-style metrics (stage latency histograms, cache/error counters)
+    path('metrics', MetricsAPIView.as_view(), name='metrics'),
 ]